@@ -11,21 +11,21 @@ from __future__ import absolute_import, print_function
 
 import compiler
 from compiler.ast import Module, Node, Stmt
-from traceback import format_exc
 import types
 from uuid import UUID, uuid4
 
-from six import exec_
-
-from traits.api import (Bool, Dict, Either, HasTraits,
-                                  Instance, List, Property, Str,
+from traits.api import (Any, Bool, Dict, Either, HasTraits,
+                                  Instance, Int, List, Property, Str,
                                   cached_property, Event)
 
-from ..util.dict import map_keys, map_values
-from ..util import graph
+from ..util.cache import LRUCache
 from ..util.sequence import is_sequence
 
 from .analysis import NameFinder
+from .block_cache import get_block_cache, rename_code, shift_code
+from .dependency_index import DependencyIndex
+from .restriction import RestrictionGraph
+from .sub_block import SubBlock, analyze
 from .compiler_.api import compile_ast, parse
 from .parser_ import BlockTransformer
 from .compiler_unparse import unparse
@@ -44,6 +44,9 @@ class CompositeException(Exception):
     def __init__(self, exceptions):
         self.exceptions = exceptions
 
+class ExecutionCancelled(Exception):
+    """Raised when an execution stops because it was cancelled"""
+
 class ShadowDict(dict):
     """ Dictionary whose writes (via indexing) are also saved in a shadow
     dictionary.
@@ -83,8 +86,9 @@ class Block(HasTraits):
     imports_ast = Property(Instance(Node))
 
     # The sequence of sub-blocks that make up this block, if any. If we don't
-    # decompose into sub-blocks, 'sub_blocks' is None.
-    sub_blocks = List(__this)
+    # decompose into sub-blocks, 'sub_blocks' is None. The statements parsed
+    # into a block are 'SubBlock's (see 'codetools.blocks.sub_block').
+    sub_blocks = List(Either(__this, Instance(SubBlock)))
 
     # The AST that represents our behavior
     ast = Instance(Node)
@@ -108,6 +112,31 @@ class Block(HasTraits):
     # Is this block the result of merging other blocks?
     grouped = Bool(False)
 
+    # Enabling this updates '_dep_graph', 'inputs', 'outputs' and
+    # 'conditional_outputs' in place when 'sub_blocks' is edited (append,
+    # insert, remove, replace) instead of recomputing them from scratch, and
+    # only drops the cached restrictions that the edit can affect.
+    incremental = Bool(False)
+
+    # Enabling this decomposes 'if' and 'for' statements into finer
+    # sub-blocks where it's safe, so that 'restrict' can prune within them
+    # (see 'codetools.blocks.decomposition'). It applies when 'ast' is set,
+    # e.g. by passing it to the constructor.
+    decompose_compound_statements = Bool(False)
+
+    # Bounds for the cache of restrictions: the number of restricted blocks it
+    # holds, and the total number of statements in them (a proxy for their
+    # memory). The least recently used restrictions are evicted first. None
+    # means unbounded. 'restriction_cache_size' also bounds the cache of
+    # functions made by 'get_function'.
+    restriction_cache_size = Either(None, Int, default=256)
+    restriction_cache_max_statements = Either(None, Int)
+
+    # Usage counters for the cache of restrictions
+    restriction_cache_hits = Property(Int)
+    restriction_cache_misses = Property(Int)
+    restriction_cache_evictions = Property(Int)
+
     ### Protected traits #####################################################
 
     # The dependency graph for 'sub_blocks', if they exist. If we don't
@@ -119,9 +148,25 @@ class Block(HasTraits):
     __dep_graph = Either(Dict, None)
     __dep_graph_is_valid = Bool(False)
 
+    # Maintains '_dep_graph' when 'incremental' is enabled, and answers the
+    # name queries ('readers', 'writers', 'last_writer'). Built lazily, and
+    # updated in place by 'sub_blocks' edits once built.
+    _name_index = Property(Instance(DependencyIndex))
+    _dependency_index = Instance(DependencyIndex, transient=True)
+
+    # '_dep_graph' numbered for bitset reachability in 'restrict'. Built
+    # lazily and dropped whenever '_dep_graph' changes.
+    _restriction_graph = Property(Instance(RestrictionGraph))
+    __restriction_graph = Instance(RestrictionGraph, transient=True)
+
     _code = Property(depends_on='_code_invalidated, ast')
     _code_invalidated = Event()
 
+    # The compiled plan that 'execute' runs. Built lazily and dropped
+    # whenever '_code' or a filename changes.
+    _execution_plan = Property
+    __execution_plan = Any(transient=True)
+
 
     # Flag to break call cycles when we update 'ast' and 'sub_blocks'
     _updating_structure = Bool(False)
@@ -129,7 +174,12 @@ class Block(HasTraits):
     codestring = Property
     _stored_string = Str('')
     # A cache for block restrictions. Invalidates when structure changes.
-    __restrictions = Dict
+    _restriction_cache = Property(Instance(LRUCache))
+    __restriction_cache = Instance(LRUCache, transient=True)
+    # The functions made by 'get_function', by signature. Invalidates when
+    # structure changes.
+    _function_cache = Property(Instance(LRUCache))
+    __function_cache = Instance(LRUCache, transient=True)
 
     ###########################################################################
     # object interface
@@ -165,9 +215,15 @@ class Block(HasTraits):
             x = x.read()
 
         # 'x' -> 'self.ast' or 'self.sub_blocks'
+        cache = entry = None
         if isinstance(x, basestring):
-            # (BlockTransformer handles things like 'import *')
-            self.ast = parse(x, mode='exec', transformer=BlockTransformer())
+            cache = get_block_cache()
+            if cache is not None:
+                entry = cache.load(x, self._cache_options())
+            if entry is None:
+                # (BlockTransformer handles things like 'import *')
+                self.ast = parse(x, mode='exec',
+                                 transformer=BlockTransformer())
             self._stored_string = x
         elif isinstance(x, Node):
             # push an exception handler onto the stack to ensure that the calling function gets the error
@@ -203,6 +259,11 @@ class Block(HasTraits):
         # Set flag whether this is a grouped block or not
         self.grouped = grouped
 
+        if entry is not None:
+            cache.restore(self, entry)
+        elif cache is not None:
+            cache.store(self, x, self._cache_options())
+
     def __eq__(self, other):
         return type(self) == type(other) and self.uuid == other.uuid
 
@@ -226,6 +287,9 @@ class Block(HasTraits):
 
         version = state.pop('_Block_version', 0)
 
+        # Restrictions used to be pickled with the block
+        state.pop('_Block__restrictions', None)
+
         if version < 1:
             if state.has_key('inputs'):
                  state['_inputs'] = state.pop('inputs')
@@ -254,10 +318,10 @@ class Block(HasTraits):
         """
         print("--------------------------------------")
         for k in graph.keys():
-            if isinstance(k, Block):
+            if isinstance(k, (Block, SubBlock)):
                 print(k.ast)
                 for dep in graph[k]:
-                    if isinstance(dep, Block):
+                    if isinstance(dep, (Block, SubBlock)):
                         print("    %s" % dep.ast)
                     else:
                         print("    '%s'" % dep[0])
@@ -281,44 +345,102 @@ class Block(HasTraits):
         return isinstance(self.ast, Stmt) and len(self.ast.nodes) == 0
 
 
-    def execute(self, local_context, global_context = {}, continue_on_errors=False):
+    def execute(self, local_context, global_context = {}, continue_on_errors=False,
+                cancelled=None):
         """Execute the block in local_context, optionally specifying a global
         context.  If continue_on_errors is specified, continue executing code after
         an exception is thrown and throw the exceptions at the end of execution.
-        if more than one exception was thrown, combine them in a CompositeException"""
-        # To get tracebacks to show the right filename for any line in any
-        # sub-block, we need each sub-block to compile its own '_code' since a
-        # code object only keeps one filename. This is slow, so we give the
-        # user the option 'no_filenames_in_tracebacks' to gain speed but lose
-        # readability of tracebacks.
+        if more than one exception was thrown, combine them in a CompositeException
 
-
-        if (len(self.sub_blocks) == 0 or self.no_filenames_in_tracebacks) and \
-               not continue_on_errors:
-            if self.filename:
-                local_context['__file__'] = self.filename
-            exec_(self._code, global_context, local_context)
-        else:
-            if continue_on_errors:
-                exceptions = []
-                for block in self.sub_blocks:
-                    try:
-                        block.execute(local_context, global_context)
-                    except Exception as e:
-                        # save the current traceback
-                        e.traceback = format_exc()
-                        exceptions.append(e)
-                if exceptions:
-                    if len(exceptions)>1:
-                        raise CompositeException(exceptions)
-                    else:
-                        raise exceptions[0]
-
-            else:
-                for block in self.sub_blocks:
-                    block.execute(local_context, global_context)
+        If 'cancelled' is given, it is called before each sub-block, and the
+        execution stops with an ExecutionCancelled exception when it returns
+        True. Whatever the sub-blocks already executed wrote into
+        local_context stays there."""
+        # To get tracebacks to show the right filename for any line in any
+        # sub-block, each run of sub-blocks from the same file is compiled
+        # into its own code object, since a code object only keeps one
+        # filename. The execution plan runs them all from a single 'exec';
+        # 'no_filenames_in_tracebacks' compiles the whole block into one code
+        # object instead.
+        self._execution_plan.execute(local_context, global_context,
+                                     continue_on_errors, cancelled)
         return
 
+    def execute_parallel(self, local_context, global_context={},
+                         continue_on_errors=False, executor=None):
+        """Execute the block like 'execute', but run independent sub-blocks
+        concurrently on a 'concurrent.futures' executor (by default, a thread
+        pool with one worker per CPU).
+
+        Each sub-block is submitted as soon as the sub-blocks it depends on
+        have finished. Writes into local_context are made by the calling
+        thread, in source order, and errors are handled as by 'execute'.
+        This pays off when sub-blocks spend their time in code that releases
+        the GIL (e.g. NumPy), and requires that sub-blocks don't mutate shared
+        objects through method calls; see 'codetools.blocks.parallel'."""
+        if len(self.sub_blocks) == 0:
+            self.execute(local_context, global_context, continue_on_errors)
+            return
+        from .parallel import execute_parallel
+        execute_parallel(self, local_context, global_context,
+                         continue_on_errors, executor)
+
+    def execute_sweep(self, base_context, varying, outputs=None,
+                      global_context={}, executor=None, chunk_size=None):
+        """Execute the block for every point of a parameter sweep and return
+        a dict mapping each of 'outputs' to a NumPy array of its values.
+
+        'varying' maps names to sequences of the same length; point 'i' sets
+        each name to the 'i'th item of its sequence, over 'base_context'.
+        The sub-blocks that don't depend on the varying names run only once,
+        and the others are compiled into a function called for every point,
+        in chunks on 'executor' if one is given (e.g. a process pool). By
+        default, 'outputs' are the names bound downstream of the varying
+        names. See 'codetools.blocks.sweep'."""
+        from .sweep import execute_sweep
+        return execute_sweep(self, base_context, varying, outputs,
+                             global_context, executor, chunk_size)
+
+    def execute_chunked(self, local_context, outputs=None, out=None,
+                        directory=None, chunk_size=1 << 20,
+                        materialize=False):
+        """Execute the block over chunks of the arrays in local_context, for
+        arrays that don't fit in memory (memmaps, HDF5 datasets, or any
+        object with a 'shape' that can be sliced along its first axis).
+
+        All these arrays must have the same length. The elementwise
+        statements that read them run over 'chunk_size' elements at a time,
+        and the arrays they compute are written chunk by chunk into the
+        arrays of 'out', a dict, or into new memmaps in 'directory' (a
+        temporary directory by default). Statements that read arrays and
+        aren't elementwise, like reductions, raise an UnsafeStatementError,
+        or run over the whole arrays if 'materialize' is True. By default
+        every array computed is written; otherwise only those in 'outputs'
+        and those read later. See 'codetools.blocks.chunked'."""
+        from .chunked import execute_chunked
+        execute_chunked(self, local_context, outputs, out, directory,
+                        chunk_size, materialize)
+
+    def execute_processes(self, local_context, global_context={},
+                          continue_on_errors=False, executor=None,
+                          threshold=1 << 16):
+        """Execute the block like 'execute_parallel', but in worker processes
+        (by default, a 'concurrent.futures' process pool with one process per
+        CPU), for statements that hold the GIL.
+
+        Each sub-block's code object and the values it reads are sent to a
+        worker, and only the names it binds or modifies are merged back into
+        local_context. NumPy arrays of at least 'threshold' bytes go through
+        shared memory instead of being pickled. Other values that cross the
+        process boundary must be picklable; see 'codetools.blocks.processes'.
+        """
+        if len(self.sub_blocks) == 0:
+            self.execute(local_context, global_context, continue_on_errors)
+            return
+        from .processes import execute_processes
+        execute_processes(self, local_context, global_context,
+                          continue_on_errors, executor, threshold)
+
     def execute_impure(self, context, continue_on_errors=False,
                        clean_shadow=True):
         """
@@ -410,6 +532,8 @@ class Block(HasTraits):
             explicit means to invalidating the cached _code object
         """
         self._code_invalidated = True
+        self.__execution_plan = None
+        self.__function_cache = None
 
     def restrict(self, inputs=(), outputs=()):
         ''' The minimal sub-block that computes 'outputs' from 'inputs'.
@@ -440,165 +564,145 @@ class Block(HasTraits):
 
         inputs = set(inputs)
         outputs = set(outputs)
+        self._validate_restriction(inputs, [outputs])
 
         # Look for results in the cache
         cache_key = (frozenset(inputs), frozenset(outputs))
-        if cache_key in self.__restrictions:
-            return self.__restrictions[cache_key]
+        cached = self._restriction_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-        # Validate the method arguments.
-        #
-        # 'inputs' are allowed to be in the block inputs or outputs to allow
-        # for restricting intermidiate inputs.
-        if not (inputs or outputs):
-            raise ValueError('Must provide inputs or outputs')
-        if not inputs.issubset(self.inputs | self.outputs | self.fromimports):
-            raise ValueError('Unknown inputs: %s' % (inputs - self.inputs - self.outputs - self.fromimports))
-        if not outputs.issubset(self.all_outputs):
-            raise ValueError('Unknown outputs: %s' %(outputs-self.all_outputs))
-
-        # Validate the block to make sure it is safe for restriction
-        if self.validate_for_restriction() is not None:
-            raise RuntimeError("Block failed to validate")
+        self._validate_for_restriction()
 
         # If we don't decompose, then we are already as restricted as possible
         if self.sub_blocks is None:
             return self
 
-        # we must keep a list of import blocks. Imports are lost because
-        # they are not reachable during the reversing of the graph
-        import_sub_blocks = []
-        for sub_block in self.sub_blocks:
-            if isinstance(sub_block.ast, compiler.ast.Import) or \
-               isinstance(sub_block.ast, compiler.ast.From):
-                import_sub_blocks.append(sub_block)
+        # look in the outputs for intermediate inputs
+        intermediates = self.outputs.intersection(inputs)
+        inputs = inputs - intermediates
 
-        # We use the mock constructors `In` and `Out` to separate input and
-        # output names in the dep graph in order to avoid cyclic graphs (in
-        # case input and output names overlap)
-        in_, out = object(), object() # (singletons)
-        In = lambda x: (x, in_)
-        Out = lambda x: (x, out)
-
-        def wrap_names(wrap):
-            "Wrap names and leave everything else alone"
-            def g(x):
-                if isinstance(x, basestring):
-                    return wrap(x)
-                else:
-                    return x
-            return g
-
-        # Decorate input names with `In` and output names with `Out` so that
-        # `g` isn't cyclic
-        g = map_keys(wrap_names(Out),
-                map_values(lambda l: map(wrap_names(In), l), self._dep_graph))
-
-        # Find the subgraph reachable from inputs, and then find its subgraph
-        # reachable from outputs. (We could also flip the order.)
-        if inputs:
-            # look in the outputs for intermediate inputs
-            intermediates = map(Out, self.outputs.intersection(inputs))
-            inputs = inputs - self.outputs.intersection(inputs)
-
-            # Find the intermediate's block node and replace it
-            # with the intermediate value. This effectively cuts
-            # the block's children off the tree. This means for
-            # the code "c = a * b; d = c * 3", we are removing c's
-            # dependency on "a" and "b"
-            #
-            # There is a special case which is handled here as well:
-            # for the code "c = a * b; d = c * 3", is the user wants
-            # to restrict the block with 'd' as an input, the result
-            # is an empty sub-block
-            for intermediate in intermediates:
-                pruned_block = g[intermediate][0]
-
-                # its possible someone tried to restrict an import,
-                # which is not in the graph
-                #fixme: uncommenting these breaks pruning intermediates, why is this here?
-#                if not g.has_key(pruned_block):
-#                    intermediates.remove(intermediate)
-#                    continue
-
-                # if intermediate is not removed, the resulting graph will
-                # be cyclic
-                g.pop(intermediate)
-
-                pure_output = True
-                for v in g.values():
-                    if pruned_block in v:
-                        pure_output = False
-                        v.remove(pruned_block)
-                        v.append(intermediate)
-                if pure_output:
-                    # pure outputs must be kept on the graph or else
-                    # they will not be reachable
-                    g[intermediate] = [Block("%s = %s" % \
-                                        (intermediate[0], intermediate[0]))]
-
-            inputs = map(In, inputs) + intermediates
-
-            # if no inputs were valid, do not alter the graph
-            if len(inputs) > 0:
-                g = graph.reverse(graph.reachable_graph(graph.reverse(g), inputs))
-        if outputs:
-            outputs = map(Out, outputs)
-            g = graph.reachable_graph(g, set(outputs).intersection(g.keys()))
+        restricted = self._restriction_graph.restrict(inputs, outputs,
+                                                      intermediates)
+        b = self._restricted_block(restricted, self._import_sub_blocks())
 
-        # Create a new block from the remaining sub-blocks (ordered imports
-        # first, then input to output, ignoring the variables at the ends)
-        # and give it our filename
-        remaining_sub_blocks = [node for node in reversed(graph.topological_sort(g))
-                       if isinstance(node, Block)]
+        # Cache result
+        self._restriction_cache[cache_key] = b
 
-        # trim out redundant imports which can occur if a restricted output is
-        # one of the imports:
-        for sub_block in remaining_sub_blocks:
-            if sub_block in import_sub_blocks:
-                remaining_sub_blocks.remove(sub_block)
+        return b
 
-        b = Block(import_sub_blocks + remaining_sub_blocks)
-        b.filename = self.filename
+    def restrict_many(self, inputs=(), outputs_list=()):
+        ''' The restrictions of the block to 'inputs' and each of the output
+            sets in 'outputs_list', in order.
 
-        # Cache result
-        self.__restrictions[cache_key] = b
+            This is equivalent to calling 'restrict' for each output set, but
+            the sweep from the inputs through the dependency graph is done
+            once, and so is the sweep back from each output name. The results
+            go into the restriction cache like those of 'restrict'.
+        '''
+        inputs = set(inputs)
+        outputs_list = [set(outputs) for outputs in outputs_list]
+        self._validate_restriction(inputs, outputs_list)
 
-        return b
+        # Look for results in the cache
+        results = []
+        missing = []
+        for outputs in outputs_list:
+            cache_key = (frozenset(inputs), frozenset(outputs))
+            cached = self._restriction_cache.get(cache_key)
+            results.append(cached)
+            if cached is None and outputs not in missing:
+                missing.append(outputs)
+        if not missing:
+            return results
+
+        self._validate_for_restriction()
+
+        # If we don't decompose, then we are already as restricted as possible
+        if self.sub_blocks is None:
+            return [self] * len(outputs_list)
+
+        # look in the outputs for intermediate inputs
+        intermediates = self.outputs.intersection(inputs)
+        restricted = self._restriction_graph.restrict_many(
+            inputs - intermediates, missing, intermediates)
+        import_sub_blocks = self._import_sub_blocks()
+
+        computed = {}
+        for outputs, sub_blocks in zip(missing, restricted):
+            b = self._restricted_block(sub_blocks, import_sub_blocks)
+            cache_key = (frozenset(inputs), frozenset(outputs))
+            self._restriction_cache[cache_key] = computed[cache_key] = b
+
+        return [b if b is not None else
+                computed[(frozenset(inputs), frozenset(outputs))]
+                for b, outputs in zip(results, outputs_list)]
 
     def get_function(self, inputs=[], outputs=[]):
         """Return a function which takes the list of input variables
         as arguments and returns the given output_list.
 
         These lists determine the calling order for the function.
+
+        The restricted block is compiled into the body of a Python function,
+        so its names are fast locals. Blocks that can't be the body of a
+        function (see 'codetools.blocks.fast_function') are executed in a
+        namespace instead. Functions are cached for each signature.
         """
         if isinstance(outputs, basestring):
             outputs = [outputs]
         if isinstance(inputs, basestring):
             inputs = [inputs]
+        key = (tuple(inputs), tuple(outputs))
+        function = self._function_cache.get(key)
+        if function is not None:
+            return function
+
+        from .fast_function import compile_function
         block = self.restrict(inputs=inputs, outputs=outputs)
-        # Speed up execution of the block
-        block.no_filenames_in_tracebacks = True
-        leni = len(inputs)
-        leno = len(outputs)
-        def simplefunc(*args):
-            if len(args) != leni:
-                raise ValueError("Must have %d inputs" % leni)
-            namespace = {}
-            for i, arg in enumerate(args):
-                namespace[inputs[i]] = arg
-            block.execute(namespace)
-            if leno == 1:
-                return namespace[outputs[0]]
-            vals = []
-            for name in outputs:
-                vals.append(namespace[name])
-            return tuple(vals)
+        function = compile_function(block, inputs, outputs)
+        if function is None:
+            function = self._namespace_function(block, inputs, outputs)
         callstr = '(%s)'% ','.join(inputs)
         retstr = ','.join(outputs)
-        simplefunc.__doc__ = "%s = <name>%s" % (retstr, callstr)
-        simplefunc._block = block
-        return simplefunc
+        function.__doc__ = "%s = <name>%s" % (retstr, callstr)
+        function._block = block
+        self._function_cache[key] = function
+        return function
+
+    def reparse(self, code):
+        """Return the block for 'code', an edit of the source of this block,
+        reusing the sub-blocks for the unchanged lines (with their analysis
+        and compiled code), along with the list of its new sub-blocks and
+        the set of the names bound by the sub-blocks that were removed.
+
+        Only the edited regions of 'code' are parsed. The sub-blocks reused
+        are moved into the new block, so this block must not be used
+        afterwards. See 'codetools.blocks.reparse'.
+        """
+        from .reparse import reparse
+        return reparse(self, code)
+
+    def readers(self, name):
+        """Return the sub-blocks that read 'name' (or an attribute of it),
+        in execution order.
+        """
+        return self._name_index.readers(name)
+
+    def writers(self, name, conditional=False):
+        """Return the sub-blocks that bind 'name', imports included, in
+        execution order. With 'conditional', also the sub-blocks that may
+        bind it (e.g. in a branch of an 'if').
+        """
+        return self._name_index.writers(name, conditional)
+
+    def last_writer(self, name, before=None):
+        """Return the last sub-block that binds or may bind 'name', or None.
+
+        With 'before', a sub-block, the last one before it: the sub-block
+        whose value of 'name' 'before' reads.
+        """
+        return self._name_index.last_writer(name, before)
 
     def validate_for_restriction(self):
         # Check to ensure that there is not sub_block that has the same
@@ -632,6 +736,8 @@ class Block(HasTraits):
             [self.ast] = self.ast.nodes
 
     def _structure_changed(self, name, new):
+        self.__execution_plan = None
+        self.__function_cache = None
         if not self._updating_structure:
             try:
                 self._updating_structure = True
@@ -641,7 +747,8 @@ class Block(HasTraits):
                     self._tidy_ast()
 
                     # Compute our new sub-blocks and give them our filename
-                    self.sub_blocks = Block._decompose(self.ast)
+                    self.sub_blocks = Block._decompose(
+                        self.ast, self.decompose_compound_statements)
                     if self.sub_blocks is not None:
                         for b in self.sub_blocks:
                             b.filename = self.filename
@@ -655,10 +762,18 @@ class Block(HasTraits):
                 else:
                     assert False
 
+                self._stored_string = ''
+                if name == 'sub_blocks_items' and \
+                       self._splice_dependencies(new):
+                    return
+
                 # Invalidate caches
                 self.__dep_graph_is_valid = False
-                self.__restrictions.clear()
-                self._stored_string = ''
+                self.__restriction_graph = None
+                if name != 'sub_blocks_items' or self.incremental or \
+                       not self._splice_name_index(new):
+                    self._dependency_index = None
+                self._restriction_cache.clear()
 
                 # update inputs and outputs
                 self._clear_cache_inputs_and_outputs()
@@ -666,6 +781,121 @@ class Block(HasTraits):
             finally:
                 self._updating_structure = False
 
+    def _splice_dependencies(self, event):
+        ''' Update the dependency analysis in place for a 'sub_blocks' edit.
+
+            Returns False if the edit can't be applied incrementally, in which
+            case the caller invalidates everything.
+        '''
+        index = self._dependency_index
+        if not self.incremental or index is None or \
+               not isinstance(event.index, int) or \
+               not index.can_splice(event.index, event.removed, event.added):
+            return False
+
+        self.__restriction_graph = None
+        restrictions = self._restriction_cache
+        reach = index.splice(event.index, event.removed, event.added,
+                             reach=len(restrictions) > 0)
+
+        # Imports are part of every restriction, and an invalid block must
+        # make 'restrict' fail, so those edits drop all cached restrictions.
+        # Otherwise a restriction is stale if the edit lies on a path from
+        # its inputs to its outputs (adding paths), or if it binds a name
+        # that the restriction is about or goes through (cutting paths).
+        if restrictions:
+            edited = event.removed + event.added
+            if any(isinstance(b.ast, (compiler.ast.Import, compiler.ast.From))
+                   for b in edited) or \
+                   any(b.validate_for_restriction() is not None
+                       for b in event.added):
+                restrictions.clear()
+            else:
+                upstream, downstream = reach
+                bound = set()
+                for b in edited:
+                    bound |= b.all_outputs | b.fromimports
+                removed = set(event.removed)
+                for key in restrictions.keys():
+                    inputs, outputs = key
+                    if (not inputs or not inputs.isdisjoint(upstream)) and \
+                       (not outputs or not outputs.isdisjoint(downstream)):
+                        del restrictions[key]
+                        continue
+                    if not bound.isdisjoint(inputs | outputs):
+                        del restrictions[key]
+                        continue
+                    restricted = restrictions[key]
+                    names = set(name.split('.', 1)[0]
+                                for name in restricted.inputs)
+                    names |= restricted.all_outputs | restricted.fromimports
+                    if not bound.isdisjoint(names) or any(
+                            b in removed for b in restricted.sub_blocks or ()):
+                        del restrictions[key]
+
+        self._clear_cache_inputs_and_outputs()
+        self._inputs = index.inputs
+        self._outputs = index.outputs
+        self._conditional_outputs = index.conditional_outputs
+        self._fromimports = index.fromimports
+        return True
+
+    def _validate_restriction(self, inputs, outputs_list):
+        ''' Check the arguments of 'restrict'. '''
+        # 'inputs' are allowed to be in the block inputs or outputs to allow
+        # for restricting intermidiate inputs.
+        for outputs in outputs_list:
+            if not (inputs or outputs):
+                raise ValueError('Must provide inputs or outputs')
+            if not outputs.issubset(self.all_outputs):
+                raise ValueError('Unknown outputs: %s' %(outputs-self.all_outputs))
+        if not inputs.issubset(self.inputs | self.outputs | self.fromimports):
+            raise ValueError('Unknown inputs: %s' % (inputs - self.inputs - self.outputs - self.fromimports))
+
+    def _validate_for_restriction(self):
+        ''' Check that the block can be restricted.
+
+            (The cached restrictions were made from a valid block, and the
+            edits that make it invalid clear them, so a cache hit needs no
+            check.)
+        '''
+        if self.validate_for_restriction() is not None:
+            raise RuntimeError("Block failed to validate")
+
+    def _import_sub_blocks(self):
+        # we must keep a list of import blocks. Imports are lost because
+        # they are not reachable during the reversing of the graph
+        if self._dependency_index is not None:
+            return self._dependency_index.imports()
+        import_sub_blocks = []
+        for sub_block in self.sub_blocks:
+            if isinstance(sub_block.ast, compiler.ast.Import) or \
+               isinstance(sub_block.ast, compiler.ast.From):
+                import_sub_blocks.append(sub_block)
+        return import_sub_blocks
+
+    def _restricted_block(self, restricted, import_sub_blocks):
+        # Create a new block from the remaining sub-blocks (ordered imports
+        # first, then input to output) and give it our filename
+        imports = set(import_sub_blocks)
+        remaining_sub_blocks = [sub_block for sub_block in restricted
+                                if sub_block not in imports]
+
+        b = Block(import_sub_blocks + remaining_sub_blocks)
+        b.filename = self.filename
+        return b
+
+    def _splice_name_index(self, event):
+        ''' Update the name index in place for a 'sub_blocks' edit, if it's
+            built. Returns whether it was.
+        '''
+        index = self._dependency_index
+        if index is None or not isinstance(event.index, int) or \
+               not index.can_splice(event.index, event.removed, event.added):
+            return False
+        index.splice(event.index, event.removed, event.added)
+        return True
+
     def _clear_cache_inputs_and_outputs(self):
         self._inputs = None
         self._outputs = None
@@ -678,16 +908,9 @@ class Block(HasTraits):
         if self.ast is None:
             return
 
-        v = compiler.walk(self.ast, NameFinder())
-        self._inputs = set(v.free)
-        self._outputs = set(v.locals)
-        self._conditional_outputs = set(v.conditional_locals)
-        temp = [unparse(x).strip() for x in v.constlist]
-        temp2 = [x.split('=')[0].strip() for x in temp]
-        self._const_assign = (set(temp2), temp)
-        self._fromimports = set(v.fromimports)
-        self._outputs -= self.fromimports
-        self._imports_ast = v.imports
+        (self._inputs, self._outputs, self._conditional_outputs,
+         self._const_assign, self._fromimports, self._imports_ast) = \
+            analyze(self.ast)
 
     def _get_inputs(self):
         if self._inputs is None:
@@ -725,6 +948,77 @@ class Block(HasTraits):
         else:
             return unparse(self.ast)
 
+    def _get_restriction_cache_hits(self):
+        return self._restriction_cache.hits
+
+    def _get_restriction_cache_misses(self):
+        return self._restriction_cache.misses
+
+    def _get_restriction_cache_evictions(self):
+        return self._restriction_cache.evictions
+
+    def _namespace_function(self, block, inputs, outputs):
+        # Speed up execution of the block
+        block.no_filenames_in_tracebacks = True
+        leni = len(inputs)
+        leno = len(outputs)
+        def simplefunc(*args):
+            if len(args) != leni:
+                raise ValueError("Must have %d inputs" % leni)
+            namespace = {}
+            for i, arg in enumerate(args):
+                namespace[inputs[i]] = arg
+            block.execute(namespace)
+            if leno == 1:
+                return namespace[outputs[0]]
+            vals = []
+            for name in outputs:
+                vals.append(namespace[name])
+            return tuple(vals)
+        return simplefunc
+
+    def _get__function_cache(self):
+        if self.__function_cache is None:
+            self.__function_cache = LRUCache(
+                max_size=self.restriction_cache_size)
+        return self.__function_cache
+
+    def _get__restriction_cache(self):
+        if self.__restriction_cache is None:
+            self.__restriction_cache = LRUCache(
+                max_size=self.restriction_cache_size,
+                max_cost=self.restriction_cache_max_statements,
+                cost=lambda block: len(block.sub_blocks))
+        return self.__restriction_cache
+
+    def _restriction_cache_size_changed(self, new):
+        self._restriction_cache.max_size = new
+        self._restriction_cache.trim()
+        self._function_cache.max_size = new
+        self._function_cache.trim()
+
+    def _restriction_cache_max_statements_changed(self, new):
+        self._restriction_cache.max_cost = new
+        self._restriction_cache.trim()
+
+    def _incremental_changed(self):
+        self._dependency_index = None
+        self.__dep_graph_is_valid = False
+        self.__restriction_graph = None
+
+    def _decompose_compound_statements_changed(self):
+        if self.ast is None or self._updating_structure:
+            return
+        # Decompose 'ast' again, keeping the filename of the sub-blocks
+        if self.filename is None and self.sub_blocks:
+            self.filename = self.sub_blocks[0].filename
+        self._structure_changed('ast', self.ast)
+
+    def _cache_options(self):
+        ''' The settings that change how the block is built, for the cache.
+        '''
+        return (self.decompose_compound_statements,)
+
     @cached_property
     def _get__code(self):
         # Policy: our AST is either a Module or something that fits in a
@@ -733,19 +1027,77 @@ class Block(HasTraits):
         if not isinstance(ast, Module):
             ast = Module(None, Stmt([ast]))
 
+        return compile_ast(ast, self._code_filename(), 'exec')
+
+    def _code_filename(self):
         # Make a useful filename to display in tracebacks
         if not self.no_filenames_in_tracebacks:
             if self.filename is not None:
-                filename = self.filename
+                return self.filename
             else:
-                filename = '<%r>' % self
+                return '<%r>' % self
         else:
-            filename = '(Block with filename suppressed)'
+            return '(Block with filename suppressed)'
 
-        return compile_ast(ast, filename, 'exec')
+    def _shift_lines(self, delta, seen=None):
+        ''' Move the statements 'delta' lines down, keeping the compiled code.
+
+            'seen' is the set of the ids of the AST nodes already moved, for
+            nodes shared between blocks.
+        '''
+        if seen is None:
+            seen = set()
+        stack = [self.ast]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            if getattr(node, 'lineno', None) is not None:
+                node.lineno += delta
+            stack.extend(node.getChildNodes())
+        code = self.__dict__.get('_traits_cache__code')
+        if code is not None:
+            self.__dict__['_traits_cache__code'] = shift_code(code, delta)
+        for b in self.sub_blocks:
+            if b.ast is not self.ast:
+                b._shift_lines(delta, seen)
+        self.__execution_plan = None
+
+    def _restore_code(self, code):
+        ''' Use 'code' as the compiled code of the block. '''
+        # Fill the cache of the '_code' cached_property
+        self.__dict__['_traits_cache__code'] = rename_code(
+            code, self._code_filename())
+
+    def _get__execution_plan(self):
+        if self.__execution_plan is None:
+            from .execution_plan import ExecutionPlan
+            self.__execution_plan = ExecutionPlan(self)
+        return self.__execution_plan
+
+    def _filename_changed(self):
+        self.__execution_plan = None
+
+    def _no_filenames_in_tracebacks_changed(self):
+        self.__execution_plan = None
+
+    def _get__name_index(self):
+        if self._dependency_index is None:
+            self._dependency_index = DependencyIndex(self.sub_blocks)
+        return self._dependency_index
+
+    def _get__restriction_graph(self):
+        if self.__restriction_graph is None:
+            self.__restriction_graph = RestrictionGraph(self.sub_blocks,
+                                                        self._dep_graph)
+        return self.__restriction_graph
 
     def _get__dep_graph(self):
 
+        if self.incremental:
+            return self._name_index.dep_graph
+
         # Cache dep graphs
         if not self.__dep_graph_is_valid:
 
@@ -779,26 +1131,34 @@ class Block(HasTraits):
     ###########################################################################
 
     @classmethod
-    def _decompose(cls, ast):
+    def _decompose(cls, ast, compound=False):
         ''' Decompose an AST into a sequence of blocks, if possible.
 
+            With 'compound', 'if' and 'for' statements are decomposed too
+            where it's safe (see 'codetools.blocks.decomposition').
+
             Returns 'None' on failure.
         '''
         assert isinstance(ast, Node)
+        from .decomposition import decompose_statement
 
-        # TODO Look within 'for', 'if', 'try', etc. (#1165)
         if isinstance(ast, Module):
-            result = cls._decompose(ast.node)
+            result = cls._decompose(ast.node, compound)
         elif isinstance(ast, Stmt):
             if len(ast.nodes) == 0:
-                result = [Block(ast)]
+                result = [SubBlock(ast)]
             elif len(ast.nodes) == 1:
                 # Treat 'Stmt([node])' the same as 'node'
-                result = cls._decompose(ast.nodes[0])
+                result = cls._decompose(ast.nodes[0], compound)
+            elif compound:
+                result = [SubBlock(piece) for node in ast.nodes
+                          for piece in decompose_statement(node)]
             else:
-                result = map(Block, ast.nodes)
+                result = map(SubBlock, ast.nodes)
+        elif compound:
+            result = map(SubBlock, decompose_statement(ast))
         else:
-            result = [Block(ast)]
+            result = [SubBlock(ast)]
 
         return result
 
@@ -988,7 +1348,7 @@ class Expression(HasTraits):
 
 def to_block(x):
     "Coerce 'x' to a Block without creating a copy if it's one already"
-    if isinstance(x, Block):
+    if isinstance(x, (Block, SubBlock)):
         return x
     else:
         return Block(x)
@@ -0,0 +1,219 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' A persistent cache of parsed, analyzed and compiled blocks.
+
+    Building a 'Block' from source parses it, decomposes it into sub-blocks,
+    runs 'NameFinder' over every sub-block and the whole block, and compiles
+    every sub-block when it is first executed. A 'BlockCache' stores the
+    results in a directory, much like '__pycache__': the ASTs of the block
+    and its sub-blocks (pickled), their inputs and outputs, and the
+    marshalled code objects of the sub-blocks (and of the whole block, for
+    blocks with 'no_filenames_in_tracebacks'). Blocks built from the same
+    source later skip parsing, name analysis and compilation.
+
+    Entries are addressed by a hash of the source, the interpreter version
+    and the codetools version, so a stale entry is never used; old entries
+    can be removed with 'clear'. Code objects are stored with the filename
+    they were compiled with and renamed when loaded, so the cache doesn't
+    depend on the filename or on uuids.
+
+    The cache is used by 'Block' once it is enabled with 'set_block_cache',
+    or with the 'CODETOOLS_BLOCK_CACHE' environment variable.
+'''
+
+from __future__ import absolute_import
+
+from cPickle import HIGHEST_PROTOCOL, dumps, loads
+import hashlib
+import imp
+import marshal
+import os
+import sys
+import tempfile
+import types
+
+import codetools
+
+# Bump to invalidate existing entries when their contents change
+FORMAT = 1
+
+_block_cache = None
+_block_cache_checked = False
+
+
+def set_block_cache(cache):
+    ''' Use 'cache' (a 'BlockCache', a directory name, or None to disable
+        caching) when building blocks from source.
+    '''
+    global _block_cache, _block_cache_checked
+    if isinstance(cache, basestring):
+        cache = BlockCache(cache)
+    _block_cache = cache
+    _block_cache_checked = True
+
+
+def get_block_cache():
+    ''' The cache used when building blocks from source, or None. '''
+    global _block_cache_checked
+    if not _block_cache_checked:
+        _block_cache_checked = True
+        directory = os.environ.get('CODETOOLS_BLOCK_CACHE')
+        if directory:
+            set_block_cache(directory)
+    return _block_cache
+
+
+def rename_code(code, filename):
+    ''' 'code' (and the code objects nested in it) with a new filename. '''
+    if code.co_filename == filename:
+        return code
+    consts = tuple(rename_code(c, filename)
+                   if isinstance(c, types.CodeType) else c
+                   for c in code.co_consts)
+    return types.CodeType(code.co_argcount, code.co_nlocals,
+                          code.co_stacksize, code.co_flags, code.co_code,
+                          consts, code.co_names, code.co_varnames, filename,
+                          code.co_name, code.co_firstlineno, code.co_lnotab,
+                          code.co_freevars, code.co_cellvars)
+
+
+def shift_code(code, delta):
+    ''' 'code' (and the code objects nested in it) moved 'delta' lines down.
+    '''
+    consts = tuple(shift_code(c, delta)
+                   if isinstance(c, types.CodeType) else c
+                   for c in code.co_consts)
+    return types.CodeType(code.co_argcount, code.co_nlocals,
+                          code.co_stacksize, code.co_flags, code.co_code,
+                          consts, code.co_names, code.co_varnames,
+                          code.co_filename, code.co_name,
+                          code.co_firstlineno + delta, code.co_lnotab,
+                          code.co_freevars, code.co_cellvars)
+
+class BlockCache(object):
+    ''' A directory of cached blocks. '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tag = '%s-%s' % (sys.subversion[0].lower(),
+                              ''.join(map(str, sys.version_info[:2])))
+
+    ###########################################################################
+    # BlockCache public interface
+    ###########################################################################
+
+    def key(self, source, options=()):
+        ''' The name of the entry for 'source', built with 'options' (see
+            'Block._cache_options').
+        '''
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+        digest = hashlib.sha1()
+        for part in (str(FORMAT), imp.get_magic(), sys.version,
+                     codetools.__version__, repr(tuple(options)), source):
+            digest.update(part)
+            digest.update('\0')
+        return '%s.%s.pickle' % (digest.hexdigest(), self.tag)
+
+    def load(self, source, options=()):
+        ''' The entry for 'source', or None. Unreadable entries are ignored.
+        '''
+        try:
+            with open(os.path.join(self.directory,
+                                   self.key(source, options)),
+                      'rb') as f:
+                entry = loads(f.read())
+        except Exception:
+            return None
+        if entry.get('format') != FORMAT:
+            return None
+        return entry
+
+    def restore(self, block, entry):
+        ''' Set up 'block', which has no structure yet, from 'entry'. '''
+        from .sub_block import SubBlock
+
+        sub_blocks = []
+        for ast, analysis, code in entry['sub_blocks']:
+            sub_block = SubBlock(ast)
+            sub_block.filename = block.filename
+            self._restore(sub_block, analysis, code)
+            sub_blocks.append(sub_block)
+
+        block._updating_structure = True
+        try:
+            block.ast = entry['ast']
+            block.sub_blocks = sub_blocks
+        finally:
+            block._updating_structure = False
+        self._restore(block, entry['analysis'], entry['code'])
+
+    def store(self, block, source, options=()):
+        ''' Save 'block', built from 'source', to the cache. '''
+        # Blocks that fail analysis or compilation aren't cached: the errors
+        # must show up when the caller uses the block, as without a cache
+        try:
+            entry = dict(
+                format=FORMAT,
+                ast=block.ast,
+                analysis=self._analysis(block),
+                code=(marshal.dumps(block._code)
+                      if block.no_filenames_in_tracebacks else None),
+                sub_blocks=[(b.ast, self._analysis(b),
+                             marshal.dumps(b._code))
+                            for b in block.sub_blocks],
+            )
+            data = dumps(entry, HIGHEST_PROTOCOL)
+        except Exception:
+            return
+
+        # Like Python with '.pyc' files, carry on if the cache can't be
+        # written. The entry is written to a temporary file and renamed, so
+        # that concurrent readers never see a partial entry.
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temp, os.path.join(self.directory,
+                                         self.key(source, options)))
+        except (IOError, OSError):
+            os.remove(temp)
+
+    def clear(self):
+        ''' Remove all the entries. '''
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                os.remove(os.path.join(self.directory, name))
+
+    ###########################################################################
+    # BlockCache protected interface
+    ###########################################################################
+
+    def _analysis(self, block):
+        return dict(inputs=block.inputs, outputs=block.outputs,
+                    conditional_outputs=block.conditional_outputs,
+                    const_assign=block.const_assign,
+                    fromimports=block.fromimports,
+                    imports_ast=block.imports_ast)
+
+    def _restore(self, block, analysis, code):
+        block._inputs = analysis['inputs']
+        block._outputs = analysis['outputs']
+        block._conditional_outputs = analysis['conditional_outputs']
+        block._const_assign = analysis['const_assign']
+        block._fromimports = analysis['fromimports']
+        block._imports_ast = analysis['imports_ast']
+        if code is not None:
+            block._restore_code(marshal.loads(code))
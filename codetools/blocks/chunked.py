@@ -0,0 +1,322 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Out-of-core execution of blocks over chunks of their array inputs.
+
+    'ChunkedExecution' runs a block whose inputs include arrays too large for
+    memory: 'numpy.memmap's, HDF5 datasets, or any object with a 'shape' that
+    can be sliced along its first axis. All these arrays must have the same
+    length. The sub-blocks are taken in order:
+
+    - Sub-blocks that don't read any array (e.g. imports, or 'k = 2 * s') run
+      once, in the namespace.
+
+    - Chunk-safe sub-blocks, which assign a name an elementwise expression of
+      arrays, numbers and ufuncs (see 'codetools.blocks.fusion'), are grouped
+      and run over one chunk of rows of the arrays at a time. The arrays they
+      compute are written chunk by chunk into preallocated arrays: the arrays
+      given in 'out', or new 'numpy.memmap's in 'directory'.
+
+    - Other sub-blocks that read arrays, such as reductions ('x.sum()') or
+      calls to functions that aren't ufuncs, aren't chunk-safe. By default
+      they make the execution fail with an 'UnsafeStatementError' before
+      anything runs. With 'materialize=True', they run once over the whole
+      arrays instead, after reading the array inputs they use into memory;
+      arrays they compute with the same length are chunked again by the
+      following sub-blocks.
+
+    Only the arrays that later sub-blocks read, and those in 'outputs', are
+    written; the other names computed chunk by chunk are dropped.
+'''
+
+from __future__ import absolute_import
+
+from compiler.ast import Assign, AssName, CallFunc, Module, Stmt
+import numbers
+import os
+import tempfile
+
+import numpy
+from six import exec_
+
+from .compiler_.api import compile_ast
+from .compiler_unparse import unparse
+from .fusion import called_roots, dotted_name, input_roots, is_elementwise
+
+
+class UnsafeStatementError(ValueError):
+    ''' A block has statements that can't run over chunks of its arrays. '''
+
+    def __init__(self, statements):
+        self.statements = statements
+        ValueError.__init__(self, 'Statements not chunk-safe: %s' %
+                            '; '.join(statements))
+
+
+def is_array(value):
+    ''' Whether 'value' is an array that can be chunked along its first axis.
+    '''
+    shape = getattr(value, 'shape', None)
+    return isinstance(shape, tuple) and len(shape) > 0 and \
+           hasattr(value, '__getitem__')
+
+
+def chunk_safe_statement(ast):
+    ''' (name, expression) if 'ast' assigns an elementwise expression to a
+        name, else None.
+    '''
+    if isinstance(ast, Assign) and len(ast.nodes) == 1 and \
+           isinstance(ast.nodes[0], AssName) and \
+           ast.nodes[0].flags == 'OP_ASSIGN' and is_elementwise(ast.expr):
+        return ast.nodes[0].name, ast.expr
+    return None
+
+
+def resolve(name, namespace):
+    ''' The value of the dotted 'name' in 'namespace'. '''
+    parts = name.split('.')
+    value = namespace[parts[0]]
+    for part in parts[1:]:
+        value = getattr(value, part)
+    return value
+
+
+class ChunkedExecution(object):
+    ''' Executes a block over chunks of the arrays in a context. '''
+
+    def __init__(self, block, local_context, outputs=None, out=None,
+                 directory=None, chunk_size=1 << 20, materialize=False):
+        self.block = block
+        self.local_context = local_context
+
+        # The names whose arrays must be written (default: all the names)
+        self.outputs = outputs
+
+        # Preallocated arrays for some of the outputs, by name
+        self.out = dict(out or {})
+
+        # Where to create the memmaps of the other outputs
+        self.directory = directory
+
+        # The number of elements in a chunk
+        self.chunk_size = chunk_size
+
+        # Whether to run the statements that aren't chunk-safe over whole
+        # arrays (or to refuse them)
+        self.materialize = materialize
+
+    ###########################################################################
+    # ChunkedExecution public interface
+    ###########################################################################
+
+    def run(self):
+        ''' Execute the block; its results are bound in the context. '''
+        namespace = dict((name, self.local_context[name])
+                         for name in self.local_context.keys())
+        arrays = set(name for name, value in namespace.items()
+                     if is_array(value))
+        lengths = set(namespace[name].shape[0] for name in arrays)
+        if len(lengths) > 1:
+            raise ValueError('The arrays must have the same length: %s' %
+                             ', '.join('%s%r' % (name, namespace[name].shape)
+                                       for name in sorted(arrays)))
+        self.length = lengths.pop() if lengths else None
+
+        if not self.materialize:
+            unsafe = self._unsafe_statements(arrays)
+            if unsafe:
+                raise UnsafeStatementError(unsafe)
+
+        sub_blocks = self.block.sub_blocks or [self.block]
+        pending = []
+        for i, sub_block in enumerate(sub_blocks):
+            reads = input_roots(sub_block) | sub_block.conditional_outputs
+            if reads.isdisjoint(arrays):
+                # (Run the pending statements first if this one binds a
+                # name they read or bind)
+                if not sub_block.all_outputs.isdisjoint(
+                        self._reads(pending) | self._writes(pending)):
+                    self._run_chunks(pending, namespace, arrays,
+                                     sub_blocks[i:])
+                    pending = []
+                sub_block.execute(namespace)
+                arrays -= sub_block.outputs
+            elif self._chunk_safe(sub_block, namespace, arrays):
+                pending.append(sub_block)
+                arrays |= sub_block.outputs
+            elif not self.materialize:
+                # (e.g. a call to a function that isn't a ufunc)
+                raise UnsafeStatementError([unparse(sub_block.ast).strip()])
+            else:
+                self._run_chunks(pending, namespace, arrays, sub_blocks[i:])
+                pending = []
+                self._run_whole(sub_block, namespace, arrays)
+        self._run_chunks(pending, namespace, arrays, [])
+
+        for name, value in namespace.items():
+            if name == '__builtins__':
+                continue
+            if name not in self.local_context or \
+                   self.local_context[name] is not value:
+                self.local_context[name] = value
+
+    ###########################################################################
+    # ChunkedExecution protected interface
+    ###########################################################################
+
+    def _unsafe_statements(self, arrays):
+        ''' The source of the statements that read arrays and aren't
+            elementwise, found without running anything.
+        '''
+        arrays = set(arrays)
+        unsafe = []
+        for sub_block in self.block.sub_blocks or [self.block]:
+            reads = input_roots(sub_block) | sub_block.conditional_outputs
+            if reads.isdisjoint(arrays):
+                arrays -= sub_block.outputs
+            elif chunk_safe_statement(sub_block.ast) is None:
+                unsafe.append(unparse(sub_block.ast).strip())
+            else:
+                arrays |= sub_block.outputs
+        return unsafe
+
+    def _chunk_safe(self, sub_block, namespace, arrays):
+        ''' Whether 'sub_block' can run over chunks of 'arrays'. '''
+        statement = chunk_safe_statement(sub_block.ast)
+        if statement is None:
+            return False
+        expr = statement[1]
+
+        # The functions must be ufuncs and the other values numbers
+        try:
+            for root in called_roots(expr):
+                namespace[root]
+        except KeyError:
+            return False
+        for function in _called_names(expr):
+            try:
+                value = resolve(function, namespace)
+            except (KeyError, AttributeError):
+                return False
+            if not isinstance(value, numpy.ufunc):
+                return False
+        for read in input_roots(sub_block) - called_roots(expr) - arrays:
+            value = namespace.get(read)
+            if not isinstance(value, (numbers.Number, numpy.generic)):
+                return False
+        return True
+
+    def _reads(self, sub_blocks):
+        reads = set()
+        for sub_block in sub_blocks:
+            reads |= input_roots(sub_block)
+        return reads
+
+    def _writes(self, sub_blocks):
+        writes = set()
+        for sub_block in sub_blocks:
+            writes |= sub_block.all_outputs
+        return writes
+
+    def _run_chunks(self, sub_blocks, namespace, arrays, remaining):
+        ''' Run 'sub_blocks' over chunks, and write the arrays they compute
+            that the 'remaining' sub-blocks read or that are outputs.
+        '''
+        if not sub_blocks:
+            return
+
+        assigned = set()
+        for sub_block in sub_blocks:
+            assigned |= sub_block.outputs
+        needed = self._reads(remaining)
+        written = [name for name in sorted(assigned)
+                   if name in needed or self.outputs is None or
+                   name in self.outputs]
+        reads = sorted(self._reads(sub_blocks) & arrays - assigned)
+
+        code = compile_ast(Module(None, Stmt([b.ast for b in sub_blocks])),
+                           sub_blocks[0]._code_filename(), 'exec')
+        shape = namespace[reads[0]].shape if reads else (self.length,)
+        row_size = int(numpy.prod(shape[1:]))
+        step = max(1, self.chunk_size // max(row_size, 1))
+
+        results = {}
+        scalars = dict((name, value) for name, value in namespace.items()
+                       if name not in arrays)
+        for start in range(0, self.length, step):
+            stop = min(start + step, self.length)
+            chunk = dict(scalars)
+            for name in reads:
+                chunk[name] = numpy.asarray(namespace[name][start:stop])
+            exec_(code, {}, chunk)
+            for name in written:
+                value = chunk[name]
+                if name not in results:
+                    results[name] = self._allocate(name, value)
+                results[name][start:stop] = value
+
+        for name in assigned:
+            namespace.pop(name, None)
+        for name, array in results.items():
+            if isinstance(array, numpy.memmap):
+                array.flush()
+            namespace[name] = array
+        arrays -= assigned - set(results)
+
+    def _run_whole(self, sub_block, namespace, arrays):
+        ''' Run 'sub_block' over whole arrays, read into memory. '''
+        whole = dict(namespace)
+        for name in input_roots(sub_block) & arrays:
+            value = namespace[name]
+            if not isinstance(value, numpy.ndarray):
+                whole[name] = numpy.asarray(value[...])
+        sub_block.execute(whole)
+        for name in sub_block.outputs | sub_block.conditional_outputs:
+            if name in whole:
+                value = namespace[name] = whole[name]
+                if is_array(value) and value.shape[0] == self.length:
+                    arrays.add(name)
+                else:
+                    arrays.discard(name)
+
+    def _allocate(self, name, value):
+        ''' The array to write the chunks of 'name' into. '''
+        value = numpy.asarray(value)
+        shape = (self.length,) + value.shape[1:]
+        if name in self.out:
+            out = self.out[name]
+            if out.shape != shape:
+                raise ValueError('The array for %r must have shape %r' %
+                                 (name, shape))
+            return out
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp()
+        return numpy.memmap(os.path.join(self.directory, '%s.dat' % name),
+                            dtype=value.dtype, mode='w+', shape=shape)
+
+
+def execute_chunked(block, local_context, outputs=None, out=None,
+                    directory=None, chunk_size=1 << 20, materialize=False):
+    ''' Execute 'block' over chunks of the arrays in 'local_context'; see
+        'Block.execute_chunked'.
+    '''
+    ChunkedExecution(block, local_context, outputs, out, directory,
+                     chunk_size, materialize).run()
+
+
+def _called_names(expr):
+    ''' The dotted names of the functions called in an elementwise 'expr'.
+    '''
+    names = set()
+    if isinstance(expr, CallFunc):
+        names.add(dotted_name(expr.node))
+        children = expr.args
+    else:
+        children = expr.getChildNodes()
+    for child in children:
+        names |= _called_names(child)
+    return names
@@ -0,0 +1,328 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Common-subexpression elimination for blocks.
+
+    Scripts often compute the same expression in several statements::
+
+        from numpy import interp, log
+        a = log(vp) * 2
+        b = log(vp) + interp(depth, log_depth, values)
+        c = interp(depth, log_depth, values) ** 2
+
+    'eliminate_common_subexpressions' hoists each pure expression that's
+    computed more than once into a temporary, assigned by a new sub-block
+    inserted before its first use::
+
+        __cse_0 = interp(depth, log_depth, values)
+        __cse_1 = log(vp)
+        ...
+        b = __cse_1 + __cse_0
+
+    The new sub-blocks take part in the dependency graph of the block like
+    the others, so restricting it still works.
+
+    An expression is pure if it only applies operators and calls to the
+    functions of 'PURE_FUNCTIONS' to names and constants. Functions are
+    recognized by the module they're imported from in the block (e.g.
+    'numpy.log' for 'np.log' after 'import numpy as np', or 'log' after
+    'from numpy import log'), since names from the context could be bound to
+    anything. Two occurrences are the same expression only if none of the
+    names they read is bound again, or used in a way that could modify it (a
+    method call or an argument of another function), between them. Values
+    aliased under other names aren't tracked, and expressions that are only
+    evaluated conditionally ('and', 'or', 'if' expressions, comprehensions
+    and lambdas, compound statements) are left alone.
+'''
+
+from __future__ import absolute_import
+
+from compiler.ast import (Add, And, Assign, AssName, AugAssign, Bitand,
+                          Bitor, Bitxor, CallFunc, Compare, Const, Discard,
+                          Div, FloorDiv, From, GenExpr, IfExp, Import, Invert,
+                          Keyword, Lambda, LeftShift, ListComp, Mod, Mul,
+                          Name, Not, Or, Power, Print, Printnl, RightShift,
+                          Sub, UnaryAdd, UnarySub)
+
+from .analysis import Transformer
+from .compiler_unparse import unparse
+from .fusion import dotted_name
+
+# The functions with no side effects, by module
+PURE_FUNCTIONS = frozenset(
+    ['math.' + name for name in
+     'acos acosh asin asinh atan atan2 atanh ceil copysign cos cosh degrees '
+     'erf erfc exp expm1 fabs factorial floor fmod frexp gamma hypot isinf '
+     'isnan ldexp lgamma log log10 log1p modf pow radians sin sinh sqrt tan '
+     'tanh trunc'.split()] +
+    ['numpy.' + name for name in
+     'abs absolute arccos arccosh arcsin arcsinh arctan arctan2 arctanh '
+     'around cbrt ceil clip cos cosh cumprod cumsum deg2rad degrees diff dot '
+     'exp exp2 expm1 fabs floor fmod hypot interp isfinite isinf isnan log '
+     'log10 log1p log2 maximum mean median minimum mod negative outer power '
+     'prod rad2deg radians reciprocal remainder rint round sign sin sinh '
+     'sqrt square std sum tan tanh trunc var where'.split()]
+)
+
+# The operators of pure expressions
+OPERATORS = (Add, Bitand, Bitor, Bitxor, Compare, Div, FloorDiv, Invert,
+             LeftShift, Mod, Mul, Not, Power, RightShift, Sub, UnaryAdd,
+             UnarySub)
+
+# The expressions whose operands may not be evaluated
+CONDITIONAL = (And, GenExpr, IfExp, Lambda, ListComp, Or)
+
+TEMPORARY = '__cse_%d'
+
+
+def eliminate_common_subexpressions(block, pure=PURE_FUNCTIONS):
+    ''' The block equivalent to 'block' with the pure expressions computed
+        more than once hoisted into temporaries, and a dict mapping the
+        temporaries to the source of their expressions.
+
+        'pure' is the set of the (qualified) names of the functions with no
+        side effects.
+    '''
+    from .block import Block
+
+    sub_blocks = list(block.sub_blocks or [block])
+    names = set()
+    for sub_block in sub_blocks:
+        names |= sub_block.inputs | sub_block.all_outputs
+    temporaries = {}
+
+    # Hoist the largest repeated expression until there are none left
+    while True:
+        occurrences = _find_occurrences(sub_blocks, pure)
+        repeated = [(len(version[0]), -indices[0], version)
+                    for version, (expr, indices, count)
+                    in occurrences.items() if count > 1]
+        if not repeated:
+            break
+        version = max(repeated)[2]
+        expr, indices, count = occurrences[version]
+        key = version[0]
+
+        temporary = _temporary(len(temporaries), names)
+        names.add(temporary)
+        temporaries[temporary] = unparse(expr).strip()
+
+        first = sub_blocks[indices[0]]
+        assign = Assign([AssName(temporary, 'OP_ASSIGN')], expr,
+                        first.ast.lineno)
+        hoisted = Block(assign)
+        hoisted.filename = first.filename
+        for i in indices:
+            sub_blocks[i] = _replace(sub_blocks[i], key, temporary)
+        sub_blocks.insert(indices[0], hoisted)
+
+    result = Block(sub_blocks)
+    result.filename = block.filename
+    return result, temporaries
+
+
+def is_pure(expr, functions={}):
+    ''' Whether 'expr' only applies operators and the pure functions in
+        'functions' (see 'pure_expressions') to names and constants.
+    '''
+    return _collect(expr, functions, [])
+
+
+def pure_expressions(expr, functions):
+    ''' The pure sub-expressions of 'expr' that are always evaluated, where
+        'functions' maps the names of the pure functions in scope to their
+        qualified names.
+    '''
+    expressions = []
+    _collect(expr, functions, expressions)
+    return expressions
+
+
+###############################################################################
+# Protected interface
+###############################################################################
+
+class _Replacer(Transformer):
+    ''' Replaces the occurrences of an expression with a name. '''
+
+    def __init__(self, key, name):
+        super(_Replacer, self).__init__()
+        self.key = key
+        self.name = name
+
+    def transform(self, x):
+        if not isinstance(x, CONDITIONAL) and repr(x) == self.key:
+            return Name(self.name)
+        return super(_Replacer, self).transform(x)
+
+    def transformLambda(self, node):
+        return node
+
+    transformAnd = transformGenExpr = transformIfExp = transformListComp = \
+        transformOr = transformLambda
+
+
+def _expressions(ast):
+    ''' The expressions of a simple statement that are always evaluated. '''
+    if isinstance(ast, Assign):
+        return [ast.expr]
+    elif isinstance(ast, AugAssign):
+        return [ast.expr]
+    elif isinstance(ast, Discard):
+        return [ast.expr]
+    elif isinstance(ast, (Print, Printnl)):
+        return list(ast.nodes)
+    return []
+
+
+def _collect(expr, functions, expressions):
+    ''' Whether 'expr' is pure; adds its pure non-trivial sub-expressions to
+        'expressions'.
+    '''
+    if isinstance(expr, (Name, Const)):
+        return True
+    if isinstance(expr, CONDITIONAL):
+        return False
+    if isinstance(expr, CallFunc):
+        pure = dotted_name(expr.node) in functions and \
+               expr.star_args is None and expr.dstar_args is None
+        operands = [arg.expr if isinstance(arg, Keyword) else arg
+                    for arg in expr.args]
+    else:
+        pure = isinstance(expr, OPERATORS)
+        operands = expr.getChildNodes()
+    for operand in operands:
+        pure = _collect(operand, functions, expressions) and pure
+    if pure:
+        expressions.append(expr)
+    return pure
+
+
+def _find_occurrences(sub_blocks, pure):
+    ''' Map the versions of the pure expressions, i.e. their keys and the
+        versions of the names they read, to (expression, indices of the
+        sub-blocks computing it, number of occurrences).
+    '''
+    functions = {}  # name in the block -> qualified name
+    versions = {}   # name -> number of times it was bound or modified
+    occurrences = {}
+    for i, sub_block in enumerate(sub_blocks):
+        ast = sub_block.ast
+        for expr in _expressions(ast):
+            for sub_expr in pure_expressions(expr, functions):
+                key = repr(sub_expr)
+                names = _names(sub_expr)
+                version = (key, tuple((name, versions.get(name, 0))
+                                      for name in sorted(names)))
+                entry = occurrences.setdefault(version, [sub_expr, [], 0])
+                if i not in entry[1]:
+                    entry[1].append(i)
+                entry[2] += 1
+
+        # Bump the versions of the names that may have changed
+        for name in _modified_names(sub_block, functions):
+            versions[name] = versions.get(name, 0) + 1
+            for alias in [alias for alias in functions
+                          if alias.split('.')[0] == name]:
+                del functions[alias]
+        _track_imports(ast, functions, pure)
+
+    return occurrences
+
+
+def _track_imports(ast, functions, pure):
+    ''' Add the pure functions imported by 'ast' to 'functions'. '''
+    if isinstance(ast, Import):
+        for name, asname in ast.names:
+            if asname is None:
+                prefix = name.split('.')[0]
+                for function in pure:
+                    if function.startswith(prefix + '.'):
+                        functions[function] = function
+            else:
+                for function in pure:
+                    if function.startswith(name + '.'):
+                        functions[asname + function[len(name):]] = function
+    elif isinstance(ast, From):
+        for name, asname in ast.names:
+            function = '%s.%s' % (ast.modname, name)
+            if function in pure:
+                functions[asname or name] = function
+
+
+def _modified_names(sub_block, functions):
+    ''' The names 'sub_block' may bind or modify. '''
+    names = set(name.split('.')[0] for name in sub_block.all_outputs)
+    ast = sub_block.ast
+    if isinstance(ast, (Import, From)):
+        for name, asname in ast.names:
+            names.add(asname or name.split('.')[0])
+    elif isinstance(ast, Assign):
+        # (Items and attributes assigned)
+        for target in ast.nodes:
+            names |= _names(target)
+    elif isinstance(ast, AugAssign):
+        names |= _names(ast.node)
+    elif not isinstance(ast, (Discard, Print, Printnl)):
+        # Compound statements may modify anything they use
+        names |= _names(ast)
+
+    # Objects whose methods are called, or passed to other functions
+    pure_roots = set(name.split('.')[0] for name in functions)
+    names |= _passed_names(ast, functions) - pure_roots
+    return names
+
+
+def _passed_names(node, functions):
+    ''' The names passed to functions that aren't pure, or whose methods are
+        called.
+    '''
+    names = set()
+    if isinstance(node, CallFunc):
+        function = dotted_name(node.node)
+        if function not in functions:
+            if function is not None and '.' in function:
+                names.add(function.split('.')[0])
+            for arg in node.args:
+                if isinstance(arg, Keyword):
+                    arg = arg.expr
+                if isinstance(arg, Name):
+                    names.add(arg.name)
+    for child in node.getChildNodes():
+        names |= _passed_names(child, functions)
+    return names
+
+
+def _names(expr):
+    ''' The roots of the names 'expr' reads. '''
+    if isinstance(expr, Name):
+        return set([expr.name])
+    names = set()
+    for child in expr.getChildNodes():
+        names |= _names(child)
+    return names
+
+
+def _replace(sub_block, key, name):
+    from .block import Block
+
+    ast = sub_block.ast
+    replacer = _Replacer(key, name)
+    if isinstance(ast, AugAssign):
+        new = AugAssign(ast.node, ast.op, replacer.transform(ast.expr))
+    else:
+        new = replacer.transform(ast)
+    new.lineno = ast.lineno
+    replaced = Block(new)
+    replaced.filename = sub_block.filename
+    return replaced
+
+
+def _temporary(n, names):
+    while TEMPORARY % n in names:
+        n += 1
+    return TEMPORARY % n
@@ -0,0 +1,186 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Decomposition of compound statements into finer sub-blocks (#1165).
+
+    By default a block's sub-blocks are its top-level statements, so an 'if'
+    or a 'for' is one opaque sub-block and 'Block.restrict' keeps or drops it
+    whole. With 'Block.decompose_compound_statements', 'decompose_statement'
+    splits them further where this doesn't change what the block computes:
+
+    - An 'if' whose tests are pure (names and constants combined by
+      operators, see 'cse.is_pure') and whose branches don't bind the names
+      the tests read becomes one 'if' per statement of its branches::
+
+          if mode == 'fast':          if mode == 'fast':
+              a = f(x)                    a = f(x)
+              b = g(y)        ->      if mode == 'fast':
+          else:                           b = g(y)
+              a = h(x)                if mode == 'fast': pass
+                                      else:
+                                          a = h(x)
+
+      The branches are split recursively.
+
+    - A 'for' over 'range(...)', 'xrange(...)' or a list or tuple display
+      with pure items, without 'break', 'continue' or 'else', has its
+      loop-invariant assignments hoisted in front of it: assignments of pure
+      expressions that read no name the loop binds, to names that nothing
+      else in the loop binds or reads before them. Each runs guarded by the
+      loop's sequence, so that it doesn't run if the loop doesn't::
+
+          for i in range(n):          if range(n):
+              k = scale * 2       ->      k = scale * 2
+              y[i] = x[i] * k         for i in range(n):
+                                          y[i] = x[i] * k
+
+    Other statements, including 'with' and 'try' (whose context managers and
+    handlers can't be entered more than once safely), stay whole.
+'''
+
+from __future__ import absolute_import
+
+from compiler.ast import (And, Assign, AssName, Break, CallFunc, Continue,
+                          For, If, List, Name, Not, Or, Pass, Stmt, Tuple,
+                          While)
+import compiler
+
+from .analysis import NameFinder
+from .cse import is_pure
+
+
+def decompose_statement(ast):
+    ''' The statements, equivalent to the statement 'ast' run in order, that
+        'ast' can be split into.
+    '''
+    try:
+        if isinstance(ast, If):
+            return _decompose_if(ast)
+        elif isinstance(ast, For):
+            return _decompose_for(ast)
+    except NotImplementedError:
+        # (Statements the analysis doesn't support, like 'del', stay whole)
+        pass
+    return [ast]
+
+
+###############################################################################
+# Protected interface
+###############################################################################
+
+def _decompose_if(ast):
+    tests = [test for test, body in ast.tests]
+    if not all(_is_pure_test(test) for test in tests):
+        return [ast]
+    read = set()
+    for test in tests:
+        read |= _names(test).free
+    bound = _names(ast)
+    if not read.isdisjoint(bound.locals | bound.conditional_locals):
+        return [ast]
+
+    pieces = []
+    for i, (test, body) in enumerate(ast.tests):
+        skipped = [(t, Stmt([Pass()])) for t in tests[:i]]
+        for statement in _statements(body):
+            for piece in decompose_statement(statement):
+                if not isinstance(piece, Pass):
+                    pieces.append(If(skipped + [(test, Stmt([piece]))],
+                                     None, ast.lineno))
+    if ast.else_ is not None:
+        skipped = [(t, Stmt([Pass()])) for t in tests]
+        for statement in _statements(ast.else_):
+            for piece in decompose_statement(statement):
+                if not isinstance(piece, Pass):
+                    pieces.append(If(skipped, Stmt([piece]), ast.lineno))
+    if not pieces:
+        return [ast]
+    return pieces
+
+
+def _decompose_for(ast):
+    if ast.else_ is not None or not _is_reiterable(ast.list) or \
+           _contains(ast.body, (Break, Continue)):
+        return [ast]
+
+    statements = _statements(ast.body)
+    loop_bound = _names(ast.assign)
+    bound = [_names(statement) for statement in statements]
+    target = loop_bound.locals | loop_bound.conditional_locals
+
+    hoisted = []
+    for j, statement in enumerate(statements):
+        if not _is_pure_assignment(statement):
+            continue
+        outputs = bound[j].locals
+        others = [names for k, names in enumerate(bound) if k != j]
+        # Nothing else in the loop binds the names, or reads them first
+        if not outputs.isdisjoint(target) or \
+               any(not outputs.isdisjoint(names.locals |
+                                          names.conditional_locals)
+                   for names in others) or \
+               any(not outputs.isdisjoint(names.free)
+                   for names in bound[:j]):
+            continue
+        # It reads no name the (rest of the) loop binds
+        forbidden = target | outputs
+        for k, names in enumerate(bound):
+            if k != j and k not in hoisted:
+                forbidden |= names.locals | names.conditional_locals
+        if bound[j].free.isdisjoint(forbidden):
+            hoisted.append(j)
+
+    if not hoisted:
+        return [ast]
+    pieces = [If([(ast.list, Stmt([statements[j]]))], None, ast.lineno)
+              for j in hoisted]
+    body = [s for j, s in enumerate(statements) if j not in hoisted]
+    pieces.append(For(ast.assign, ast.list, Stmt(body or [Pass()]), None,
+                      ast.lineno))
+    return pieces
+
+
+def _statements(ast):
+    return ast.nodes if isinstance(ast, Stmt) else [ast]
+
+
+def _names(ast):
+    return compiler.walk(ast, NameFinder())
+
+
+def _is_pure_test(expr):
+    if isinstance(expr, (And, Or)):
+        return all(_is_pure_test(node) for node in expr.nodes)
+    if isinstance(expr, Not):
+        return _is_pure_test(expr.expr)
+    return is_pure(expr)
+
+
+def _is_pure_assignment(ast):
+    return isinstance(ast, Assign) and \
+           all(isinstance(node, AssName) and node.flags == 'OP_ASSIGN'
+               for node in ast.nodes) and is_pure(ast.expr)
+
+
+def _is_reiterable(expr):
+    ''' Whether evaluating 'expr' again gives the same, reusable sequence. '''
+    if isinstance(expr, (List, Tuple)):
+        return all(is_pure(node) for node in expr.nodes)
+    return isinstance(expr, CallFunc) and \
+           isinstance(expr.node, Name) and \
+           expr.node.name in ('range', 'xrange') and \
+           expr.star_args is None and expr.dstar_args is None and \
+           all(is_pure(arg) for arg in expr.args)
+
+
+def _contains(ast, classes):
+    if isinstance(ast, classes):
+        return True
+    # (A 'break' in a nested loop is that loop's business)
+    if isinstance(ast, (For, While)):
+        return ast.else_ is not None and _contains(ast.else_, classes)
+    return any(_contains(node, classes) for node in ast.getChildNodes())
@@ -0,0 +1,490 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Incremental maintenance of a block's dependency graph.
+
+    'Block._compute_dependencies' rebuilds the dependency graph of a sequence
+    of sub-blocks from scratch. 'DependencyIndex' produces the same graph but
+    keeps enough bookkeeping (which sub-blocks write, conditionally write,
+    import and read each name) to update it in place when sub-blocks are
+    inserted, removed or replaced. The same bookkeeping answers queries like
+    "which statements read 'vp'?" without a scan of the sub-blocks (see
+    'readers', 'writers' and 'last_writer').
+'''
+
+from __future__ import absolute_import
+
+
+def dotted_prefixes(name):
+    ''' The prefixes that name analysis checks for a dotted name.
+
+        This mirrors the prefix loop in 'NameFinder._see_unbound' and
+        'Block._compute_dependencies' exactly, including the fact that later
+        prefixes are concatenated without dots.
+
+        >>> dotted_prefixes('x')
+        []
+        >>> dotted_prefixes('os.path')
+        ['os']
+        >>> dotted_prefixes('a.b.c')
+        ['a', 'ab']
+    '''
+    prefixes, prefix, suffix = [], '', name
+    while '.' in suffix:
+        prefix += suffix[:suffix.find('.')]
+        prefixes.append(prefix)
+        suffix = suffix[suffix.find('.')+1:]
+    return prefixes
+
+
+class DependencyIndex(object):
+    ''' The dependency graph and aggregate names of a sequence of blocks.
+
+        'dep_graph' has exactly the shape returned by
+        'Block._compute_dependencies', and 'inputs', 'outputs',
+        'conditional_outputs' and 'fromimports' match what 'NameFinder'
+        reports for the concatenated code. All of them are updated in place
+        by 'splice'.
+    '''
+
+    def __init__(self, blocks=()):
+        self.dep_graph = {}
+        self.inputs = set()
+        self.outputs = set()
+        self.conditional_outputs = set()
+        self.fromimports = set()
+
+        self._blocks = []
+        self._position = {}
+
+        # name -> blocks, in execution order
+        self._writers = {}
+        self._conditional_writers = {}
+        self._importers = {}
+        self._readers = {}
+
+        # The blocks that import modules or names, in execution order
+        self._imports = []
+
+        # name -> blocks whose analysis depends on who provides the name
+        self._dependents = {}
+
+        # block -> (block deps, graph inputs, inputs, deferred names)
+        self._analysis = {}
+
+        # name -> number of blocks contributing it
+        self._input_count = {}
+        self._graph_input_count = {}
+
+        # name -> blocks that link to the name iff it is a graph input
+        self._deferred = {}
+
+        self.splice(0, [], list(blocks))
+
+    ###########################################################################
+    # DependencyIndex public interface
+    ###########################################################################
+
+    @property
+    def blocks(self):
+        return list(self._blocks)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __contains__(self, block):
+        return block in self._position
+
+    def readers(self, name):
+        ''' The blocks that read 'name' (or an attribute of it), in order.
+        '''
+        return list(self._readers.get(name, ()))
+
+    def writers(self, name, conditional=False):
+        ''' The blocks that bind 'name', imports included, in order.
+
+            With 'conditional', the blocks that may bind it too.
+        '''
+        tables = [self._writers, self._importers]
+        if conditional:
+            tables.append(self._conditional_writers)
+        blocks = set()
+        for table in tables:
+            blocks.update(table.get(name, ()))
+        return sorted(blocks, key=self._position.__getitem__)
+
+    def last_writer(self, name, before=None):
+        ''' The last block that binds or may bind 'name', before the block
+            'before' if given, or None.
+        '''
+        if before is None:
+            p = len(self._blocks)
+        else:
+            p = self._position[before]
+        last = self._provider(name, p)
+        importer = self._last_before(self._importers, name, p)
+        if last is None or importer is not None and \
+               self._position[importer] > self._position[last]:
+            last = importer
+        return last
+
+    def imports(self):
+        ''' The blocks that import modules or names, in order. '''
+        return list(self._imports)
+
+    def can_splice(self, index, removed, added):
+        ''' Whether 'splice' can handle the edit.
+
+            The index identifies blocks by position, so it can't represent a
+            sequence that contains the same block more than once.
+        '''
+        removed, added = list(removed), list(added)
+        if len(set(added)) != len(added):
+            return False
+        for b in added:
+            if b in self._position and b not in removed:
+                return False
+        return self._blocks[index:index+len(removed)] == removed
+
+    def splice(self, index, removed, added, reach=False):
+        ''' Replace the blocks 'removed', starting at 'index', with 'added'.
+
+            This is the edit described by a list 'items' trait event, so
+            appends, inserts, removals and replacements are all splices.
+
+            If 'reach' is true, returns a pair '(upstream, downstream)' of
+            name sets: the names that the edited blocks (and the blocks whose
+            dependencies changed because of the edit) read from, directly or
+            transitively, and the names that they feed into. Cached results
+            that don't mention both an upstream input and a downstream output
+            are unaffected by the edit. Otherwise returns None.
+        '''
+        removed, added = list(removed), list(added)
+
+        # Names whose providers change
+        changed = set()
+        for b in removed + added:
+            changed |= self._written_names(b)
+
+        # Existing blocks after the edit whose dependencies may change
+        removed_set = set(removed)
+        touched = set()
+        for name in changed:
+            for b in self._dependents.get(name, ()):
+                if b not in removed_set and self._position[b] >= index:
+                    touched.add(b)
+
+        if reach:
+            upstream = self._upstream_names(removed_set | touched)
+            downstream = self._downstream_names(removed_set | touched)
+
+        # Remove the old blocks
+        flipped = set()
+        for b in removed:
+            flipped |= self._forget(b)
+        self._blocks[index:index+len(removed)] = added
+        if len(removed) == len(added):
+            stop = index + len(added)
+        else:
+            stop = len(self._blocks)
+        for i in range(index, stop):
+            self._position[self._blocks[i]] = i
+
+        # Add the new blocks
+        for b in added:
+            self._register(b)
+
+        # Recompute the affected blocks, then their graph entries (which
+        # depend on the final set of graph inputs)
+        touched.update(added)
+        for b in touched:
+            flipped |= self._analyze(b)
+        linked = set(touched)
+        for name in flipped:
+            linked.update(self._deferred.get(name, ()))
+        for b in linked:
+            self._link(b)
+        for name in changed:
+            self._update_name(name)
+
+        if reach:
+            upstream |= self._upstream_names(touched)
+            downstream |= self._downstream_names(touched)
+            return upstream, downstream
+
+    ###########################################################################
+    # DependencyIndex protected interface
+    ###########################################################################
+
+    def _written_names(self, block):
+        return block.outputs | block.conditional_outputs | block.fromimports
+
+    def _relevant_names(self, block):
+        names = set(block.conditional_outputs)
+        for i in block.inputs:
+            names.add(i)
+            names.update(dotted_prefixes(i))
+        return names
+
+    def _read_names(self, block):
+        ''' The names read by 'block', and the objects whose attributes it
+            reads.
+        '''
+        names = set()
+        for i in block.inputs:
+            names.add(i)
+            while '.' in i:
+                i = i[:i.rfind('.')]
+                names.add(i)
+        return names
+
+    def _insert_sorted(self, table, name, block):
+        ''' Insert 'block' into 'table[name]', keeping execution order. '''
+        self._insert_in_order(table.setdefault(name, []), block)
+
+    def _insert_in_order(self, blocks, block):
+        p = self._position[block]
+        lo, hi = 0, len(blocks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._position[blocks[mid]] < p:
+                lo = mid + 1
+            else:
+                hi = mid
+        blocks.insert(lo, block)
+
+    def _last_before(self, table, name, p):
+        blocks = table.get(name)
+        if not blocks:
+            return None
+        lo, hi = 0, len(blocks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._position[blocks[mid]] < p:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        return blocks[lo-1]
+
+    def _any_before(self, table, name, p):
+        blocks = table.get(name)
+        return bool(blocks) and self._position[blocks[0]] < p
+
+    def _provider(self, name, p):
+        ''' The last block before position 'p' that (maybe) writes 'name'. '''
+        a = self._last_before(self._writers, name, p)
+        b = self._last_before(self._conditional_writers, name, p)
+        if a is None or b is None:
+            return a if b is None else b
+        return a if self._position[a] > self._position[b] else b
+
+    def _bound(self, name, p):
+        ''' Whether 'name' is certainly bound before position 'p'. '''
+        return (self._any_before(self._writers, name, p) or
+                self._any_before(self._importers, name, p))
+
+    def _register(self, block):
+        for o in block.outputs:
+            self._insert_sorted(self._writers, o, block)
+        for c in block.conditional_outputs:
+            self._insert_sorted(self._conditional_writers, c, block)
+        for f in block.fromimports:
+            self._insert_sorted(self._importers, f, block)
+        for name in self._read_names(block):
+            self._insert_sorted(self._readers, name, block)
+        if block.fromimports:
+            self._insert_in_order(self._imports, block)
+        for name in self._relevant_names(block):
+            self._dependents.setdefault(name, set()).add(block)
+
+    def _forget(self, block):
+        ''' Remove 'block' from the index.
+
+            Returns the graph input names whose status changed.
+        '''
+        for table, names in ((self._writers, block.outputs),
+                             (self._conditional_writers,
+                              block.conditional_outputs),
+                             (self._importers, block.fromimports),
+                             (self._readers, self._read_names(block))):
+            for name in names:
+                table[name].remove(block)
+                if not table[name]:
+                    del table[name]
+        if block.fromimports:
+            self._imports.remove(block)
+        for name in self._relevant_names(block):
+            self._dependents[name].discard(block)
+            if not self._dependents[name]:
+                del self._dependents[name]
+
+        flipped = self._set_analysis(block, None)
+        self.dep_graph.pop(block, None)
+        del self._position[block]
+        return flipped
+
+    def _analyze(self, block):
+        ''' Recompute the dependencies and contributions of 'block'.
+
+            Mirrors the body of the loop in 'Block._compute_dependencies'
+            (and the free name check in 'NameFinder'). Returns the graph input
+            names whose status changed.
+        '''
+        p = self._position[block]
+        deps, graph_inputs, inputs, deferred = set(), set(), set(), set()
+
+        for i in block.inputs:
+            prefixes = dotted_prefixes(i)
+
+            provided = False
+            for prefix in prefixes:
+                provider = self._provider(prefix, p)
+                if provider is not None:
+                    deps.add(provider)
+                    provided = True
+                    break
+            if not provided:
+                provider = self._provider(i, p)
+                if provider is not None:
+                    deps.add(provider)
+                conditional = (
+                    self._any_before(self._conditional_writers, i, p) and
+                    not self._any_before(self._writers, i, p)
+                )
+                if provider is None or conditional:
+                    graph_inputs.add(i)
+                    deps.add(i)
+
+            if not (self._bound(i, p) or
+                    any(self._bound(x, p) for x in prefixes)):
+                inputs.add(i)
+
+        for c in block.conditional_outputs:
+            provider = self._provider(c, p)
+            if provider is not None:
+                deps.add(provider)
+            else:
+                deferred.add(c)
+
+        return self._set_analysis(block, (deps, graph_inputs, inputs,
+                                          deferred))
+
+    def _set_analysis(self, block, analysis):
+        ''' Replace the recorded analysis of 'block' and update the aggregate
+            counts. Returns the graph input names whose status changed.
+        '''
+        flipped = set()
+
+        old = self._analysis.pop(block, None)
+        if old is not None:
+            _, graph_inputs, inputs, deferred = old
+            for name in graph_inputs:
+                if self._decrement(self._graph_input_count, name):
+                    flipped.add(name)
+            for name in inputs:
+                if self._decrement(self._input_count, name):
+                    self.inputs.discard(name)
+            for name in deferred:
+                self._deferred[name].discard(block)
+                if not self._deferred[name]:
+                    del self._deferred[name]
+
+        if analysis is not None:
+            self._analysis[block] = analysis
+            _, graph_inputs, inputs, deferred = analysis
+            for name in graph_inputs:
+                if self._increment(self._graph_input_count, name):
+                    flipped.add(name)
+            for name in inputs:
+                if self._increment(self._input_count, name):
+                    self.inputs.add(name)
+            for name in deferred:
+                self._deferred.setdefault(name, set()).add(block)
+
+        return flipped
+
+    def _increment(self, counts, name):
+        counts[name] = counts.get(name, 0) + 1
+        return counts[name] == 1
+
+    def _decrement(self, counts, name):
+        counts[name] -= 1
+        if counts[name] == 0:
+            del counts[name]
+            return True
+        return False
+
+    def _link(self, block):
+        ''' Update the graph entry for 'block' from its recorded analysis. '''
+        deps, _, _, deferred = self._analysis[block]
+        deps = deps | set(name for name in deferred
+                          if name in self._graph_input_count)
+        if deps:
+            self.dep_graph[block] = deps
+        else:
+            self.dep_graph.pop(block, None)
+
+    def _update_name(self, name):
+        ''' Update the graph entry and aggregate status of 'name'. '''
+        writers = self._writers.get(name)
+        conditional_writers = self._conditional_writers.get(name)
+        imported = name in self._importers
+
+        last = None
+        for blocks in (writers, conditional_writers):
+            if blocks and (last is None or
+                           self._position[blocks[-1]] > self._position[last]):
+                last = blocks[-1]
+        if last is None:
+            self.dep_graph.pop(name, None)
+        else:
+            self.dep_graph[name] = set([last])
+
+        for names, member in (
+            (self.outputs, bool(writers) and not imported),
+            (self.conditional_outputs,
+             bool(conditional_writers) and not writers and not imported),
+            (self.fromimports, imported)):
+            if member:
+                names.add(name)
+            else:
+                names.discard(name)
+
+    def _upstream_names(self, blocks):
+        ''' Names that 'blocks' read from, directly or transitively. '''
+        names, seen, stack = set(), set(), list(blocks)
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            if isinstance(node, basestring):
+                names.add(node)
+                continue
+            names |= node.inputs | self._written_names(node)
+            stack.extend(self.dep_graph.get(node, ()))
+        return names
+
+    def _downstream_names(self, blocks):
+        ''' Names that 'blocks' feed into, directly or transitively.
+
+            This over-approximates by ignoring execution order, which is
+            harmless for cache invalidation.
+        '''
+        names, seen, stack = set(), set(), list(blocks)
+        while stack:
+            block = stack.pop()
+            if block in seen:
+                continue
+            seen.add(block)
+            for name in self._written_names(block):
+                if name not in names:
+                    names.add(name)
+                    stack.extend(self._dependents.get(name, ()))
+        return names
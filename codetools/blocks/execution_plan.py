@@ -0,0 +1,200 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Compiled plans for executing the sub-blocks of a block.
+
+    Tracebacks from 'Block.execute' show the filename of the sub-block that
+    raised, and a code object only has one filename ('co_filename'), so
+    sub-blocks from different files can't share a code object. An
+    'ExecutionPlan' compiles each run of consecutive sub-blocks with the same
+    filename into one code object; the line numbers come from their ASTs, so
+    they are those of the original source. When there is more than one run, a
+    driver code object executes them in turn with 'exec' statements, so
+    executing a block takes one 'exec' from Python whatever the number of its
+    sub-blocks. (The 'compiler' package looks up each constant of a code
+    object by scanning the ones before it, so a driver for many runs is
+    itself split into drivers of at most 'DRIVER_SIZE' statements, run by
+    an outer driver.)
+
+    With 'continue_on_errors', every sub-block is compiled inside a generated
+    'try: ... except Exception: ...' statement, whose handler records the
+    exception and its formatted traceback, and execution goes on with the
+    next sub-block.
+
+    With a 'cancelled' callable, the code also calls it between sub-blocks
+    (after the first), and raises 'ExecutionCancelled' if it returns True.
+'''
+
+from __future__ import absolute_import
+
+from compiler.ast import (Assign, AssName, CallFunc, Const, Discard, Exec,
+                          Module, Stmt, TryExcept)
+import sys
+import threading
+from traceback import format_exc
+
+from six import exec_
+
+from .block import CompositeException, ExecutionCancelled
+from .compiler_.api import compile_ast
+
+# The most statements in a driver code object
+DRIVER_SIZE = 64
+
+
+class ExecutionPlan(object):
+    ''' The code objects that execute a block. '''
+
+    def __init__(self, block):
+        # The filename of the driver
+        self.filename = block._code_filename()
+
+        # A list of (value of '__file__' or None, filename of the code,
+        # sub-blocks, precompiled code or None)
+        self.groups = groups = []
+        if block.no_filenames_in_tracebacks:
+            groups.append((block.filename, self.filename,
+                           block.sub_blocks or [block], block._code))
+        else:
+            for sub_block in block.sub_blocks or [block]:
+                filename = sub_block._code_filename()
+                if groups and groups[-1][1] == filename:
+                    groups[-1][2].append(sub_block)
+                else:
+                    groups.append((sub_block.filename, filename, [sub_block],
+                                   None))
+
+        # (continue_on_errors, checkpoints) -> code object
+        self._codes = {}
+
+        # The exceptions recorded by the current execution in each thread
+        self._errors = threading.local()
+
+        # The 'cancelled' callable of the current execution in each thread
+        self._cancellation = threading.local()
+
+    ###########################################################################
+    # ExecutionPlan public interface
+    ###########################################################################
+
+    def execute(self, local_context, global_context={},
+                continue_on_errors=False, cancelled=None):
+        ''' Execute the block like 'Block.execute'. '''
+        key = (continue_on_errors, cancelled is not None)
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = self._compile(*key)
+
+        if cancelled is not None:
+            if cancelled():
+                raise ExecutionCancelled()
+            # Blocks may execute themselves, so keep the outer callable
+            outer_cancelled = getattr(self._cancellation, 'cancelled', None)
+            self._cancellation.cancelled = cancelled
+        try:
+            self._execute(code, local_context, global_context,
+                          continue_on_errors)
+        finally:
+            if cancelled is not None:
+                self._cancellation.cancelled = outer_cancelled
+
+    ###########################################################################
+    # ExecutionPlan protected interface
+    ###########################################################################
+
+    def _execute(self, code, local_context, global_context,
+                 continue_on_errors):
+        if not continue_on_errors:
+            if len(self.groups) == 1 and self.groups[0][0]:
+                local_context['__file__'] = self.groups[0][0]
+            exec_(code, global_context, local_context)
+            return
+
+        # Blocks may execute themselves, so keep the outer exceptions
+        outer = getattr(self._errors, 'exceptions', None)
+        self._errors.exceptions = exceptions = []
+        try:
+            exec_(code, global_context, local_context)
+        finally:
+            self._errors.exceptions = outer
+        if exceptions:
+            if len(exceptions) > 1:
+                raise CompositeException(exceptions)
+            else:
+                raise exceptions[0]
+
+    def _compile(self, continue_on_errors, checkpoints):
+        codes = [self._compile_group(sub_blocks, filename, code,
+                                     continue_on_errors, checkpoints)
+                 for _, filename, sub_blocks, code in self.groups]
+        if len(codes) == 1 and not (continue_on_errors and self.groups[0][0]):
+            return codes[0]
+
+        statements = []
+        for (file, _, sub_blocks, _), code in zip(self.groups, codes):
+            lineno = first_lineno(sub_blocks[0].ast)
+            if checkpoints and statements:
+                statements.append(self._checkpoint_statement(lineno))
+            if file:
+                statements.append(Assign([AssName('__file__', 'OP_ASSIGN')],
+                                         Const(file), lineno))
+            statements.append(Exec(Const(code), None, None, lineno))
+        while len(statements) > DRIVER_SIZE:
+            chunks = [statements[i:i + DRIVER_SIZE]
+                      for i in range(0, len(statements), DRIVER_SIZE)]
+            statements = [Exec(Const(self._compile_driver(chunk)), None, None,
+                               chunk[0].lineno)
+                          for chunk in chunks]
+        return self._compile_driver(statements)
+
+    def _compile_driver(self, statements):
+        return compile_ast(Module(None, Stmt(statements)), self.filename,
+                           'exec')
+
+    def _compile_group(self, sub_blocks, filename, code, continue_on_errors,
+                       checkpoints):
+        if not continue_on_errors:
+            # (The precompiled code has no checkpoints)
+            if code is not None and (len(sub_blocks) == 1 or
+                                     not checkpoints):
+                return code
+            if len(sub_blocks) == 1:
+                return sub_blocks[0]._code
+            statements = [b.ast for b in sub_blocks]
+        else:
+            record = Stmt([Discard(CallFunc(Const(self._record), []))])
+            statements = [TryExcept(Stmt([b.ast]),
+                                    [(Const(Exception), None, record)],
+                                    None, first_lineno(b.ast))
+                          for b in sub_blocks]
+        if checkpoints:
+            statements[1:] = [
+                node for b, statement in zip(sub_blocks[1:], statements[1:])
+                for node in (self._checkpoint_statement(first_lineno(b.ast)),
+                             statement)]
+        return compile_ast(Module(None, Stmt(statements)), filename, 'exec')
+
+    def _checkpoint_statement(self, lineno):
+        return Discard(CallFunc(Const(self._checkpoint), [], None, None,
+                                lineno), lineno)
+
+    def _checkpoint(self):
+        if self._cancellation.cancelled():
+            raise ExecutionCancelled()
+
+    def _record(self):
+        e = sys.exc_info()[1]
+        # save the current traceback
+        e.traceback = format_exc()
+        self._errors.exceptions.append(e)
+
+
+def first_lineno(ast):
+    ''' The first line number in 'ast', or None. '''
+    while ast.lineno is None and ast.getChildNodes():
+        ast = ast.getChildNodes()[0]
+    return ast.lineno
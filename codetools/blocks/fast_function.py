@@ -0,0 +1,134 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Compile blocks into Python functions.
+
+    'compile_function' turns a block into the body of a function that takes
+    the inputs as parameters and returns the outputs. The names the block
+    binds become fast locals, so no dictionary is built or looked up when the
+    function runs, which is what 'Block.get_function' needs for functions
+    called many times (e.g. by optimizers).
+
+    A function body doesn't run every block like 'exec' does: blocks that
+    return or yield, declare globals, use unqualified 'exec' (which is how
+    'from ... import *' is rewritten), or look at 'locals()' can't be compiled
+    this way, and 'compile_function' returns None for them.
+'''
+
+from __future__ import absolute_import
+
+import compiler
+from compiler.ast import Function, Getattr, Module, Name, Return, Stmt, Tuple
+from keyword import iskeyword
+import re
+
+from six import exec_
+
+from .compiler_.api import compile_ast
+from .execution_plan import first_lineno
+
+_identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+# Calls that behave differently in a function body
+_introspection = ('locals', 'vars', 'dir')
+
+
+class FunctionBodyChecker(object):
+    ''' Find the statements that don't mean the same in a function body.
+
+        Use with 'compiler.walk'; 'safe' ends up False if there are any.
+    '''
+
+    def __init__(self):
+        self.safe = True
+        self._depth = 0
+
+    def visitFunction(self, node):
+        self._nested(node)
+
+    def visitLambda(self, node):
+        self._nested(node)
+
+    def visitClass(self, node):
+        self._nested(node)
+
+    def visitReturn(self, node):
+        if self._depth == 0:
+            self.safe = False
+
+    def visitYield(self, node):
+        if self._depth == 0:
+            self.safe = False
+
+    def visitGlobal(self, node):
+        if self._depth == 0:
+            self.safe = False
+
+    def visitExec(self, node):
+        if node.locals is None:
+            self.safe = False
+        self._children(node)
+
+    def visitCallFunc(self, node):
+        function = node.node
+        if isinstance(function, Name) and function.name in _introspection \
+               and not node.args:
+            self.safe = False
+        # The rewriting of 'from ... import *' uses 'six.exec_'
+        if isinstance(function, Getattr) and function.attrname == 'exec_' \
+               and len(node.args) == 1:
+            self.safe = False
+        self._children(node)
+
+    def _nested(self, node):
+        self._depth += 1
+        self._children(node)
+        self._depth -= 1
+
+    def _children(self, node):
+        for child in node.getChildNodes():
+            self.visit(child)
+
+
+def is_identifier(name):
+    return bool(_identifier.match(name)) and not iskeyword(name)
+
+
+def compile_function(block, inputs, outputs, name='block_function'):
+    ''' A function computing 'outputs' from 'inputs' with the code of
+        'block', or None if the block can't be the body of a function.
+
+        The function returns the value of the output if there is one, and a
+        tuple of values otherwise.
+    '''
+    if not all(is_identifier(input) for input in inputs) or \
+           len(set(inputs)) != len(inputs):
+        return None
+    if not compiler.walk(block.ast, FunctionBodyChecker()).safe:
+        return None
+
+    try:
+        results = [compiler.parse(output, mode='eval').node
+                   for output in outputs]
+    except SyntaxError:
+        return None
+    if len(results) == 1:
+        [result] = results
+    else:
+        result = Tuple(results)
+
+    lineno = first_lineno(block.ast)
+    function = Function(None, name, list(inputs), (), 0, None,
+                        Stmt([block.ast, Return(result, lineno)]), lineno)
+    try:
+        code = compile_ast(Module(None, Stmt([function])),
+                           block._code_filename(), 'exec')
+    except SyntaxError:
+        return None
+    namespace = {}
+    exec_(code, namespace)
+    return namespace[name]
@@ -0,0 +1,490 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Fusion of elementwise NumPy statements.
+
+    A chain of statements like::
+
+        a = x * y
+        b = a + z
+        c = sqrt(b)
+
+    allocates a full temporary array for every operation. 'fuse_elementwise'
+    replaces each run of consecutive elementwise statements in a block with a
+    single statement calling a 'Kernel', which evaluates the run a chunk of
+    rows at a time with 'out=' ufunc calls into a few reusable chunk-sized
+    buffers. Only the names the rest of the block reads (or that nothing
+    reads, or that are listed in 'keep') are bound, each to a full array
+    written in place; the other intermediate names are never materialized.
+
+    The fused statement gets its kernel from 'cached_kernel', passing it the
+    statements encoded as nested lists of strings, e.g.::
+
+        b = __import__('codetools.blocks.fusion', None, None,
+                       ['cached_kernel']).cached_kernel(
+            [['a', ['Mul', ['name', 'x'], ['name', 'y']]],
+             ['b', ['call', 'sqrt', ['name', 'a']]]], ['b'], 65536)(x, y, sqrt)
+
+    so that a fused block can be unparsed, pickled, and compiled to code
+    that can be marshalled (for 'Block.execute_processes').
+
+    A statement is elementwise if it assigns a single name an expression
+    built from names, numbers, the arithmetic operators, and calls (with
+    positional arguments) to names or dotted names. Whether the names are
+    arrays and the functions ufuncs is only known when the kernel runs: if
+    the arrays don't all have the same shape, or a function isn't a ufunc, or
+    a statement doesn't involve an array, the kernel executes the original
+    statements instead.
+'''
+
+from __future__ import absolute_import
+
+from ast import literal_eval
+from compiler.ast import (Add, Assign, AssName, AssTuple, CallFunc, Const, Div,
+                          FloorDiv, Getattr, Keyword, List, Mod, Module, Mul,
+                          Name, Power, Stmt, Sub, UnaryAdd, UnarySub)
+import numbers
+
+import numpy
+from six import exec_
+
+from ..util.cache import LRUCache
+from .compiler_.api import compile_ast
+from .execution_plan import first_lineno
+
+BINARY_UFUNCS = {
+    Add: numpy.add, Sub: numpy.subtract, Mul: numpy.multiply,
+    Div: numpy.divide, FloorDiv: numpy.floor_divide, Mod: numpy.remainder,
+    Power: numpy.power,
+}
+
+UNARY_UFUNCS = {UnaryAdd: numpy.positive, UnarySub: numpy.negative}
+
+# class name -> AST class, for the operators
+OPERATORS = dict((cls.__name__, cls)
+                 for cls in list(BINARY_UFUNCS) + list(UNARY_UFUNCS))
+
+
+def dotted_name(node):
+    ''' 'a.b.c' for the AST of 'a.b.c', or None. '''
+    parts = []
+    while isinstance(node, Getattr):
+        parts.append(node.attrname)
+        node = node.expr
+    if not isinstance(node, Name):
+        return None
+    parts.append(node.name)
+    return '.'.join(reversed(parts))
+
+
+def is_elementwise(expr):
+    ''' Whether 'expr' may be an elementwise array expression. '''
+    if isinstance(expr, Name):
+        return True
+    if isinstance(expr, Const):
+        return isinstance(expr.value, numbers.Number)
+    if expr.__class__ in BINARY_UFUNCS:
+        return is_elementwise(expr.left) and is_elementwise(expr.right)
+    if expr.__class__ in UNARY_UFUNCS:
+        return is_elementwise(expr.expr)
+    if isinstance(expr, CallFunc):
+        return dotted_name(expr.node) is not None and expr.args and \
+               expr.star_args is None and expr.dstar_args is None and \
+               all(not isinstance(arg, Keyword) and is_elementwise(arg)
+                   for arg in expr.args)
+    return False
+
+
+def called_roots(expr):
+    ''' The root names of the functions called in an elementwise 'expr'. '''
+    roots = set()
+    if isinstance(expr, CallFunc):
+        roots.add(dotted_name(expr.node).split('.')[0])
+        children = expr.args
+    else:
+        children = expr.getChildNodes()
+    for child in children:
+        roots |= called_roots(child)
+    return roots
+
+
+def input_roots(block):
+    ''' The names the (possibly dotted) inputs of 'block' start from, e.g.
+        'a' for 'a.shape'.
+    '''
+    return set(name.split('.', 1)[0] for name in block.inputs)
+
+
+def elementwise_statement(ast):
+    ''' (name, expression) if 'ast' assigns an elementwise operation to a
+        name, else None.
+    '''
+    if not isinstance(ast, Assign) or len(ast.nodes) != 1 or \
+           not isinstance(ast.nodes[0], AssName) or \
+           ast.nodes[0].flags != 'OP_ASSIGN':
+        return None
+    expr = ast.expr
+    if isinstance(expr, (Name, Const)) or not is_elementwise(expr):
+        return None
+    return ast.nodes[0].name, expr
+
+
+class Kernel(object):
+    ''' Evaluates a run of elementwise statements in chunks.
+
+        Called with the values of 'inputs', returns the values of 'outputs'
+        (a tuple, or the value if there is only one output).
+    '''
+
+    def __init__(self, statements, outputs, chunk_size=1 << 16,
+                 filename='<fused kernel>'):
+        # [(name, expression)]
+        self.statements = statements
+        self.outputs = list(outputs)
+
+        # The number of elements in a chunk
+        self.chunk_size = chunk_size
+
+        # The free names of the statements, in order of appearance
+        self.inputs = []
+
+        # [(function, operands, register)], where functions are ufuncs or
+        # dotted names, and operands are ('input', name), ('const', value) or
+        # ('register', index)
+        self.ops = []
+
+        # name -> register
+        self.registers = {}
+
+        for name, expr in statements:
+            _, register = self._emit(expr)
+            self.registers[name] = register
+        self.roots = [self.registers[name] for name, _ in statements]
+
+        # register -> index of the last op that reads it
+        self.last_use = {}
+        for i, (_, operands, _) in enumerate(self.ops):
+            for kind, value in operands:
+                if kind == 'register':
+                    self.last_use[value] = i
+
+        self._code = compile_ast(Module(None, Stmt([
+            Assign([AssName(name, 'OP_ASSIGN')], expr)
+            for name, expr in statements])), filename, 'exec')
+
+    def __repr__(self):
+        return '<Kernel %s>' % ', '.join(self.outputs)
+
+    def __call__(self, *args):
+        values = dict(zip(self.inputs, args))
+        plan = self._plan(values)
+        if plan is None:
+            results = self._execute(values)
+        else:
+            results = self._evaluate(values, *plan)
+        if len(results) == 1:
+            return results[0]
+        return tuple(results)
+
+    ###########################################################################
+    # Kernel protected interface
+    ###########################################################################
+
+    def _emit(self, expr):
+        ''' Add the ops computing 'expr'; return the operand for its value.
+        '''
+        if isinstance(expr, Name):
+            if expr.name in self.registers:
+                return ('register', self.registers[expr.name])
+            self._input(expr.name)
+            return ('input', expr.name)
+        if isinstance(expr, Const):
+            return ('const', expr.value)
+        if expr.__class__ in BINARY_UFUNCS:
+            function = BINARY_UFUNCS[expr.__class__]
+            operands = [self._emit(expr.left), self._emit(expr.right)]
+        elif expr.__class__ in UNARY_UFUNCS:
+            function = UNARY_UFUNCS[expr.__class__]
+            operands = [self._emit(expr.expr)]
+        else:
+            function = dotted_name(expr.node)
+            self._input(function.split('.')[0])
+            operands = [self._emit(arg) for arg in expr.args]
+        register = len(self.ops)
+        self.ops.append((function, operands, register))
+        return ('register', register)
+
+    def _input(self, name):
+        if name not in self.inputs:
+            self.inputs.append(name)
+
+    def _plan(self, values):
+        ''' (functions, shape, dtypes) for evaluating the ops over 'values'
+            in chunks, or None if they must be executed as statements.
+        '''
+        functions = []
+        for function, operands, _ in self.ops:
+            if isinstance(function, basestring):
+                parts = function.split('.')
+                function = values[parts[0]]
+                try:
+                    for part in parts[1:]:
+                        function = getattr(function, part)
+                except AttributeError:
+                    return None
+                if not isinstance(function, numpy.ufunc) or \
+                       function.nin != len(operands) or function.nout != 1:
+                    return None
+            functions.append(function)
+
+        # The array inputs must all have the same shape
+        shape = None
+        for _, operands, _ in self.ops:
+            for kind, value in operands:
+                if kind != 'input':
+                    continue
+                value = values[value]
+                if isinstance(value, numpy.ndarray) and value.ndim > 0:
+                    if value.dtype.hasobject or \
+                           shape is not None and value.shape != shape:
+                        return None
+                    shape = value.shape
+                elif not isinstance(value, (numbers.Number, numpy.generic,
+                                            numpy.ndarray)):
+                    return None
+        if shape is None:
+            return None
+
+        # Every statement must compute an array; evaluate the ops on the
+        # first row for the dtypes of the results
+        samples = []
+        try:
+            with numpy.errstate(all='ignore'):
+                for function, (_, operands, _) in zip(functions, self.ops):
+                    args = [self._operand(operand, values, samples, 0, 1)
+                            for operand in operands]
+                    samples.append(function(*args))
+        except Exception:
+            return None
+        for register in self.roots:
+            if numpy.shape(samples[register]) != (1,) + shape[1:]:
+                return None
+        dtypes = [sample.dtype for sample in samples]
+        return functions, shape, dtypes
+
+    def _operand(self, operand, values, registers, start, stop):
+        kind, value = operand
+        if kind == 'register':
+            return registers[value]
+        if kind == 'const':
+            return value
+        value = values[value]
+        if isinstance(value, numpy.ndarray) and value.ndim > 0:
+            return value[start:stop]
+        return value
+
+    def _evaluate(self, values, functions, shape, dtypes):
+        rows = shape[0]
+        row_size = int(numpy.prod(shape[1:]))
+        step = max(1, min(rows, self.chunk_size // max(row_size, 1)))
+
+        outputs = {}
+        for name in self.outputs:
+            register = self.registers[name]
+            outputs[register] = numpy.empty(shape, dtypes[register])
+
+        # Assign chunk buffers to the other registers, reusing the buffers
+        # of the registers that aren't read anymore
+        buffers, free, assigned = [], {}, {}
+        for i, (_, operands, register) in enumerate(self.ops):
+            for kind, value in operands:
+                if kind == 'register' and value not in outputs and \
+                       self.last_use[value] == i:
+                    free.setdefault(dtypes[value], []).append(
+                        assigned[value])
+            if register in outputs:
+                continue
+            available = free.get(dtypes[register])
+            if available:
+                assigned[register] = available.pop()
+            else:
+                assigned[register] = len(buffers)
+                buffers.append(numpy.empty((step,) + shape[1:],
+                                           dtypes[register]))
+
+        registers = [None] * len(self.ops)
+        for start in range(0, rows, step):
+            stop = min(start + step, rows)
+            for function, (_, operands, register) in zip(functions,
+                                                         self.ops):
+                args = [self._operand(operand, values, registers, start,
+                                      stop)
+                        for operand in operands]
+                if register in outputs:
+                    out = outputs[register][start:stop]
+                else:
+                    out = buffers[assigned[register]][:stop - start]
+                registers[register] = function(*args, out=out)
+
+        return [outputs[self.registers[name]] for name in self.outputs]
+
+    def _execute(self, values):
+        namespace = dict(values)
+        exec_(self._code, {}, namespace)
+        return [namespace[name] for name in self.outputs]
+
+
+def encode_statements(statements):
+    ''' The [(name, expression)] of elementwise statements as nested lists
+        of strings, which 'decode_statements' turns back.
+    '''
+    return [[name, _encode(expr)] for name, expr in statements]
+
+
+def decode_statements(data):
+    return [(name, _decode(expr)) for name, expr in data]
+
+
+# (encoded statements, outputs, chunk size) -> Kernel
+_kernels = LRUCache(max_size=256)
+
+
+def cached_kernel(statements, outputs, chunk_size):
+    ''' The 'Kernel' for the encoded elementwise 'statements'. '''
+    key = (repr(statements), tuple(outputs), chunk_size)
+    kernel = _kernels.get(key)
+    if kernel is None:
+        kernel = _kernels[key] = Kernel(decode_statements(statements),
+                                        outputs, chunk_size)
+    return kernel
+
+
+def fuse_elementwise(block, keep=(), chunk_size=1 << 16):
+    ''' A block computing the same as 'block', with its runs of elementwise
+        statements fused into kernels.
+
+        The names in 'keep' are bound even if no statement reads them.
+    '''
+    from .block import Block
+
+    sub_blocks = block.sub_blocks or [block]
+    keep = set(keep)
+
+    # Split the sub-blocks into runs of elementwise statements, where no
+    # name is assigned twice or read before it's assigned
+    runs, run, assigned, read = [], [], set(), set()
+    for sub_block in sub_blocks:
+        statement = elementwise_statement(sub_block.ast)
+        roots = input_roots(sub_block)
+        if statement is not None and statement[0] in roots:
+            statement = None
+        if run and (statement is None or statement[0] in assigned or
+                    statement[0] in read or
+                    not called_roots(statement[1]).isdisjoint(assigned)):
+            runs.append(run)
+            run, assigned, read = [], set(), set()
+        if statement is None:
+            runs.append([(sub_block, None)])
+            continue
+        run.append((sub_block, statement))
+        read |= roots - assigned
+        assigned.add(statement[0])
+    if run:
+        runs.append(run)
+
+    result = []
+    for run in runs:
+        fused = _fuse(run, sub_blocks, keep, chunk_size)
+        if fused is None:
+            result.extend(sub_block for sub_block, _ in run)
+        else:
+            result.append(fused)
+
+    fused_block = Block(result)
+    fused_block.filename = block.filename
+    return fused_block
+
+
+def _fuse(run, sub_blocks, keep, chunk_size):
+    ''' A sub-block replacing the 'run', or None if it isn't worth it. '''
+    from .block import Block
+
+    statements = [statement for _, statement in run]
+    if any(statement is None for statement in statements):
+        return None
+
+    members = set(sub_block for sub_block, _ in run)
+    consumed_outside = set()
+    for sub_block in sub_blocks:
+        if sub_block not in members:
+            consumed_outside |= input_roots(sub_block)
+    consumed_inside = set()
+    for sub_block, _ in run:
+        consumed_inside |= input_roots(sub_block)
+    outputs = [name for name, _ in statements
+               if name in keep or name in consumed_outside or
+               name not in consumed_inside]
+
+    encoded = encode_statements(statements)
+    kernel = cached_kernel(encoded, outputs, chunk_size)
+    if len(kernel.ops) < 2:
+        return None
+
+    lineno = first_lineno(run[0][0].ast)
+    if len(outputs) == 1:
+        targets = [AssName(outputs[0], 'OP_ASSIGN')]
+    else:
+        targets = [AssTuple([AssName(name, 'OP_ASSIGN')
+                             for name in outputs])]
+    module = CallFunc(Name('__import__'), [
+        Const(__name__), Name('None'), Name('None'),
+        List([Const('cached_kernel')])])
+    get_kernel = CallFunc(Getattr(module, 'cached_kernel'), [
+        _literal(encoded), _literal(outputs), Const(chunk_size)])
+    call = CallFunc(get_kernel, [Name(name) for name in kernel.inputs])
+    fused = Block(Assign(targets, call, lineno))
+    fused.filename = run[0][0].filename
+    return fused
+
+
+def _encode(expr):
+    if isinstance(expr, Name):
+        return ['name', expr.name]
+    if isinstance(expr, Const):
+        return ['const', repr(expr.value)]
+    if isinstance(expr, CallFunc):
+        return ['call', dotted_name(expr.node)] + map(_encode, expr.args)
+    return [expr.__class__.__name__] + map(_encode, expr.getChildNodes())
+
+
+def _decode(data):
+    kind = data[0]
+    if kind == 'name':
+        return Name(data[1])
+    if kind == 'const':
+        try:
+            return Const(literal_eval(data[1]))
+        except ValueError:
+            # (inf and nan)
+            return Const(float(data[1]))
+    if kind == 'call':
+        parts = data[1].split('.')
+        node = Name(parts[0])
+        for part in parts[1:]:
+            node = Getattr(node, part)
+        return CallFunc(node, map(_decode, data[2:]))
+    cls = OPERATORS[kind]
+    if cls in BINARY_UFUNCS:
+        return cls(tuple(map(_decode, data[1:])))
+    return cls(_decode(data[1]))
+
+
+def _literal(data):
+    ''' The AST of a list literal for nested lists of strings. '''
+    if isinstance(data, list):
+        return List(map(_literal, data))
+    return Const(data)
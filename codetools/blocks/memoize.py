@@ -0,0 +1,306 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Memoized execution of the sub-blocks of a block.
+
+    'Memoizer.execute' runs a block like 'Block.execute', one sub-block at a
+    time, but first fingerprints the values of the names each sub-block reads.
+    If a sub-block already ran with the same fingerprints, the values it wrote
+    then are assigned again instead of running it.
+
+    Fingerprints are exact for immutable values: numbers, strings, None, and
+    tuples and frozensets of fingerprintable values are compared by value,
+    and NumPy arrays by dtype, shape and a hash of their contents. Modules,
+    functions, classes and the objects of methods are compared by identity.
+    Other (mutable) objects are compared by identity and a version number,
+    for the types that have a version function registered with
+    'register_version'. A sub-block that reads or writes a value that can't
+    be fingerprinted always runs.
+
+    So do the sub-blocks that have side effects other than their writes to
+    names: sub-blocks that modify objects in place ('x[0] = y'), that don't
+    write any names, that call one of the functions in
+    'Memoizer.impure_functions', or that were marked with
+    'Memoizer.mark_impure'.
+'''
+
+from __future__ import absolute_import
+
+import compiler
+from compiler.ast import Getattr, Name
+import hashlib
+from traceback import format_exc
+import types
+from weakref import WeakKeyDictionary
+
+from ..util.cache import LRUCache
+from .block import CompositeException, ExecutionCancelled
+from .parallel import mutated_names, root_name, written_names
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Types whose values are their own fingerprint
+VALUE_TYPES = (type(None), bool, int, long, float, complex, str, unicode)
+
+# Types that are fingerprinted by identity alone
+IDENTITY_TYPES = (types.ModuleType, types.FunctionType,
+                  types.BuiltinFunctionType, type, types.ClassType)
+
+# type -> function giving a version number that changes with the object
+_versions = {}
+
+
+def register_version(cls, version):
+    ''' Fingerprint instances of 'cls' by identity and 'version(instance)'.
+
+        'version' must return a different value whenever the instance has
+        been modified.
+    '''
+    _versions[cls] = version
+
+
+class Unfingerprintable(Exception):
+    pass
+
+
+def fingerprint(value):
+    ''' A hashable value that is equal for equal inputs to a statement.
+
+        Raises Unfingerprintable for values that can't be compared safely.
+
+        >>> fingerprint((1, 'a')) == fingerprint((1, 'a'))
+        True
+        >>> fingerprint(1) == fingerprint(1.0)
+        False
+    '''
+    cls = type(value)
+    if cls in VALUE_TYPES:
+        return (cls, value)
+    if cls in (tuple, frozenset):
+        items = [fingerprint(item) for item in value]
+        if cls is frozenset:
+            items = frozenset(items)
+        return (cls, tuple(items) if cls is tuple else items)
+    if numpy is not None and cls is numpy.ndarray and \
+            not value.dtype.hasobject:
+        data = numpy.ascontiguousarray(value).view(numpy.uint8)
+        return (cls, value.dtype.str, value.shape,
+                hashlib.sha1(data).digest())
+    if isinstance(value, IDENTITY_TYPES):
+        return Identity(value)
+    if cls is types.MethodType:
+        return (cls, Identity(value.im_func), Identity(value.im_self))
+    for base in cls.__mro__:
+        if base in _versions:
+            return (Identity(value), _versions[base](value))
+    raise Unfingerprintable(cls)
+
+
+class Identity(object):
+    ''' Compares by the identity of 'value', and keeps it alive so that its
+        id isn't reused.
+    '''
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return type(other) is Identity and self.value is other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return id(self.value)
+
+
+class CallFinder(object):
+    ''' Find the dotted names of the functions called by name.
+
+        Use with 'compiler.walk'; the names end up in 'names'.
+    '''
+
+    def __init__(self):
+        self.names = set()
+
+    def visitCallFunc(self, node):
+        parts, function = [], node.node
+        while isinstance(function, Getattr):
+            parts.append(function.attrname)
+            function = function.expr
+        if isinstance(function, Name):
+            parts.append(function.name)
+            self.names.add('.'.join(reversed(parts)))
+        for child in node.getChildNodes():
+            self.visit(child)
+
+
+def called_names(block):
+    ''' The (dotted) names of the functions that 'block' calls. '''
+    return compiler.walk(block.ast, CallFinder()).names
+
+
+class Memoizer(object):
+    ''' Executes blocks, replaying sub-blocks whose inputs are unchanged.
+
+        A memoizer remembers at most 'max_size' executions of sub-blocks,
+        evicting the least recently used ones first.
+    '''
+
+    # Calls to functions whose dotted names contain one of these make a
+    # statement impure (e.g. 'random' matches 'numpy.random.rand')
+    IMPURE_FUNCTIONS = frozenset(['random', 'time', 'clock', 'now', 'today',
+                                  'input', 'raw_input', 'open', 'urandom',
+                                  'uuid1', 'uuid4'])
+
+    def __init__(self, max_size=1024, impure_functions=IMPURE_FUNCTIONS):
+        self.cache = LRUCache(max_size=max_size)
+        self.impure_functions = set(impure_functions)
+
+        # uuids of the sub-blocks marked impure
+        self._impure = set()
+
+        # sub-block -> (read names, written names, whether it's pure apart
+        # from the marks and impure functions, called names)
+        self._analysis = WeakKeyDictionary()
+
+    ###########################################################################
+    # Memoizer public interface
+    ###########################################################################
+
+    def mark_impure(self, block, impure=True):
+        ''' Always run 'block', or the sub-blocks of 'block'.
+
+            With 'impure=False', remove the mark instead.
+        '''
+        for sub_block in block.sub_blocks or [block]:
+            if impure:
+                self._impure.add(sub_block.uuid)
+            else:
+                self._impure.discard(sub_block.uuid)
+
+    def is_pure(self, block):
+        ''' Whether a sub-block may be replayed. '''
+        if block.uuid in self._impure:
+            return False
+        _, _, pure, called = self._analyze(block)
+        if not pure:
+            return False
+        for name in called:
+            parts = name.split('.')
+            for i in range(len(parts)):
+                for j in range(i + 1, len(parts) + 1):
+                    if '.'.join(parts[i:j]) in self.impure_functions:
+                        return False
+        return True
+
+    def execute(self, block, local_context, global_context={},
+                continue_on_errors=False, cancelled=None):
+        ''' Execute 'block' like 'Block.execute', with memoization. '''
+        sub_blocks = block.sub_blocks or [block]
+        if not continue_on_errors:
+            for sub_block in sub_blocks:
+                if cancelled is not None and cancelled():
+                    raise ExecutionCancelled()
+                self._execute(sub_block, local_context, global_context)
+            return
+
+        exceptions = []
+        for sub_block in sub_blocks:
+            if cancelled is not None and cancelled():
+                raise ExecutionCancelled()
+            try:
+                self._execute(sub_block, local_context, global_context)
+            except Exception as e:
+                # save the current traceback
+                e.traceback = format_exc()
+                exceptions.append(e)
+        if exceptions:
+            if len(exceptions) > 1:
+                raise CompositeException(exceptions)
+            else:
+                raise exceptions[0]
+
+    def clear(self):
+        ''' Forget all the recorded executions. '''
+        self.cache.clear()
+
+    ###########################################################################
+    # Memoizer protected interface
+    ###########################################################################
+
+    def _analyze(self, block):
+        analysis = self._analysis.get(block)
+        if analysis is None:
+            writes = written_names(block)
+            # Names assigned unconditionally don't affect the result
+            reads = set(root_name(name) for name in
+                        block.inputs | block.conditional_outputs |
+                        (block.outputs - writes))
+            analysis = (reads, writes,
+                        bool(writes) and not mutated_names(block),
+                        called_names(block))
+            self._analysis[block] = analysis
+        return analysis
+
+    def _execute(self, block, local_context, global_context):
+        if not self.is_pure(block):
+            block.execute(local_context, global_context)
+            return
+
+        try:
+            key = (block.uuid, self._fingerprints(self._analyze(block)[0],
+                                                  local_context,
+                                                  global_context))
+        except Unfingerprintable:
+            block.execute(local_context, global_context)
+            return
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            outputs, output_fingerprints = entry
+            try:
+                replayable = output_fingerprints == tuple(
+                    fingerprint(value) for _, value in outputs)
+            except Unfingerprintable:
+                replayable = False
+            if replayable:
+                for name, value in outputs:
+                    local_context[name] = value
+                return
+            del self.cache[key]
+
+        block.execute(local_context, global_context)
+
+        outputs = tuple((name, local_context[name])
+                        for name in sorted(self._analyze(block)[1])
+                        if name in local_context)
+        try:
+            output_fingerprints = tuple(fingerprint(value)
+                                        for _, value in outputs)
+        except Unfingerprintable:
+            return
+        self.cache[key] = (outputs, output_fingerprints)
+
+    def _fingerprints(self, names, local_context, global_context):
+        result = []
+        for name in sorted(names):
+            if name in local_context:
+                value = local_context[name]
+            elif name in global_context:
+                value = global_context[name]
+            else:
+                result.append((name,))
+                continue
+            result.append((name, fingerprint(value)))
+        return tuple(result)
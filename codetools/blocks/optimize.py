@@ -0,0 +1,282 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Constant folding and dead-code elimination for blocks.
+
+    'optimize' simplifies a block before it runs, in two passes over its
+    sub-blocks:
+
+    - Constant propagation and folding. A name assigned a constant ('k = 2',
+      see 'analysis.is_const') is replaced by its value in the simple
+      statements that follow, until it's bound again, and the operators
+      applied to constants are evaluated: 'y = k * 3 + f(k)' becomes
+      'y = 6 + f(2)'. Only immutable values (numbers, strings, None and
+      tuples of these) are propagated, so that no statement shares an object
+      it could mutate.
+
+    - Dead-code elimination. An assignment whose names are all bound again
+      before anything reads them ('x = expensive()' followed by 'x = 2') is
+      dropped, as well as, if 'outputs' is given, an assignment of names that
+      nothing reads later and that aren't outputs.
+
+    Like 'Block.restrict', this assumes that an assignment has no effect
+    other than binding its names. Statements that don't bind names (e.g.
+    'print x' or 'l.append(x)') are always kept.
+
+    The result is a new block, with an 'OptimizationReport' of what changed.
+'''
+
+from __future__ import absolute_import
+
+from compiler.ast import (Add, And, Assign, AssList, AssName, AssTuple,
+                          AugAssign, Bitand, Bitor, Bitxor, Compare, Const,
+                          Discard, Div, Expression, FloorDiv, From, GenExpr,
+                          Import, Invert, Lambda, LeftShift, ListComp, Mod,
+                          Mul, Name, Not, Or, Power, Print, Printnl,
+                          RightShift, Sub, Tuple, UnaryAdd, UnarySub)
+
+from .analysis import Transformer, is_const
+from .compiler_.api import eval_ast
+from .compiler_unparse import unparse
+
+# The operators folded when all their operands are constants
+FOLDED = (Add, And, Bitand, Bitor, Bitxor, Compare, Div, FloorDiv, Invert,
+          LeftShift, Mod, Mul, Not, Or, Power, RightShift, Sub, Tuple,
+          UnaryAdd, UnarySub)
+
+# The largest string, tuple or integer (in bits) produced by folding
+MAX_FOLDED_SIZE = 4096
+
+
+class OptimizationReport(object):
+    ''' What 'optimize' changed in a block. '''
+
+    def __init__(self):
+        # (source, reason) of the sub-blocks removed, where 'reason' is
+        # 'overwritten' or 'unused'
+        self.removed = []
+
+        # (source before, source after) of the statements folded
+        self.folded = []
+
+        # The constants propagated, by name
+        self.constants = {}
+
+    def __str__(self):
+        lines = ['removed (%s): %s' % (reason, source)
+                 for source, reason in self.removed]
+        lines += ['folded: %s -> %s' % (before, after)
+                  for before, after in self.folded]
+        return '\n'.join(lines)
+
+
+def optimize(block, outputs=None):
+    ''' The block equivalent to 'block' with its constants folded and its
+        dead code removed, and the 'OptimizationReport' of the changes.
+
+        'outputs' are the names needed after the block runs; by default, all
+        the names it binds.
+    '''
+    from .block import Block
+
+    report = OptimizationReport()
+    sub_blocks = block.sub_blocks or [block]
+    sub_blocks = fold_constants(sub_blocks, report)
+    sub_blocks = remove_dead_code(sub_blocks, outputs, report)
+
+    optimized = Block(sub_blocks)
+    optimized.filename = block.filename
+    return optimized, report
+
+
+def fold_constants(sub_blocks, report):
+    ''' 'sub_blocks' with the constants propagated and folded. '''
+    from .block import Block
+
+    constants = {}
+    result = []
+    for sub_block in sub_blocks:
+        ast = sub_block.ast
+        folder = ConstantFolder(constants)
+        if isinstance(ast, (Assign, Discard, Print, Printnl)):
+            folded = folder.transform(ast)
+        elif isinstance(ast, AugAssign):
+            folded = AugAssign(ast.node, ast.op, folder.transform(ast.expr))
+        else:
+            folded = ast
+
+        if folder.changed:
+            folded.lineno = ast.lineno
+            report.folded.append((_source(ast), _source(folded)))
+            new = Block(folded)
+            new.filename = sub_block.filename
+            sub_block = new
+        result.append(sub_block)
+
+        # Forget the names bound again, and remember the new constants
+        if isinstance(ast, From) and ast.names[0][0] == '*':
+            constants.clear()
+        for name in _bound_names(sub_block):
+            constants.pop(name, None)
+        if isinstance(folded, Assign) and len(folded.nodes) == 1 and \
+               isinstance(folded.nodes[0], AssName) and \
+               folded.nodes[0].flags == 'OP_ASSIGN' and \
+               is_const(folded.expr):
+            value = eval_ast(Expression(folded.expr))
+            if _is_immutable(value):
+                constants[folded.nodes[0].name] = value
+                report.constants[folded.nodes[0].name] = value
+    return result
+
+
+def remove_dead_code(sub_blocks, outputs, report):
+    ''' 'sub_blocks' without the assignments of names that are never read.
+    '''
+    # Walk backwards, tracking the names read later ('live'), or, when all
+    # the names are outputs, the names bound again before any read ('dead')
+    live = None if outputs is None else set(_root(name) for name in outputs)
+    dead = set()
+    assigned = set()
+    kept = []
+    for sub_block in reversed(sub_blocks):
+        names = _assigned_names(sub_block.ast)
+        if names:
+            if live is None:
+                removable = names <= dead
+            else:
+                removable = names.isdisjoint(live)
+            if removable:
+                reason = 'overwritten' if names <= assigned else 'unused'
+                report.removed.insert(0, (_source(sub_block.ast), reason))
+                continue
+
+        kept.append(sub_block)
+        bound = set(name for name in sub_block.outputs if '.' not in name)
+        read = set(_root(name) for name in sub_block.inputs |
+                   sub_block.conditional_outputs)
+        assigned |= bound
+        if live is None:
+            dead = (dead | bound) - read
+        else:
+            live = (live - bound) | read
+    kept.reverse()
+    return kept
+
+
+class ConstantFolder(Transformer):
+    ''' Replaces the names of constants with their values, and folds the
+        operators on constants.
+    '''
+
+    def __init__(self, constants):
+        super(ConstantFolder, self).__init__()
+        self.constants = constants
+        self.changed = False
+
+    def transformName(self, node):
+        if node.name in self.constants:
+            self.changed = True
+            return Const(self.constants[node.name])
+        return Name(node.name)
+
+    # Names in these are bound by the expressions themselves
+    def transformLambda(self, node):
+        return node
+
+    transformGenExpr = transformListComp = transformLambda
+
+    def _transform_children(self, node):
+        node = super(ConstantFolder, self)._transform_children(node)
+        if isinstance(node, FOLDED) and \
+               all(isinstance(child, Const) for child in node.getChildNodes()):
+            # (Don't even compute results that would be too large, like
+            # '2 ** 10**10')
+            if _estimated_size(node) > MAX_FOLDED_SIZE:
+                return node
+            try:
+                value = eval_ast(Expression(node))
+            except Exception:
+                return node
+            if _is_immutable(value) and _size(value) <= MAX_FOLDED_SIZE:
+                self.changed = True
+                return Const(value)
+        return node
+
+
+def _source(ast):
+    return unparse(ast).strip()
+
+
+def _root(name):
+    return name.split('.')[0]
+
+
+def _is_immutable(value):
+    if isinstance(value, tuple):
+        return all(_is_immutable(item) for item in value)
+    return value is None or isinstance(value, (bool, int, long, float,
+                                               complex, basestring))
+
+
+def _size(value):
+    if isinstance(value, (int, long)) and not isinstance(value, bool):
+        return value.bit_length()
+    if isinstance(value, (basestring, tuple)):
+        return len(value)
+    return 0
+
+
+def _estimated_size(node):
+    ''' An upper bound of the '_size' of the result of an operator whose
+        operands are constants, for the operators that can make it huge.
+    '''
+    if not isinstance(node, (Power, Mul, LeftShift)):
+        return 0
+    left, right = node.left.value, node.right.value
+    if isinstance(node, Mul) and isinstance(left, (int, long)):
+        left, right = right, left
+    if not isinstance(right, (int, long)):
+        return 0
+    if isinstance(left, (basestring, tuple)):
+        return len(left) * right if isinstance(node, Mul) else 0
+    if not isinstance(left, (int, long)):
+        return 0
+    if isinstance(node, Power):
+        if right < 0 or -1 <= left <= 1:
+            return 0
+        return left.bit_length() * right
+    if isinstance(node, LeftShift):
+        return left.bit_length() + max(right, 0)
+    return left.bit_length() + right.bit_length()
+
+
+def _assigned_names(ast):
+    ''' The names an assignment of names only binds, or an empty set. '''
+    if not isinstance(ast, Assign):
+        return set()
+    names = set()
+    targets = list(ast.nodes)
+    while targets:
+        target = targets.pop()
+        if isinstance(target, AssName) and target.flags == 'OP_ASSIGN':
+            names.add(target.name)
+        elif isinstance(target, (AssTuple, AssList)):
+            targets.extend(target.nodes)
+        else:
+            return set()
+    return names
+
+
+def _bound_names(sub_block):
+    ''' All the names 'sub_block' may bind, including its imports. '''
+    names = set(_root(name) for name in sub_block.outputs |
+                sub_block.conditional_outputs)
+    ast = sub_block.ast
+    if isinstance(ast, (Import, From)):
+        for name, asname in ast.names:
+            names.add(asname or _root(name))
+    return names
@@ -0,0 +1,390 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Wavefront execution of the sub-blocks of a block.
+
+    Sub-blocks that don't depend on each other can run at the same time.
+    'WavefrontExecution' submits each sub-block to a 'concurrent.futures'
+    executor as soon as the sub-blocks it depends on have finished. Every
+    sub-block runs in a private namespace holding only the names it uses, and
+    its writes are copied back into the context by the calling thread, in
+    source order, so the context sees the same sequence of assignments as
+    with 'Block.execute'.
+
+    Besides the dependencies in 'Block._dep_graph' (a sub-block reads a name
+    that an earlier one writes), a sub-block also waits for the earlier
+    sub-blocks that read or write a name it writes. Item and attribute
+    assignments ('x[0] = y', 'x.a = y') count as writes of 'x', but mutations
+    through method calls ('x.append(y)') are not visible to the analysis:
+    sub-blocks that mutate objects used by other sub-blocks that way must be
+    run with 'Block.execute'.
+
+    'execute_components' is coarser: it runs the connected components of
+    the sub-blocks, groups that share no name any of them writes, each in
+    one task.
+
+    On Python 2 this needs the 'futures' backport of 'concurrent.futures'.
+'''
+
+from __future__ import absolute_import
+
+from compiler.ast import AssAttr, AugAssign, Getattr, Name, Slice, Subscript
+import compiler
+import sys
+from traceback import format_exc
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import six
+
+from .block import CompositeException, ExecutionCancelled
+
+
+def root_name(name):
+    ''' The variable that a possibly dotted name starts from.
+
+        >>> root_name('os.path.join')
+        'os'
+    '''
+    return name.split('.', 1)[0]
+
+
+class MutationFinder(object):
+    ''' Find the variables whose items or attributes are assigned to.
+
+        Use with 'compiler.walk'; the names end up in 'names'.
+    '''
+
+    def __init__(self):
+        self.names = set()
+
+    def _see_target(self, node):
+        while isinstance(node, (AssAttr, Getattr, Slice, Subscript)):
+            node = node.expr
+        if isinstance(node, Name):
+            self.names.add(node.name)
+
+    def visitAssAttr(self, node):
+        self._see_target(node)
+        self.visit(node.expr)
+
+    def visitSubscript(self, node):
+        if node.flags != 'OP_APPLY':
+            self._see_target(node)
+        for child in node.getChildNodes():
+            self.visit(child)
+
+    visitSlice = visitSubscript
+
+    def visitAugAssign(self, node):
+        self._see_target(node.node)
+        for child in node.getChildNodes():
+            self.visit(child)
+
+
+def mutated_names(block):
+    ''' The names whose values 'block' modifies in place by assignment. '''
+    return compiler.walk(block.ast, MutationFinder()).names
+
+
+def sub_block_dependencies(blocks, dep_graph):
+    ''' The earlier blocks that each block in 'blocks' has to wait for.
+
+        Returns a list of sets of indices into 'blocks'. This adds the
+        write-after-read and write-after-write orderings that a parallel
+        execution needs to the read-after-write dependencies of 'dep_graph'.
+    '''
+    position = dict((b, i) for i, b in enumerate(blocks))
+    last_writer, readers = {}, {}
+    dependencies = []
+    for i, block in enumerate(blocks):
+        # (Blocks left out of 'blocks' are ignored)
+        deps = set(position[d] for d in dep_graph.get(block, ())
+                   if not isinstance(d, six.string_types) and d in position)
+        for name in read_names(block):
+            if name in last_writer:
+                deps.add(last_writer[name])
+        written = written_roots(block)
+        for name in written:
+            if name in last_writer:
+                deps.add(last_writer[name])
+            deps.update(readers.get(name, ()))
+        for name in read_names(block):
+            readers.setdefault(name, set()).add(i)
+        for name in written:
+            last_writer[name] = i
+            readers[name] = set()
+        deps.discard(i)
+        dependencies.append(deps)
+    return dependencies
+
+
+def connected_components(blocks, dep_graph):
+    ''' The indices of 'blocks' grouped into the connected components of
+        their dependencies (see 'sub_block_dependencies'), in order.
+
+        No two components read or write a name that one of them writes.
+    '''
+    parent = range(len(blocks))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, deps in enumerate(sub_block_dependencies(blocks, dep_graph)):
+        for d in deps:
+            parent[find(d)] = find(i)
+
+    components = {}
+    roots = []
+    for i in range(len(blocks)):
+        root = find(i)
+        if root not in components:
+            components[root] = []
+            roots.append(root)
+        components[root].append(i)
+    return [components[root] for root in roots]
+
+
+def read_names(block):
+    ''' The names 'block' may need from its namespace. '''
+    names = set()
+    for name in block.inputs | block.outputs | block.conditional_outputs:
+        names.add(root_name(name))
+    return names | mutated_names(block)
+
+
+def written_roots(block):
+    ''' The names whose values 'block' may replace or modify. '''
+    names = set()
+    for name in (block.outputs | block.conditional_outputs |
+                 block.fromimports):
+        names.add(root_name(name))
+    return names | mutated_names(block)
+
+
+def written_names(block):
+    ''' The names 'block' may bind, which have to be copied back. '''
+    return set(name for name in (block.outputs | block.conditional_outputs |
+                                 block.fromimports)
+               if '.' not in name)
+
+
+def execute_sub_block(block, namespace, global_context):
+    ''' Execute 'block' in 'namespace' (in a worker).
+
+        Returns the namespace and, if the block raised, the exception with
+        its formatted traceback and traceback object.
+    '''
+    try:
+        block.execute(namespace, global_context)
+    except Exception as e:
+        return namespace, (e, format_exc(), sys.exc_info()[2])
+    return namespace, None
+
+
+def execute_components(components, local_context, execute, executor):
+    ''' Execute the blocks 'components', which share no name that one of them
+        writes, concurrently on 'executor'.
+
+        Each block runs through 'execute(block, namespace)' in a private
+        namespace holding the names it reads, and its writes are copied into
+        'local_context' afterwards, in the order of 'components'. The first
+        block runs in the calling thread, which then takes over the blocks the
+        executor hasn't started, so this can be called from one of the
+        executor's workers.
+
+        If blocks raise, the error of the first one is raised, after copying
+        the writes of the blocks before it, and its own as far as it got.
+        Like an error in a sequential execution, this leaves out the blocks
+        after it, but the components interleave in the original order: the
+        blocks before it ran their statements after the failing one too,
+        and the writes the blocks after it made before that are lost. If
+        one is cancelled (ExecutionCancelled), nothing is copied.
+    '''
+    namespaces = [dict((name, local_context[name]) for name in
+                       read_names(block) if name in local_context)
+                  for block in components]
+    futures = [executor.submit(_execute_component, execute, block, namespace)
+               for block, namespace in zip(components[1:], namespaces[1:])]
+    errors = [_execute_component(execute, components[0], namespaces[0])]
+    errors.extend([None] * len(futures))
+    # Take over the blocks the executor hasn't started, from the last one
+    pending = []
+    for i in reversed(range(len(futures))):
+        if futures[i].cancel():
+            errors[i + 1] = _execute_component(execute, components[i + 1],
+                                               namespaces[i + 1])
+        else:
+            pending.append(i)
+    for i in pending:
+        errors[i + 1] = futures[i].result()
+
+    for error in errors:
+        if error is not None and isinstance(error[1], ExecutionCancelled):
+            six.reraise(*error)
+    failed = [i for i, error in enumerate(errors) if error is not None]
+    count = failed[0] + 1 if failed else len(components)
+    for block, namespace in zip(components[:count], namespaces[:count]):
+        for name in written_names(block):
+            if name in namespace:
+                local_context[name] = namespace[name]
+    if failed:
+        six.reraise(*errors[failed[0]])
+
+
+def _execute_component(execute, block, namespace):
+    try:
+        execute(block, namespace)
+    except Exception:
+        return sys.exc_info()
+    return None
+
+
+class WavefrontExecution(object):
+    ''' One execution of a sequence of sub-blocks on an executor. '''
+
+    def __init__(self, blocks, dep_graph, local_context, global_context,
+                 continue_on_errors=False):
+        self.blocks = list(blocks)
+        self.local_context = local_context
+        self.global_context = global_context
+        self.continue_on_errors = continue_on_errors
+
+        self.dependencies = sub_block_dependencies(self.blocks, dep_graph)
+        self._reads = [read_names(b) for b in self.blocks]
+        self._writes = [written_names(b) for b in self.blocks]
+
+    ###########################################################################
+    # WavefrontExecution public interface
+    ###########################################################################
+
+    def run(self, executor):
+        ''' Execute the sub-blocks on 'executor' and update the context.
+
+            Errors are handled as by 'Block.execute'. Without
+            'continue_on_errors', the context ends up as after a sequential
+            execution that stopped at the first failing sub-block (in source
+            order): the writes of later sub-blocks that already ran are
+            dropped.
+        '''
+        n = len(self.blocks)
+        dependents = [[] for _ in range(n)]
+        waiting = [len(deps) for deps in self.dependencies]
+        for i, deps in enumerate(self.dependencies):
+            for d in deps:
+                dependents[d].append(i)
+        ready = [i for i in range(n) if waiting[i] == 0]
+
+        # Writes of finished sub-blocks that aren't in the context yet. A
+        # name's latest finished writer is the one later readers need: they
+        # wait for every earlier writer, and later writers wait for them.
+        staged = {}
+        results = {}
+        errors = {}
+        committed = 0
+        stop = n
+        futures = {}
+
+        while ready or futures:
+            for i in sorted(ready):
+                if i < stop:
+                    future = executor.submit(*self._task(i, staged))
+                    futures[future] = i
+            ready = []
+            if not futures:
+                break
+
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures.pop(future)
+                namespace, error = self._result(i, future.result())
+                writes = dict((name, namespace[name]) for name in
+                              self._writes[i] if name in namespace)
+                results[i] = writes
+                staged.update(writes)
+                if error is not None:
+                    errors[i] = error
+                    if not self.continue_on_errors:
+                        stop = min(stop, i)
+                        continue
+                for j in dependents[i]:
+                    waiting[j] -= 1
+                    if waiting[j] == 0:
+                        ready.append(j)
+
+            # Serialize the writes into the context, in source order
+            while committed in results and committed <= stop:
+                for name, value in results.pop(committed).items():
+                    self.local_context[name] = value
+                committed += 1
+
+        self._raise(errors)
+
+    ###########################################################################
+    # WavefrontExecution protected interface
+    ###########################################################################
+
+    def _namespace(self, i, staged):
+        ''' A private namespace for sub-block 'i' with the names it reads. '''
+        namespace = {}
+        for name in self._reads[i]:
+            if name in staged:
+                namespace[name] = staged[name]
+            elif name in self.local_context:
+                namespace[name] = self.local_context[name]
+        return namespace
+
+    def _task(self, i, staged):
+        ''' The callable and arguments to submit for sub-block 'i'. '''
+        block = self.blocks[i]
+        # Compile in this thread rather than racing in the workers
+        block._code
+        return (execute_sub_block, block, self._namespace(i, staged),
+                self.global_context)
+
+    def _result(self, i, result):
+        ''' The namespace and error of sub-block 'i' from its task's result.
+        '''
+        return result
+
+    def _raise(self, errors):
+        if not errors:
+            return
+        if not self.continue_on_errors:
+            e, _, tb = errors[min(errors)]
+            six.reraise(type(e), e, tb)
+        exceptions = []
+        for i in sorted(errors):
+            e, traceback, _ = errors[i]
+            e.traceback = traceback
+            exceptions.append(e)
+        if len(exceptions) > 1:
+            raise CompositeException(exceptions)
+        raise exceptions[0]
+
+
+def execute_parallel(block, local_context, global_context={},
+                     continue_on_errors=False, executor=None):
+    ''' Execute the sub-blocks of 'block' on 'executor'.
+
+        If no executor is given, a thread pool with one worker per CPU is used
+        for this execution.
+    '''
+    execution = WavefrontExecution(block.sub_blocks, block._dep_graph,
+                                   local_context, global_context,
+                                   continue_on_errors)
+    if executor is not None:
+        execution.run(executor)
+        return
+    from multiprocessing import cpu_count
+    pool = ThreadPoolExecutor(max_workers=cpu_count())
+    try:
+        execution.run(pool)
+    finally:
+        pool.shutdown()
@@ -0,0 +1,282 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Wavefront execution of the sub-blocks of a block in worker processes.
+
+    Threads don't help with statements that hold the GIL. 'ProcessExecution'
+    schedules sub-blocks like 'WavefrontExecution', but ships each sub-block's
+    code object (marshalled) and the values it reads (pickled) to a process
+    pool, and merges back only the names the sub-block binds or modifies.
+
+    NumPy arrays of at least 'threshold' bytes are not pickled: they are
+    copied once into a file in '/dev/shm' (memory-backed on Linux), which the
+    workers map copy-on-write, and arrays computed by workers come back the
+    same way. The files are removed at the end of the execution; arrays that
+    end up in the context stay mapped. An array shared once is reused by all
+    the sub-blocks that read it.
+
+    Everything else that crosses the process boundary must be picklable,
+    except modules, which are imported again by name. Changes that workers
+    make to the global context, or to objects through method calls, are not
+    seen by the caller.
+'''
+
+from __future__ import absolute_import
+
+from cPickle import HIGHEST_PROTOCOL, PicklingError, dumps, loads
+import marshal
+import os
+import sys
+import tempfile
+from traceback import format_exc
+import types
+
+from concurrent.futures import ProcessPoolExecutor
+from six import exec_
+
+from .parallel import WavefrontExecution, mutated_names
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Where shared arrays live: memory-backed on Linux
+if os.path.isdir('/dev/shm'):
+    SHARED_DIRECTORY = '/dev/shm'
+else:
+    SHARED_DIRECTORY = tempfile.gettempdir()
+
+# Arrays at least this large (in bytes) are shared instead of pickled
+DEFAULT_THRESHOLD = 1 << 16
+
+
+class SharedArray(object):
+    ''' A picklable reference to an array stored in a file. '''
+
+    def __init__(self, filename, dtype, shape, order):
+        self.filename = filename
+        self.dtype = dtype
+        self.shape = shape
+        self.order = order
+
+    @classmethod
+    def create(cls, array, directory=SHARED_DIRECTORY):
+        ''' Copy 'array' into a new file in 'directory'. '''
+        order = 'F' if (array.flags.f_contiguous and
+                        not array.flags.c_contiguous) else 'C'
+        fd, filename = tempfile.mkstemp(prefix='codetools-', dir=directory)
+        os.close(fd)
+        shared = cls(filename, array.dtype, array.shape, order)
+        if array.size:
+            mapped = numpy.memmap(filename, dtype=array.dtype, mode='w+',
+                                  shape=array.shape, order=order)
+            mapped[...] = array
+            mapped.flush()
+            del mapped
+        return shared
+
+    def attach(self, mode='c'):
+        ''' Map the array. The default mode keeps changes private. '''
+        if not numpy.prod(self.shape):
+            return numpy.empty(self.shape, self.dtype, self.order)
+        return numpy.asarray(numpy.memmap(self.filename, dtype=self.dtype,
+                                          mode=mode, shape=self.shape,
+                                          order=self.order))
+
+
+class ModuleReference(object):
+    ''' A picklable reference to a module. '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def resolve(self):
+        __import__(self.name)
+        return sys.modules[self.name]
+
+
+def is_shareable(value, threshold):
+    return (numpy is not None and type(value) in (numpy.ndarray,
+                                                  numpy.memmap) and
+            not value.dtype.hasobject and value.nbytes >= threshold)
+
+
+def encode_value(value, threshold, directory):
+    ''' A picklable stand-in for 'value', for a worker. '''
+    if isinstance(value, types.ModuleType):
+        return ModuleReference(value.__name__)
+    if is_shareable(value, threshold):
+        return SharedArray.create(value, directory)
+    return value
+
+
+def decode_value(value, mode='c'):
+    if isinstance(value, ModuleReference):
+        return value.resolve()
+    if isinstance(value, SharedArray):
+        return value.attach(mode)
+    return value
+
+
+def picklable_error(e, traceback):
+    ''' The error '(e, traceback)', with 'e' replaced by a RuntimeError if
+        it can't be sent to another process.
+    '''
+    try:
+        loads(dumps(e, HIGHEST_PROTOCOL))
+    except Exception:
+        e = RuntimeError('%s: %s' % (type(e).__name__, e))
+    return e, traceback
+
+
+def execute_code(payload):
+    ''' Execute a pickled sub-block (in a worker process).
+
+        Returns the pickled values of the names it writes and, if it raised,
+        the exception and its formatted traceback.
+    '''
+    (code, filename, namespace, global_context, writes, threshold,
+     directory) = loads(payload)
+    namespace = dict((name, decode_value(value))
+                     for name, value in loads(namespace).items())
+    global_context = loads(global_context)
+    if filename:
+        namespace['__file__'] = filename
+
+    error = None
+    try:
+        exec_(marshal.loads(code), global_context, namespace)
+    except Exception as e:
+        error = picklable_error(e, format_exc())
+
+    values = dict((name, encode_value(namespace[name], threshold, directory))
+                  for name in writes if name in namespace)
+    try:
+        return dumps((values, error), HIGHEST_PROTOCOL)
+    except Exception:
+        unpicklable = []
+        for name, value in sorted(values.items()):
+            try:
+                dumps(value, HIGHEST_PROTOCOL)
+            except Exception:
+                unpicklable.append(name)
+        for value in values.values():
+            if isinstance(value, SharedArray):
+                os.remove(value.filename)
+        if error is None and unpicklable:
+            error = (PicklingError('Values of %s cannot be sent back from '
+                                   'a worker process' %
+                                   ', '.join(unpicklable)), format_exc())
+        values = dict((name, values[name]) for name in values
+                      if name not in unpicklable)
+        return dumps((values, error), HIGHEST_PROTOCOL)
+
+
+def failed_task(error):
+    ''' A task result for a sub-block that couldn't be sent to a worker. '''
+    return dumps(({}, error), HIGHEST_PROTOCOL)
+
+
+class ProcessExecution(WavefrontExecution):
+    ''' One execution of a sequence of sub-blocks on a process pool. '''
+
+    def __init__(self, blocks, dep_graph, local_context, global_context,
+                 continue_on_errors=False, threshold=DEFAULT_THRESHOLD,
+                 directory=SHARED_DIRECTORY):
+        super(ProcessExecution, self).__init__(blocks, dep_graph,
+                                               local_context, global_context,
+                                               continue_on_errors)
+        self.threshold = threshold
+        self.directory = directory
+
+        # Copies of modified objects come back from the workers
+        for i, block in enumerate(self.blocks):
+            self._writes[i] |= mutated_names(block)
+
+        # id(array) -> (array, SharedArray), for every array shared so far
+        self._shared = {}
+        self._global_context = None
+
+    ###########################################################################
+    # WavefrontExecution interface
+    ###########################################################################
+
+    def run(self, executor):
+        try:
+            super(ProcessExecution, self).run(executor)
+        finally:
+            for _, shared in self._shared.values():
+                try:
+                    os.remove(shared.filename)
+                except OSError:
+                    pass
+            self._shared = {}
+
+    def _task(self, i, staged):
+        block = self.blocks[i]
+        try:
+            if self._global_context is None:
+                self._global_context = dumps(self.global_context,
+                                             HIGHEST_PROTOCOL)
+            namespace = dict((name, self._encode(value)) for name, value in
+                             self._namespace(i, staged).items())
+            payload = dumps((marshal.dumps(block._code), block.filename,
+                             dumps(namespace, HIGHEST_PROTOCOL),
+                             self._global_context, self._writes[i],
+                             self.threshold, self.directory),
+                            HIGHEST_PROTOCOL)
+        except Exception as e:
+            return failed_task, picklable_error(e, format_exc())
+        return execute_code, payload
+
+    def _result(self, i, result):
+        values, error = loads(result)
+        namespace = {}
+        for name, value in values.items():
+            namespace[name] = decode_value(value, mode='r+')
+            if isinstance(value, SharedArray):
+                # Downstream sub-blocks reuse the worker's file
+                array = namespace[name]
+                self._shared[id(array)] = (array, value)
+        if error is not None:
+            error = error + (None,)
+        return namespace, error
+
+    ###########################################################################
+    # ProcessExecution protected interface
+    ###########################################################################
+
+    def _encode(self, value):
+        if is_shareable(value, self.threshold):
+            if id(value) not in self._shared:
+                self._shared[id(value)] = (value, SharedArray.create(
+                    value, self.directory))
+            return self._shared[id(value)][1]
+        return encode_value(value, self.threshold, self.directory)
+
+
+def execute_processes(block, local_context, global_context={},
+                      continue_on_errors=False, executor=None,
+                      threshold=DEFAULT_THRESHOLD):
+    ''' Execute the sub-blocks of 'block' on a process pool 'executor'.
+
+        If no executor is given, a pool with one process per CPU is used for
+        this execution.
+    '''
+    execution = ProcessExecution(block.sub_blocks, block._dep_graph,
+                                 local_context, global_context,
+                                 continue_on_errors, threshold)
+    if executor is not None:
+        execution.run(executor)
+        return
+    pool = ProcessPoolExecutor()
+    try:
+        execution.run(pool)
+    finally:
+        pool.shutdown()
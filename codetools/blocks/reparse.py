@@ -0,0 +1,238 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Rebuilding a block after its source is edited.
+
+    Building a block from source parses, analyzes and compiles every
+    statement, and a new block starts with empty caches. When only a few
+    lines of a long script are edited, 'reparse' diffs the old and new
+    sources by line instead: the sub-blocks whose lines are unchanged are
+    moved into the new block as they are, with their analysis and compiled
+    code (and their line numbers shifted if lines were added or removed
+    above them), and only the regions of the new source between them are
+    parsed.
+
+    Each edited region must parse on its own, i.e. the edit must not join
+    statements with unchanged ones (an unclosed bracket, a line continuation
+    or a decorator in front of an unchanged 'def'); otherwise, or if the
+    encoding declaration changed, the whole source is parsed again.
+
+    'reparse' also tells which sub-blocks are new, and which names the
+    removed sub-blocks bound: running the new sub-blocks and the sub-blocks
+    downstream of them and of those names (see 'affected_sub_blocks') brings
+    a context computed by the old block up to date with the new one.
+'''
+
+from __future__ import absolute_import
+
+from compiler.ast import Import, From, Stmt
+from difflib import SequenceMatcher
+import re
+
+# An encoding declaration, on the first two lines of the source (PEP 263)
+CODING = re.compile(r'^[ \t\f]*#.*coding[:=][ \t]*([-\w.]+)')
+
+
+def reparse(block, code):
+    ''' Rebuild 'block', built from a string, for its edited source 'code'.
+
+        Returns (new block, its new sub-blocks, names bound by the removed
+        sub-blocks). The sub-blocks kept are moved out of 'block', which
+        must not be used afterwards, unless this raises a 'SyntaxError'.
+    '''
+    old_code = block._stored_string
+    old_lines = old_code.splitlines(True)
+    lines = code.splitlines(True)
+    sub_blocks = block.sub_blocks
+
+    chunks = None
+    if old_code and sub_blocks and _coding(old_lines) == _coding(lines):
+        try:
+            chunks = _reuse(_chunks(sub_blocks, len(old_lines)), old_lines,
+                            lines, block)
+        except SyntaxError:
+            pass
+
+    if chunks is None or not any(reused for reused, items in chunks):
+        return _rebuild(block, code)
+
+    new_sub_blocks = []
+    changed = []
+    kept = set()
+    for reused, items in chunks:
+        new_sub_blocks.extend(items)
+        if reused:
+            kept.update(items)
+        else:
+            changed.extend(items)
+    removed = set()
+    for sub_block in sub_blocks:
+        if sub_block not in kept:
+            removed |= sub_block.all_outputs
+
+    new = _new_block(block, new_sub_blocks)
+    if not _same(new.sub_blocks or [], new_sub_blocks):
+        # (A block of one sub-block wraps it in a new one)
+        return _rebuild(block, code)
+    new._stored_string = code
+    return new, changed, removed
+
+
+def affected_sub_blocks(block, sub_blocks=(), names=(), removed=()):
+    ''' The sub-blocks of 'block' downstream of 'sub_blocks' (including them)
+        or of the names 'names', with the imports first.
+
+        'removed' are the names bound by removed sub-blocks: the sub-blocks
+        that still bind them are affected too, since a removed one may have
+        rebound the name after them.
+    '''
+    if block.sub_blocks is None:
+        return [block]
+    sub_blocks = list(sub_blocks)
+    for name in removed:
+        sub_blocks.extend(block.writers(name, conditional=True))
+    affected = block._restriction_graph.downstream(
+        sub_blocks, set(names).union(removed))
+    imports = [b for b in block.sub_blocks
+               if isinstance(b.ast, (Import, From))]
+    return imports + [b for b in affected if b not in set(imports)]
+
+
+###############################################################################
+# Protected interface
+###############################################################################
+
+def _chunks(sub_blocks, line_count):
+    ''' (start, end, sub-blocks) for the lines of the statements, grouping
+        the sub-blocks that start on the same line.
+    '''
+    chunks = []
+    for sub_block in sub_blocks:
+        start = _first_line(sub_block.ast)
+        if start is None:
+            return []
+        if chunks and chunks[-1][0] == start - 1:
+            chunks[-1][2].append(sub_block)
+        elif chunks and chunks[-1][0] > start - 1:
+            # (Out of order sub-blocks don't come from a source)
+            return []
+        else:
+            chunks.append([start - 1, None, [sub_block]])
+    for this, next in zip(chunks, chunks[1:] + [[line_count]]):
+        this[1] = next[0]
+    if chunks:
+        # (Leading comments belong to the first statement)
+        chunks[0][0] = 0
+    return chunks
+
+
+def _reuse(chunks, old_lines, lines, block):
+    ''' The (reused, sub-blocks) of the new source, in order. '''
+    if not chunks:
+        return None
+
+    equal = [opcode for opcode in
+             SequenceMatcher(None, old_lines, lines, False).get_opcodes()
+             if opcode[0] == 'equal']
+
+    # Keep the chunks whose lines are all unchanged
+    kept = []
+    for start, end, sub_blocks in chunks:
+        for _, i1, i2, j1, j2 in equal:
+            if i1 <= start and end <= i2 and start < end:
+                kept.append((start, end, j1 - i1, sub_blocks))
+                break
+
+    # Parse the lines in between, before moving anything, so that 'block'
+    # is left alone if they don't parse
+    result = []
+    moves = []
+    position = 0
+    for start, end, delta, sub_blocks in kept:
+        if start + delta > position:
+            result.append((False, _parse(block, lines, position,
+                                         start + delta)))
+        result.append((True, sub_blocks))
+        moves.extend((sub_block, delta) for sub_block in sub_blocks if delta)
+        position = end + delta
+    if position < len(lines):
+        result.append((False, _parse(block, lines, position, len(lines))))
+
+    seen = set()
+    for sub_block, delta in moves:
+        sub_block._shift_lines(delta, seen)
+    return result
+
+
+def _parse(block, lines, start, end):
+    ''' The sub-blocks for lines 'start' to 'end' of the new source. '''
+    from .block import Block
+
+    region = Block(''.join(lines[start:end]),
+                   decompose_compound_statements=
+                   block.decompose_compound_statements)
+    sub_blocks = [b for b in region.sub_blocks or [region]
+                  if not (isinstance(b.ast, Stmt) and not b.ast.nodes)]
+    seen = set()
+    for sub_block in sub_blocks:
+        if start:
+            sub_block._shift_lines(start, seen)
+        sub_block.filename = _filename(block)
+    return sub_blocks
+
+
+def _rebuild(block, code):
+    ''' (new block, its sub-blocks, all names bound by 'block'). '''
+    new = _new_block(block, code)
+    removed = set()
+    for sub_block in block.sub_blocks or [block]:
+        removed |= sub_block.all_outputs
+    return new, list(new.sub_blocks or [new]), removed
+
+
+def _same(sub_blocks, others):
+    return len(sub_blocks) == len(others) and \
+        all(a is b for a, b in zip(sub_blocks, others))
+
+
+def _new_block(block, x):
+    from .block import Block
+
+    new = Block(x, **block.trait_get(
+        'decompose_compound_statements', 'incremental',
+        'no_filenames_in_tracebacks', 'restriction_cache_size',
+        'restriction_cache_max_statements'))
+    if isinstance(x, basestring) and new.sub_blocks:
+        for sub_block in new.sub_blocks:
+            sub_block.filename = _filename(block)
+    return new
+
+
+def _filename(block):
+    if block.sub_blocks:
+        return block.sub_blocks[0].filename
+    return block.filename
+
+
+def _coding(lines):
+    return [match.group(1) for match in map(CODING.match, lines[:2])
+            if match is not None]
+
+
+def _first_line(ast):
+    ''' The smallest line number in 'ast' (decorators come before 'def'). '''
+    linenos = [node.lineno for node in _nodes(ast)
+               if getattr(node, 'lineno', None) is not None]
+    return min(linenos) if linenos else None
+
+
+def _nodes(ast):
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.getChildNodes())
@@ -0,0 +1,191 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Bitset reachability for block restriction.
+
+    'Block.restrict' needs the sub-blocks that lie downstream of some input
+    names and upstream of some output names in the block's dependency graph.
+    'RestrictionGraph' numbers every node of the dependency graph once and
+    stores each node's forward and reverse adjacency as an integer bitset, so
+    a restriction is a couple of reachability sweeps made of bitwise
+    operations instead of a transitive closure over a freshly copied graph.
+'''
+
+from __future__ import absolute_import
+
+
+def iter_bits(bits):
+    ''' The indices of the set bits in 'bits', lowest first.
+
+        >>> list(iter_bits(0b10110))
+        [1, 2, 4]
+    '''
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def sweep(start, adjacency, mask=-1):
+    ''' The nodes reachable from the bitset 'start', including 'start'.
+
+        Only nodes in the bitset 'mask' are visited.
+
+        >>> bin(sweep(0b1, [0b10, 0b100, 0b0]))
+        '0b111'
+        >>> bin(sweep(0b1, [0b10, 0b100, 0b0], mask=0b11))
+        '0b11'
+    '''
+    reached = frontier = start & mask
+    while frontier:
+        successors = 0
+        for i in iter_bits(frontier):
+            successors |= adjacency[i]
+        frontier = successors & mask & ~reached
+        reached |= frontier
+    return reached
+
+
+class RestrictionGraph(object):
+    ''' A block's dependency graph, numbered for bitset reachability.
+
+        Sub-blocks get the ids '0..len(blocks)-1' in execution order, so the
+        restricted sub-blocks come out of a bitset already sorted. Output names
+        (the keys of the dependency graph) and input names (its values) get
+        separate ids to avoid cycles when a name is both, just like the 'In'
+        and 'Out' wrappers that 'restrict' used before.
+    '''
+
+    def __init__(self, blocks, dep_graph):
+        self.blocks = list(blocks)
+
+        ids = dict((b, i) for i, b in enumerate(self.blocks))
+        self._output_ids = {}
+        self._input_ids = {}
+        self._forward = [0] * len(self.blocks)
+        self._reverse = [0] * len(self.blocks)
+
+        def new_id(table, name):
+            table[name] = len(self._forward)
+            self._forward.append(0)
+            self._reverse.append(0)
+            return table[name]
+
+        for node, deps in dep_graph.items():
+            if isinstance(node, basestring):
+                k = self._output_ids.get(node)
+                if k is None:
+                    k = new_id(self._output_ids, node)
+            else:
+                k = ids[node]
+            for dep in deps:
+                if isinstance(dep, basestring):
+                    d = self._input_ids.get(dep)
+                    if d is None:
+                        d = new_id(self._input_ids, dep)
+                else:
+                    d = ids[dep]
+                self._forward[k] |= 1 << d
+                self._reverse[d] |= 1 << k
+
+    ###########################################################################
+    # RestrictionGraph public interface
+    ###########################################################################
+
+    def restrict(self, inputs=(), outputs=(), intermediates=()):
+        ''' The sub-blocks that compute 'outputs' from 'inputs', in order.
+
+            'intermediates' are input names that are also outputs of the
+            block: the sub-blocks that compute them are cut off, so that only
+            their dependents are affected. Returns the same sub-blocks as the
+            graph copying implementation of 'Block.restrict' did.
+        '''
+        return self.restrict_many(inputs, [outputs], intermediates)[0]
+
+    def restrict_many(self, inputs=(), outputs_list=(), intermediates=()):
+        ''' 'restrict' for each of the output sets in 'outputs_list'.
+
+            The nodes reachable from the inputs are found once, and so are
+            the nodes that reach each output name: the nodes that reach an
+            output set are the union of those.
+        '''
+        forward, reverse = self._forward, self._reverse
+
+        # Find the nodes reachable from inputs, and then the nodes among them
+        # that reach the outputs.
+        mask = -1
+        if inputs or intermediates:
+            start = 0
+            if intermediates:
+                forward, reverse = list(forward), list(reverse)
+            for name in intermediates:
+                node = self._output_ids[name]
+                start |= 1 << node
+
+                # Find the intermediate's block node and replace it
+                # with the intermediate value. This effectively cuts
+                # the block's children off the tree. This means for
+                # the code "c = a * b; d = c * 3", we are removing c's
+                # dependency on "a" and "b"
+                #
+                # There is a special case which is handled here as well:
+                # for the code "c = a * b; d = c * 3", if the user wants
+                # to restrict the block with 'd' as an input, the result
+                # is an empty sub-block. (A pure output like 'd' keeps its
+                # node, which nothing depends on.)
+                pruned = next(iter_bits(forward[node]))
+                for i in iter_bits(forward[node]):
+                    reverse[i] &= ~(1 << node)
+                forward[node] = 0
+                dependents = reverse[pruned]
+                for i in iter_bits(dependents):
+                    forward[i] = forward[i] & ~(1 << pruned) | 1 << node
+                reverse[node] |= dependents
+                reverse[pruned] = 0
+            for name in inputs:
+                if name in self._input_ids:
+                    start |= 1 << self._input_ids[name]
+            mask = sweep(start, reverse)
+
+        results = []
+        reached = {}
+        for outputs in outputs_list:
+            restricted = mask
+            if outputs:
+                restricted = 0
+                for name in outputs:
+                    if name not in reached:
+                        node = self._output_ids.get(name)
+                        reached[name] = 0 if node is None else \
+                                        sweep(1 << node, forward, mask)
+                    restricted |= reached[name]
+            results.append([self.blocks[i] for i in
+                            iter_bits(restricted & self._block_mask)])
+        return results
+
+    def downstream(self, blocks=(), names=()):
+        ''' The sub-blocks affected by a change to 'blocks' (including them)
+            or to the names 'names', in order.
+        '''
+        ids = dict((b, i) for i, b in enumerate(self.blocks))
+        start = 0
+        for b in blocks:
+            if b in ids:
+                start |= 1 << ids[b]
+        for name in names:
+            if name in self._input_ids:
+                start |= 1 << self._input_ids[name]
+        mask = sweep(start, self._reverse)
+        return [self.blocks[i] for i in iter_bits(mask & self._block_mask)]
+
+    ###########################################################################
+    # RestrictionGraph protected interface
+    ###########################################################################
+
+    @property
+    def _block_mask(self):
+        return (1 << len(self.blocks)) - 1
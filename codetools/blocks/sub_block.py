@@ -0,0 +1,236 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' A compact representation for the statements of a block.
+
+    A 'Block' built from source has one sub-block per statement. As 'Block's,
+    sub-blocks cost a 'HasTraits' object each, with a 'uuid4()', trait
+    change handlers and caches that only the top-level block uses, which
+    dominates the time and memory it takes to build a block from a long
+    script. 'SubBlock' is a plain object with '__slots__' that provides what
+    the code using sub-blocks needs of them: the same analysis ('inputs',
+    'outputs', ...), compiled code, 'execute' and 'validate_for_restriction'
+    as a 'Block' made from one statement. Its uuid is only assigned when
+    something asks for it, and sub-blocks compare by identity.
+
+    That is all of the 'Block' API a sub-block has: restricting a single
+    statement or running it with 'execute_impure', 'execute_parallel', ...
+    takes a 'Block', e.g. 'Block([sub_block])'.
+
+    'Block's can still be used as sub-blocks, e.g. when 'sub_blocks' is
+    edited, so code handling sub-blocks must not rely on them being one or
+    the other.
+'''
+
+from __future__ import absolute_import
+
+import compiler
+from compiler.ast import Module, Stmt
+from uuid import uuid4
+
+from .analysis import NameFinder
+from .block_cache import rename_code, shift_code
+from .compiler_.api import compile_ast
+from .compiler_unparse import unparse
+
+
+def analyze(ast):
+    ''' The (inputs, outputs, conditional outputs, constant assignments,
+        names imported with 'from', imports) of the code 'ast', as used by
+        'Block'.
+    '''
+    v = compiler.walk(ast, NameFinder())
+    temp = [unparse(x).strip() for x in v.constlist]
+    temp2 = [x.split('=')[0].strip() for x in temp]
+    fromimports = set(v.fromimports)
+    return (set(v.free), set(v.locals) - fromimports,
+            set(v.conditional_locals), (set(temp2), temp), fromimports,
+            v.imports)
+
+
+class SubBlock(object):
+    ''' One statement of a block. '''
+
+    __slots__ = ('_ast', 'filename', '_uuid', '_inputs', '_outputs',
+                 '_conditional_outputs', '_const_assign', '_fromimports',
+                 '_imports_ast', '_compiled', '_plan', '__weakref__')
+
+    # A sub-block has no sub-blocks of its own
+    sub_blocks = ()
+
+    # (Only top-level blocks leave filenames out of tracebacks)
+    no_filenames_in_tracebacks = False
+
+    def __init__(self, ast, filename=None):
+        self._ast = ast
+        self.filename = filename
+        self._uuid = None
+        self._compiled = None
+        self._plan = None
+        self._clear_analysis()
+
+    def __repr__(self):
+        return '%s(uuid=%s)' % (type(self).__name__, self.uuid)
+
+    __str__ = __repr__
+
+    def __getstate__(self):
+        return dict(ast=self._ast, filename=self.filename, uuid=self._uuid)
+
+    def __setstate__(self, state):
+        self.__init__(state['ast'], state['filename'])
+        self._uuid = state['uuid']
+
+    ###########################################################################
+    # SubBlock public interface
+    ###########################################################################
+
+    @property
+    def ast(self):
+        return self._ast
+
+    @ast.setter
+    def ast(self, ast):
+        self._ast = ast
+        self._compiled = self._plan = None
+        self._clear_analysis()
+
+    @property
+    def uuid(self):
+        if self._uuid is None:
+            self._uuid = uuid4()
+        return self._uuid
+
+    @property
+    def inputs(self):
+        if self._inputs is None:
+            self._analyze()
+        return self._inputs
+
+    @property
+    def outputs(self):
+        if self._outputs is None:
+            self._analyze()
+        return self._outputs
+
+    @property
+    def conditional_outputs(self):
+        if self._conditional_outputs is None:
+            self._analyze()
+        return self._conditional_outputs
+
+    @property
+    def all_outputs(self):
+        return self.outputs | self.conditional_outputs
+
+    @property
+    def const_assign(self):
+        if self._const_assign is None:
+            self._analyze()
+        return self._const_assign
+
+    @property
+    def fromimports(self):
+        if self._fromimports is None:
+            self._analyze()
+        return self._fromimports
+
+    @property
+    def imports_ast(self):
+        if self._imports_ast is None:
+            self._analyze()
+        return self._imports_ast
+
+    @property
+    def codestring(self):
+        return unparse(self._ast)
+
+    def is_empty(self):
+        return isinstance(self._ast, Stmt) and len(self._ast.nodes) == 0
+
+    def execute(self, local_context, global_context={},
+                continue_on_errors=False, cancelled=None):
+        ''' Execute the statement, like 'Block.execute'. '''
+        from .execution_plan import ExecutionPlan
+        if self._plan is None or \
+               self._plan.filename != self._code_filename():
+            self._plan = ExecutionPlan(self)
+        self._plan.execute(local_context, global_context, continue_on_errors,
+                           cancelled)
+
+    def validate_for_restriction(self):
+        ''' Return the statement if it reads a name it binds, like
+            'Block.validate_for_restriction', or None.
+        '''
+        if self.inputs & self.outputs:
+            return self
+        return None
+
+    def invalidate_cache(self):
+        ''' Someone modified the AST in place: compile it again. '''
+        self._compiled = self._plan = None
+
+    ###########################################################################
+    # SubBlock protected interface
+    ###########################################################################
+
+    @property
+    def _code(self):
+        filename = self._code_filename()
+        code = self._compiled
+        if code is None:
+            ast = self._ast
+            if not isinstance(ast, Module):
+                ast = Module(None, Stmt([ast]))
+            code = self._compiled = compile_ast(ast, filename, 'exec')
+        elif code.co_filename != filename:
+            # (Set by the block cache, or the filename changed)
+            code = self._compiled = rename_code(code, filename)
+        return code
+
+    def _code_filename(self):
+        if self.filename is not None:
+            return self.filename
+        return '<%r>' % self
+
+    def _tidy_ast(self):
+        # (See 'Block._tidy_ast'; statements from '_decompose' are tidy)
+        if isinstance(self._ast, Module):
+            self.ast = self._ast.node
+        if isinstance(self._ast, Stmt) and len(self._ast.nodes) == 1:
+            [self.ast] = self._ast.nodes
+
+    def _restore_code(self, code):
+        ''' Use 'code' as the compiled code of the statement. '''
+        self._compiled = code
+
+    def _shift_lines(self, delta, seen=None):
+        ''' Move the statement 'delta' lines down; see 'Block._shift_lines'.
+        '''
+        if seen is None:
+            seen = set()
+        stack = [self._ast]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            if getattr(node, 'lineno', None) is not None:
+                node.lineno += delta
+            stack.extend(node.getChildNodes())
+        if self._compiled is not None:
+            self._compiled = shift_code(self._compiled, delta)
+        self._plan = None
+
+    def _analyze(self):
+        (self._inputs, self._outputs, self._conditional_outputs,
+         self._const_assign, self._fromimports, self._imports_ast) = \
+            analyze(self._ast)
+
+    def _clear_analysis(self):
+        self._inputs = self._outputs = self._conditional_outputs = None
+        self._const_assign = self._fromimports = self._imports_ast = None
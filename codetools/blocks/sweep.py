@@ -0,0 +1,266 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+''' Parameter sweeps over a block.
+
+    'execute_sweep' runs a block for many values of some of its inputs, e.g.
+    for every point of a grid of parameters. The block is split once: the
+    sub-blocks that don't depend on the varying names run once, in a copy of
+    the base context, and the sub-blocks downstream of the varying names are
+    compiled into a function (see 'codetools.blocks.fast_function') that is
+    called for every point, with the names computed upstream as arguments.
+    The outputs of every point are stored in NumPy arrays allocated once,
+    with the dtype and shape of the first value (an object array if the
+    values aren't numbers, or if their shapes differ).
+
+    The points can also be spread over a 'concurrent.futures' executor, e.g.
+    a process pool, in chunks. The downstream block, the values it reads and
+    its outputs must then be picklable.
+
+    Downstream sub-blocks must not mutate the objects computed upstream,
+    since these are shared by all the points.
+'''
+
+from __future__ import absolute_import
+
+from compiler.ast import From, Import
+from multiprocessing import cpu_count
+
+import numpy
+
+from ..util.cache import LRUCache
+from .fast_function import compile_function
+
+
+class SweepResults(object):
+    ''' Output values, stored by point in preallocated arrays. '''
+
+    def __init__(self, names, size):
+        self.names = names
+        self.size = size
+        self.arrays = dict.fromkeys(names)
+
+    ###########################################################################
+    # SweepResults public interface
+    ###########################################################################
+
+    def store(self, name, index, value):
+        ''' Store the value of 'name' at the point 'index'. '''
+        array = self.arrays[name]
+        if array is None:
+            array = self.arrays[name] = self._allocate(value)
+        elif array.dtype != object:
+            try:
+                dtype = numpy.result_type(array.dtype, value)
+            except (TypeError, ValueError):
+                dtype = numpy.dtype(object)
+            if dtype.kind not in 'biufc' or \
+                   numpy.shape(value) != array.shape[1:]:
+                array = self.arrays[name] = self._objects(array, index)
+            elif dtype != array.dtype:
+                array = self.arrays[name] = array.astype(dtype)
+        array[index] = value
+
+    ###########################################################################
+    # SweepResults protected interface
+    ###########################################################################
+
+    def _allocate(self, value):
+        dtype = numpy.asarray(value).dtype
+        if dtype.kind not in 'biufc':
+            return numpy.empty(self.size, dtype=object)
+        return numpy.empty((self.size,) + numpy.shape(value), dtype=dtype)
+
+    def _objects(self, array, stored):
+        objects = numpy.empty(self.size, dtype=object)
+        for i in range(stored):
+            objects[i] = array[i]
+        return objects
+
+
+class Sweep(object):
+    ''' A block split for a sweep over 'varying' names. '''
+
+    def __init__(self, block, base_context, varying, outputs=None,
+                 global_context={}):
+        self.names = names = sorted(varying)
+        if not names:
+            raise ValueError('Must provide varying names')
+        self.columns = [column if isinstance(column, (list, tuple,
+                                                      numpy.ndarray))
+                        else list(column)
+                        for column in (varying[name] for name in names)]
+        sizes = set(len(column) for column in self.columns)
+        if len(sizes) > 1:
+            raise ValueError('The varying sequences must have the same '
+                             'length')
+        [self.size] = sizes
+        self.global_context = global_context
+
+        # Split the sub-blocks (imports are needed on both sides)
+        used = [name for name in names
+                if name in block.inputs | block.outputs | block.fromimports]
+        sub_blocks = block.sub_blocks or [block]
+        if not used:
+            downstream = []
+        elif not block.sub_blocks:
+            downstream = [block]
+        else:
+            try:
+                downstream = block.restrict(inputs=used).sub_blocks
+            except RuntimeError:
+                # Blocks that can't be restricted run whole at every point
+                downstream = block.sub_blocks
+        restricted = set(downstream)
+        upstream = [b for b in sub_blocks if b not in restricted or
+                    isinstance(b.ast, (Import, From))]
+
+        # Run the upstream part
+        self.shared = shared = dict((name, base_context[name])
+                                    for name in base_context.keys())
+        if upstream:
+            upstream_block = block.__class__(upstream)
+            upstream_block.execute(shared, global_context)
+
+        if outputs is None:
+            outputs = sorted(name for b in downstream for name in b.outputs
+                             if '.' not in name)
+        self.outputs = list(outputs)
+
+        # Compile the downstream part for the outputs it computes
+        computed = set()
+        for b in downstream:
+            computed |= b.all_outputs
+        self.computed = [name for name in self.outputs if name in computed]
+        if self.computed:
+            self.block = block.__class__(downstream)
+            try:
+                self.block = self.block.restrict(outputs=self.computed)
+            except RuntimeError:
+                pass
+            reads = self.block.inputs | self.block.conditional_outputs
+            self.params = [name for name in sorted(reads | set(names))
+                           if name in names or name in shared or
+                           name in global_context]
+        else:
+            self.block = None
+            self.params = []
+
+    ###########################################################################
+    # Sweep public interface
+    ###########################################################################
+
+    def run(self, executor=None, chunk_size=None):
+        ''' Compute the outputs at every point; returns a dict of arrays. '''
+        results = SweepResults(self.outputs, self.size)
+
+        for name in self.outputs:
+            if name not in self.computed:
+                value = self.shared[name]
+                for i in range(self.size):
+                    results.store(name, i, value)
+
+        if self.block is not None and self.size:
+            fixed, varying = self._arguments()
+            if executor is None:
+                rows = sweep_rows(self.block, self.params, self.computed,
+                                  fixed, varying, self.columns,
+                                  self.global_context)
+                self._store(results, 0, rows)
+            else:
+                if chunk_size is None:
+                    chunk_size = -(-self.size // (4 * cpu_count()))
+                # ('exec' adds the unpicklable '__builtins__')
+                global_context = dict(
+                    (name, value) for name, value in
+                    self.global_context.items() if name != '__builtins__')
+                futures = []
+                for start in range(0, self.size, chunk_size):
+                    columns = [column[start:start + chunk_size]
+                               for column in self.columns]
+                    futures.append((start, executor.submit(
+                        sweep_rows, self.block, self.params, self.computed,
+                        fixed, varying, columns, global_context)))
+                for start, future in futures:
+                    self._store(results, start, future.result())
+
+        return results.arrays
+
+    ###########################################################################
+    # Sweep protected interface
+    ###########################################################################
+
+    def _arguments(self):
+        fixed, varying = [], []
+        for position, name in enumerate(self.params):
+            if name in self.names:
+                varying.append((position, self.names.index(name)))
+                fixed.append(None)
+            elif name in self.shared:
+                fixed.append(self.shared[name])
+            else:
+                fixed.append(self.global_context[name])
+        return fixed, varying
+
+    def _store(self, results, start, rows):
+        for i, row in enumerate(rows):
+            for name, value in zip(self.computed, row):
+                results.store(name, start + i, value)
+
+
+# (block uuid, params, outputs) -> function, in each process
+_functions = LRUCache(max_size=64)
+
+
+def sweep_rows(block, params, outputs, fixed, varying, columns,
+               global_context):
+    ''' The values of 'outputs' for every point of 'columns'.
+
+        'fixed' holds the arguments of the function for 'block', with None
+        for the varying ones; 'varying' maps their positions to the index of
+        their column.
+    '''
+    key = (block.uuid, tuple(params), tuple(outputs))
+    function = _functions.get(key)
+    if function is None:
+        function = compile_function(block, params, outputs)
+        if function is None:
+            function = _namespace_function(block, params, outputs,
+                                           global_context)
+        elif len(outputs) == 1:
+            function = _tuple_function(function)
+        _functions[key] = function
+
+    rows = []
+    args = list(fixed)
+    size = len(columns[0])
+    for i in range(size):
+        for position, column in varying:
+            args[position] = columns[column][i]
+        rows.append(function(*args))
+    return rows
+
+
+def execute_sweep(block, base_context, varying, outputs=None,
+                  global_context={}, executor=None, chunk_size=None):
+    ''' Run 'block' once for every point in 'varying', a dict of sequences
+        of the same length; see 'Block.execute_sweep'.
+    '''
+    return Sweep(block, base_context, varying, outputs,
+                 global_context).run(executor, chunk_size)
+
+
+def _namespace_function(block, params, outputs, global_context):
+    def function(*args):
+        namespace = dict(zip(params, args))
+        block.execute(namespace, global_context)
+        return tuple(namespace[name] for name in outputs)
+    return function
+
+
+def _tuple_function(function):
+    return lambda *args: (function(*args),)
@@ -0,0 +1,138 @@
+"""Tests for the persistent cache of parsed and compiled Blocks."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from codetools.blocks.block import Block
+from codetools.blocks.block_cache import BlockCache, set_block_cache
+
+CODE = """import math
+a = x + 1
+if a > 1:
+    b = math.sqrt(a)
+c = 2
+def f(y):
+    return y / 0
+"""
+
+
+class BlockCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = BlockCache(self.directory)
+        set_block_cache(self.cache)
+
+    def tearDown(self):
+        set_block_cache(None)
+        shutil.rmtree(self.directory)
+
+    def assertSameBlock(self, cached, block):
+        self.assertEqual(len(cached.sub_blocks), len(block.sub_blocks))
+        for b1, b2 in zip(cached.sub_blocks, block.sub_blocks):
+            self.assertEqual(b1.codestring, b2.codestring)
+            self.assertEqual(b1.inputs, b2.inputs)
+            self.assertEqual(b1.outputs, b2.outputs)
+            self.assertEqual(b1.conditional_outputs, b2.conditional_outputs)
+        self.assertEqual(cached.inputs, block.inputs)
+        self.assertEqual(cached.outputs, block.outputs)
+        self.assertEqual(cached.conditional_outputs,
+                         block.conditional_outputs)
+        self.assertEqual(cached.fromimports, block.fromimports)
+        self.assertEqual(cached.const_assign, block.const_assign)
+
+    def test_options(self):
+        code = 'if x:\n    a = 1\n    b = 2'
+        self.assertEqual(len(Block(code).sub_blocks), 1)
+        compound = Block(code, decompose_compound_statements=True)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual(len(compound.sub_blocks), 2)
+        self.assertSameBlock(Block(code, decompose_compound_statements=True),
+                             compound)
+
+    def test_warm_start(self):
+        block = Block(CODE)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        # Analysis and code come from the cache
+        cached = Block(CODE)
+        self.assertIsNot(cached.sub_blocks[0], block.sub_blocks[0])
+        for b in cached.sub_blocks:
+            self.assertIsNotNone(b._compiled)
+            self.assertIsNotNone(b._inputs)
+        self.assertIsNotNone(cached._inputs)
+        self.assertSameBlock(cached, block)
+
+        names = dict(x=3)
+        cached.execute(names)
+        self.assertEqual(names['b'], 2)
+        self.assertEqual(len(cached.restrict(inputs=['x']).sub_blocks), 3)
+
+    def test_code_filenames(self):
+        Block(CODE)
+        cached = Block(CODE)
+        for b in cached.sub_blocks:
+            self.assertEqual(b._code.co_filename, '<%r>' % b)
+
+        # Nested code objects are renamed too
+        names = dict(x=0)
+        cached.execute(names)
+        try:
+            names['f'](1)
+        except ZeroDivisionError:
+            tb = sys.exc_info()[2]
+            while tb.tb_next is not None:
+                tb = tb.tb_next
+            self.assertEqual(tb.tb_frame.f_code.co_filename,
+                             '<%r>' % cached.sub_blocks[-1])
+        else:
+            self.fail('ZeroDivisionError not raised')
+
+    def test_file_blocks(self):
+        filename = os.path.join(self.directory, 'model.py')
+        with open(filename, 'w') as f:
+            f.write(CODE)
+        Block(file=filename)
+        cached = Block(file=filename)
+        self.assertEqual(cached.filename, filename)
+        for b in cached.sub_blocks:
+            self.assertEqual(b._code.co_filename, filename)
+
+    def test_no_filenames_in_tracebacks(self):
+        Block(CODE, no_filenames_in_tracebacks=True)
+        cached = Block(CODE, no_filenames_in_tracebacks=True)
+        self.assertIn('_traits_cache__code', cached.__dict__)
+        names = dict(x=0)
+        cached.execute(names)
+        self.assertEqual(names['c'], 2)
+
+    def test_different_sources(self):
+        Block('a = 1')
+        Block('a = 2')
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        names = {}
+        Block('a = 2').execute(names)
+        self.assertEqual(names, dict(a=2))
+
+    def test_unreadable_entries_are_ignored(self):
+        with open(os.path.join(self.directory, self.cache.key(CODE)),
+                  'wb') as f:
+            f.write('garbage')
+        self.assertSameBlock(Block(CODE), Block(CODE))
+
+    def test_clear(self):
+        Block(CODE)
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_disabled(self):
+        set_block_cache(None)
+        Block(CODE)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+"""Tests for the chunked execution of Blocks over large arrays."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from codetools.blocks.block import Block
+from codetools.blocks.chunked import ChunkedExecution, UnsafeStatementError
+
+CODE = """import numpy
+from numpy import sqrt
+k = scale * 2
+a = x * y
+b = sqrt(a) + k
+c = numpy.exp(-b) * y
+"""
+
+
+class Sliceable(object):
+    """ An array-like that only supports slicing, like an HDF5 dataset. """
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+        self.slices = []
+
+    def __getitem__(self, index):
+        self.slices.append(index)
+        return self.array[index].copy()
+
+
+class ChunkedExecutionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.x = numpy.random.rand(1003)
+        self.y = numpy.random.rand(1003)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def expected(self, block, **names):
+        block.execute(names)
+        return names
+
+    def test_same_results_as_execute(self):
+        block = Block(CODE)
+        expected = self.expected(block, x=self.x, y=self.y, scale=1.5)
+        x = Sliceable(self.x)
+        context = dict(x=x, y=self.y, scale=1.5)
+        block.execute_chunked(context, directory=self.directory,
+                              chunk_size=100)
+        self.assertEqual(context['k'], 3.0)
+        for name in 'abc':
+            self.assertIsInstance(context[name], numpy.memmap)
+            numpy.testing.assert_array_almost_equal(context[name],
+                                                    expected[name])
+        self.assertEqual(len(x.slices), 11)
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                    'c.dat')))
+
+    def test_outputs_and_out(self):
+        block = Block(CODE)
+        out = numpy.zeros(1003)
+        context = dict(x=self.x, y=self.y, scale=1.5)
+        block.execute_chunked(context, outputs=['c'], out=dict(c=out),
+                              directory=self.directory, chunk_size=64)
+        self.assertIs(context['c'], out)
+        expected = self.expected(block, x=self.x, y=self.y, scale=1.5)
+        numpy.testing.assert_array_almost_equal(out, expected['c'])
+        # Intermediates aren't written
+        self.assertNotIn('a', context)
+        self.assertNotIn('b', context)
+
+    def test_rows(self):
+        block = Block('a = x * 2 + y')
+        x = numpy.arange(60.).reshape(20, 3)
+        context = dict(x=x, y=numpy.ones((20, 3)))
+        block.execute_chunked(context, directory=self.directory,
+                              chunk_size=7)
+        self.assertEqual(context['a'].shape, (20, 3))
+        numpy.testing.assert_array_equal(context['a'], x * 2 + 1)
+
+    def test_unsafe_statements_are_refused(self):
+        block = Block('a = x * 2\nm = a.sum()\nb = a - m')
+        context = dict(x=self.x)
+        try:
+            block.execute_chunked(context, directory=self.directory)
+        except UnsafeStatementError as e:
+            self.assertEqual(e.statements, ['m = a.sum()'])
+        else:
+            self.fail('UnsafeStatementError not raised')
+        self.assertNotIn('a', context)
+
+        # Calls to functions that aren't ufuncs
+        block = Block('from numpy import cumsum\na = cumsum(x)')
+        self.assertRaises(UnsafeStatementError, block.execute_chunked,
+                          dict(x=self.x), directory=self.directory)
+
+    def test_materialize(self):
+        block = Block('a = x * 2\nm = a.mean()\nb = a - m\n'
+                      'from numpy import cumsum\nc = cumsum(b) + 1')
+        x = Sliceable(self.x)
+        context = dict(x=x)
+        block.execute_chunked(context, directory=self.directory,
+                              chunk_size=100, materialize=True)
+        expected = self.expected(block, x=self.x)
+        self.assertAlmostEqual(context['m'], expected['m'])
+        for name in 'abc':
+            numpy.testing.assert_array_almost_equal(context[name],
+                                                    expected[name])
+
+    def test_attribute_reads(self):
+        # Attributes of the arrays computed in chunks read the whole arrays
+        for code in ['y = x * 2\nn = y.shape[0]\nz = y + 1',
+                     'y = x * 2\nz = y.T']:
+            block = Block(code)
+            self.assertRaises(UnsafeStatementError, block.execute_chunked,
+                              dict(x=self.x), directory=self.directory)
+
+            context = dict(x=self.x)
+            block.execute_chunked(context, directory=self.directory,
+                                  chunk_size=100, materialize=True)
+            expected = self.expected(block, x=self.x)
+            for name in expected:
+                numpy.testing.assert_array_almost_equal(context[name],
+                                                        expected[name])
+
+    def test_reassigned_scalars(self):
+        block = Block('a = x * k\nk = 3\nb = x * k')
+        context = dict(x=self.x, k=2)
+        block.execute_chunked(context, directory=self.directory,
+                              chunk_size=100)
+        numpy.testing.assert_array_equal(context['a'], self.x * 2)
+        numpy.testing.assert_array_equal(context['b'], self.x * 3)
+
+    def test_rebound_arrays(self):
+        block = Block('b = x * 2\nb = 5')
+        context = dict(x=self.x)
+        block.execute_chunked(context, directory=self.directory,
+                              chunk_size=100)
+        self.assertEqual(context['b'], 5)
+
+    def test_unaligned_arrays(self):
+        execution = ChunkedExecution(Block('a = x + y'),
+                                     dict(x=self.x, y=self.y[:10]))
+        self.assertRaises(ValueError, execution.run)
+
+
+if __name__ == '__main__':
+    unittest.main()
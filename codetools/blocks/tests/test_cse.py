@@ -0,0 +1,94 @@
+"""Tests for common-subexpression elimination in Blocks."""
+
+import unittest
+
+import numpy
+
+from codetools.blocks.block import Block
+from codetools.blocks.cse import eliminate_common_subexpressions
+
+CODE = """import numpy as np
+from numpy import interp, log
+a = log(vp) * 2
+b = log(vp) + interp(depth, xp, fp)
+c = interp(depth, xp, fp) ** 2 + np.sqrt(a) + np.sqrt(a)
+"""
+
+
+class CSETestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.context = dict(vp=numpy.linspace(1, 2, 5),
+                            depth=numpy.linspace(0, 10, 5),
+                            xp=numpy.array([0., 10.]),
+                            fp=numpy.array([1., 3.]))
+
+    def execute(self, block):
+        names = dict((name, value.copy())
+                     for name, value in self.context.items())
+        block.execute(names)
+        return names
+
+    def assertSameResults(self, block, optimized, names):
+        expected = self.execute(block)
+        results = self.execute(optimized)
+        for name in names:
+            numpy.testing.assert_array_equal(results[name], expected[name])
+
+    def test_hoisted_expressions(self):
+        block = Block(CODE)
+        optimized, temporaries = eliminate_common_subexpressions(block)
+        self.assertEqual(sorted(temporaries.values()),
+                         ['interp(depth, xp, fp)', 'log(vp)', 'np.sqrt(a)'])
+        self.assertEqual(len(optimized.sub_blocks), 8)
+        self.assertEqual(optimized.outputs,
+                         block.outputs | set(temporaries))
+        self.assertSameResults(block, optimized, 'abc')
+
+    def test_restrict(self):
+        optimized, temporaries = eliminate_common_subexpressions(Block(CODE))
+        restricted = optimized.restrict(outputs=['b'])
+        self.assertEqual(restricted.outputs - set(temporaries), set(['b']))
+        names = self.execute(restricted)
+        numpy.testing.assert_array_equal(
+            names['b'], numpy.log(self.context['vp']) +
+            numpy.interp(self.context['depth'], self.context['xp'],
+                         self.context['fp']))
+
+        restricted = optimized.restrict(inputs=['depth'])
+        self.assertEqual(restricted.outputs - set(temporaries),
+                         set(['b', 'c']))
+
+    def test_impure_functions_are_not_hoisted(self):
+        # Functions from the context, and methods, could do anything
+        block = Block('a = f(x) + f(x)\nb = x.sum() + x.sum()\n'
+                      'import numpy\nc = numpy.random.rand(3) + '
+                      'numpy.random.rand(3)')
+        optimized, temporaries = eliminate_common_subexpressions(block)
+        self.assertEqual(temporaries, {})
+
+    def test_modified_names(self):
+        block = Block('from numpy import log\na = log(vp)\nvp.sort()\n'
+                      'b = log(vp)\nvp[0] = 5\nc = log(vp)\n'
+                      'vp = vp * 2\nd = log(vp)\ne = log(vp)')
+        self.context['vp'] = self.context['vp'][::-1]
+        optimized, temporaries = eliminate_common_subexpressions(block)
+        self.assertEqual(temporaries.values(), ['log(vp)'])
+        self.assertSameResults(block, optimized, 'abcde')
+
+    def test_conditional_expressions(self):
+        block = Block('import math\na = x > 0 and math.sqrt(x)\n'
+                      'b = x > 0 and math.sqrt(x)')
+        optimized, temporaries = eliminate_common_subexpressions(block)
+        self.assertEqual(temporaries, {})
+        self.assertEqual(optimized.execute({'x': -1.0}), None)
+
+    def test_existing_names_are_not_reused(self):
+        block = Block('import math\n__cse_0 = 1\na = math.sqrt(x) + '
+                      'math.sqrt(x)')
+        optimized, temporaries = eliminate_common_subexpressions(block)
+        self.assertEqual(temporaries.keys(), ['__cse_1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""Tests for the decomposition of compound statements into sub-blocks."""
+
+from compiler import parse
+import unittest
+
+from codetools.blocks.block import Block
+from codetools.blocks.compiler_unparse import unparse
+from codetools.blocks.decomposition import decompose_statement
+
+CODE = """import math
+if mode == 'fast' and n > 1:
+    a = f(x)
+    b = g(y)
+elif mode == 'slow':
+    a = h(x)
+else:
+    pass
+    c = 0
+for i in range(n):
+    k = scale * 2
+    j = k + 1
+    y[i] = x[i] * k
+    z = i * j
+d = a + 1
+"""
+
+
+def pieces(code):
+    return [unparse(piece).split()
+            for piece in decompose_statement(parse(code).node.nodes[0])]
+
+
+class DecomposeStatementTestCase(unittest.TestCase):
+
+    def test_if(self):
+        self.assertEqual(
+            pieces('if m:\n a = 1\n if n:\n  b = 2\n  c = 3\nelse:\n d = 4'),
+            [['if', 'm:', 'a', '=', '1'],
+             ['if', 'm:', 'if', 'n:', 'b', '=', '2'],
+             ['if', 'm:', 'if', 'n:', 'c', '=', '3'],
+             ['if', 'm:', 'pass', 'else:', 'd', '=', '4']])
+
+    def test_if_stays_whole(self):
+        for code in ['if f(m):\n a = 1\n b = 2',
+                     'if m:\n m = 1\n b = 2',
+                     'if m.x:\n a = 1\n b = 2']:
+            self.assertEqual(len(pieces(code)), 1, code)
+
+    def test_for(self):
+        self.assertEqual(
+            pieces('for i in range(n):\n k = s * 2\n y[i] = k\n'),
+            [['if', 'range(n):', 'k', '=', 's*2'],
+             ['for', 'i', 'in', 'range(n):', 'y[i]', '=', 'k']])
+        self.assertEqual(
+            pieces('for i in (1, 2):\n k = s * 2\n'),
+            [['if', '(1,', '2):', 'k', '=', 's*2'],
+             ['for', 'i', 'in', '(1,', '2):', 'pass']])
+
+    def test_for_stays_whole(self):
+        for code in ['for i in items:\n k = s * 2\n y[i] = k',
+                     'for i in range(n):\n k = s * 2\n if i: break',
+                     'for i in range(n):\n k = s * 2\nelse:\n y = 1',
+                     'for i in range(n):\n k = i * 2',
+                     'for i in range(n):\n k = f(s)',
+                     'for i in range(n):\n s = s + 1\n k = s * 2',
+                     'for i in range(n):\n y = k\n k = s * 2',
+                     'for i in range(n):\n k = s * 2\n k = 1']:
+            self.assertEqual(len(pieces(code)), 1, code)
+
+
+class BlockDecompositionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.block = Block(CODE, decompose_compound_statements=True)
+        self.functions = dict(f=lambda x: 1, g=lambda y: 2, h=lambda x: 3)
+
+    def context(self, mode):
+        return dict(self.functions, mode=mode, n=3, scale=1.5, x=[1, 2, 3],
+                    y=[0, 0, 0])
+
+    def test_sub_blocks(self):
+        self.assertEqual(len(Block(CODE).sub_blocks), 4)
+        self.assertEqual(len(self.block.sub_blocks), 9)
+        self.assertEqual(self.block.outputs, Block(CODE).outputs)
+        self.assertEqual(self.block.inputs, Block(CODE).inputs)
+
+    def test_same_results_as_execute(self):
+        for mode in ['fast', 'slow', 'other']:
+            expected = self.context(mode)
+            try:
+                Block(CODE).execute(expected)
+            except NameError:
+                expected = None
+            names = self.context(mode)
+            try:
+                self.block.execute(names)
+            except NameError:
+                names = None
+            self.assertEqual(names, expected)
+
+    def test_restrict(self):
+        restricted = self.block.restrict(outputs=['b'])
+        self.assertEqual(restricted.all_outputs, set(['b']))
+        self.assertNotIn('f(x)', restricted.codestring)
+
+        restricted = self.block.restrict(inputs=['scale'])
+        self.assertEqual(restricted.all_outputs, set(['i', 'j', 'k', 'z']))
+        self.assertNotIn('f(x)', restricted.codestring)
+
+    def test_toggle(self):
+        block = Block(CODE)
+        block.decompose_compound_statements = True
+        self.assertEqual(len(block.sub_blocks), 9)
+        block.decompose_compound_statements = False
+        self.assertEqual(len(block.sub_blocks), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
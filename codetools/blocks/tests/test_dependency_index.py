@@ -0,0 +1,222 @@
+"""Tests for incremental dependency analysis of Blocks."""
+
+import random
+import unittest
+
+from codetools.blocks.block import Block
+from codetools.blocks.dependency_index import DependencyIndex
+
+
+STATEMENTS = [
+    'a = 1',
+    'b = a + x',
+    'c = b * y',
+    'if t: a = 2',
+    'if t: c = z',
+    'd = c.real',
+    'import os',
+    'p = os.path.join(a, "q")',
+    'from math import sqrt',
+    'e = sqrt(d)',
+    'x = e',
+    'a = a.b.c',
+    'f = c + e',
+    'for i in range(3):\n    g = f',
+]
+
+
+def full_analysis(blocks):
+    """ The analysis of 'blocks' computed from scratch. """
+    _, _, _, dep_graph = Block._compute_dependencies(blocks)
+    b = Block(blocks) if blocks else Block()
+    return (dict((k, set(v)) for k, v in dep_graph.items()), b.inputs,
+            b.outputs, b.conditional_outputs)
+
+
+def scanned_names(blocks, name):
+    """ The readers, writers and conditional writers of 'name', scanned. """
+    readers = [b for b in blocks
+               if any(i == name or i.startswith(name + '.')
+                      for i in b.inputs)]
+    writers = [b for b in blocks
+               if name in b.outputs or name in b.fromimports]
+    conditional = [b for b in blocks
+                   if name in b.outputs | b.conditional_outputs |
+                   b.fromimports]
+    return readers, writers, conditional
+
+
+class DependencyIndexTestCase(unittest.TestCase):
+
+    def assertMatches(self, index, blocks):
+        dep_graph, inputs, outputs, conditional_outputs = full_analysis(blocks)
+        self.assertEqual(index.dep_graph, dep_graph)
+        self.assertEqual(index.inputs, inputs)
+        self.assertEqual(index.outputs, outputs)
+        self.assertEqual(index.conditional_outputs, conditional_outputs)
+        for name in ['a', 'c', 'os', 'os.path', 'sqrt', 'x']:
+            readers, writers, conditional = scanned_names(blocks, name)
+            self.assertEqual(index.readers(name), readers)
+            self.assertEqual(index.writers(name), writers)
+            self.assertEqual(index.writers(name, conditional=True),
+                             conditional)
+            self.assertEqual(index.last_writer(name),
+                             conditional[-1] if conditional else None)
+        self.assertEqual(index.imports(),
+                         [b for b in blocks if b.fromimports])
+
+    def test_construction(self):
+        blocks = [Block(s) for s in STATEMENTS]
+        self.assertMatches(DependencyIndex(blocks), blocks)
+
+    def test_random_splices(self):
+        rng = random.Random(0)
+        blocks = []
+        index = DependencyIndex()
+        for _ in range(200):
+            start = rng.randint(0, len(blocks))
+            stop = rng.randint(start, min(len(blocks), start + 2))
+            added = [Block(rng.choice(STATEMENTS))
+                     for _ in range(rng.randint(0, 2))]
+            index.splice(start, blocks[start:stop], added)
+            blocks[start:stop] = added
+            self.assertMatches(index, blocks)
+
+
+class IncrementalBlockTestCase(unittest.TestCase):
+
+    def test_sub_block_edits(self):
+        b = Block('a = x\nb = a + 1\nc = b * 2', incremental=True)
+        b._dep_graph
+        b.sub_blocks.append(Block('d = c + y'))
+        b.sub_blocks.insert(1, Block('a = 3'))
+        del b.sub_blocks[0]
+        b.sub_blocks[0] = Block('a = z')
+        expected = Block([s.ast for s in b.sub_blocks])
+        self.assertEqual(b.inputs, expected.inputs)
+        self.assertEqual(b.outputs, expected.outputs)
+        self.assertEqual(b.inputs, set(['y', 'z']))
+
+        names = dict(y=1, z=2)
+        b.execute(names)
+        self.assertEqual(names['d'], 7)
+
+    def test_restrictions_are_selectively_invalidated(self):
+        b = Block('a = x\nb = a + 1\nc = y * 2', incremental=True)
+        by_x = b.restrict(inputs=('x',))
+        by_y = b.restrict(inputs=('y',))
+
+        # Editing the 'y' chain leaves the 'x' restriction alone
+        b.sub_blocks.append(Block('d = c + 1'))
+        self.assertIs(b.restrict(inputs=('x',)), by_x)
+        by_y_new = b.restrict(inputs=('y',))
+        self.assertIsNot(by_y_new, by_y)
+
+        names = dict(y=1)
+        by_y_new.execute(names)
+        self.assertEqual(names['d'], 3)
+
+    def test_splice_sub_blocks(self):
+        b = Block('a = x\nb = a + 1\nc = y * 2', incremental=True)
+        by_x = b.restrict(inputs=('x',))
+        b.sub_blocks.append(Block('d = c').sub_blocks[0])
+        self.assertIs(b.restrict(inputs=('x',)), by_x)
+        names = dict(y=1)
+        b.restrict(inputs=('y',)).execute(names)
+        self.assertEqual(names['d'], 2)
+
+        # A statement that reads what it binds makes 'restrict' fail
+        b.sub_blocks.append(Block('e = 1\ne = e + 1').sub_blocks[1])
+        self.assertRaises(RuntimeError, b.restrict, inputs=('x',))
+
+    def test_name_queries(self):
+        b = Block('import os\na = x\nif t:\n    a = os.sep\nb = a + x.y')
+        imp, first, branch, last = b.sub_blocks
+        self.assertEqual(b.readers('x'), [first, last])
+        self.assertEqual(b.readers('x.y'), [last])
+        self.assertEqual(b.readers('os'), [branch])
+        self.assertEqual(b.writers('a'), [first])
+        self.assertEqual(b.writers('a', conditional=True), [first, branch])
+        self.assertEqual(b.writers('os'), [imp])
+        self.assertIs(b.last_writer('a'), branch)
+        self.assertIs(b.last_writer('a', before=branch), first)
+        self.assertIs(b.last_writer('b'), last)
+        self.assertIs(b.last_writer('x'), None)
+
+        # The index follows the edits of the sub-blocks
+        index = b._dependency_index
+        b.sub_blocks.append(Block('a = b'))
+        self.assertIs(b._dependency_index, index)
+        self.assertIs(b.last_writer('a'), b.sub_blocks[-1])
+        self.assertEqual(b.readers('b'), [b.sub_blocks[-1]])
+        self.assertEqual([s.ast for s in
+                          b.restrict(inputs=('x',)).sub_blocks],
+                         [s.ast for s in b.sub_blocks])
+        b.sub_blocks = [Block('c = 1')]
+        self.assertEqual(b.readers('x'), [])
+
+    def test_insert_between_provider_and_reader(self):
+        b = Block('y = x\nz = y', incremental=True)
+        self.assertEqual(len(b.restrict(inputs=('x',)).sub_blocks), 2)
+        b.sub_blocks.insert(1, Block('y = 2'))
+        self.assertEqual(len(b.restrict(inputs=('x',)).sub_blocks), 1)
+
+    def test_rebinding_cuts_cached_restrictions(self):
+        b = Block('a = x\nc = a + 1', incremental=True)
+        self.assertEqual(len(b.restrict(inputs=('x',),
+                                        outputs=('a',)).sub_blocks), 1)
+        b.sub_blocks.append(Block('a = 5'))
+        self.assertEqual(b.restrict(inputs=('x',), outputs=('a',)).sub_blocks,
+                         [])
+
+        # Restricting to names the edits removed fails, cached or not
+        b.restrict(inputs=('a',), outputs=('c',))
+        b.sub_blocks[1] = Block('d = a + 1')
+        self.assertRaises(ValueError, b.restrict, inputs=('a',),
+                          outputs=('c',))
+
+    def test_random_edits_match_fresh_restrictions(self):
+        statements = ['a = x', 'b = a + y', 'c = b * 2', 'a = 5', 'b = c + x',
+                      'if t: c = a', 'd = c + b', 'y = d', 'x = 1',
+                      'e = a.real + d', 'a.b = c', 'g = a.b + x',
+                      'from math import sqrt', 'f = sqrt(e)']
+        names = ['a', 'b', 'c', 'd', 'e', 'x', 'y', 't']
+
+        def restriction(block, inputs, outputs):
+            try:
+                restricted = block.restrict(inputs=inputs, outputs=outputs)
+            except ValueError:
+                return ValueError
+            return [s.codestring for s in restricted.sub_blocks]
+
+        rng = random.Random(0)
+        for _ in range(10):
+            b = Block('\n'.join(rng.sample(statements, 4)), incremental=True)
+            for _ in range(30):
+                keys = [(rng.sample(names, rng.randint(0, 2)),
+                         rng.sample(names, rng.randint(0, 2)))
+                        for _ in range(8)]
+                for inputs, outputs in keys:
+                    restriction(b, inputs, outputs)
+
+                n = len(b.sub_blocks)
+                edit = rng.randint(0, 2) if n else 0
+                if edit == 0:
+                    b.sub_blocks.insert(rng.randint(0, n),
+                                        Block(rng.choice(statements)))
+                elif edit == 1:
+                    del b.sub_blocks[rng.randint(0, n - 1)]
+                else:
+                    b.sub_blocks[rng.randint(0, n - 1)] = \
+                        Block(rng.choice(statements))
+                if not b.sub_blocks:
+                    continue
+
+                fresh = Block([s.ast for s in b.sub_blocks])
+                for inputs, outputs in keys:
+                    self.assertEqual(restriction(b, inputs, outputs),
+                                     restriction(fresh, inputs, outputs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+"""Tests for the compiled execution plans of Blocks."""
+
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+import unittest
+
+from codetools.blocks.block import (Block, CompositeException,
+                                    ExecutionCancelled)
+from codetools.blocks.execution_plan import DRIVER_SIZE, ExecutionPlan
+
+CODE = """a = 1
+b = a + 1
+c = 1/0
+d = undefined
+e = b
+"""
+
+
+def last_frame(tb):
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    return tb.tb_frame.f_code.co_filename, tb.tb_lineno
+
+
+class ExecutionPlanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, code):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as f:
+            f.write(code)
+        return filename
+
+    def test_groups(self):
+        b = Block('a = 1\nb = a')
+        plan = ExecutionPlan(b)
+        self.assertEqual([g[2] for g in plan.groups],
+                         [[b.sub_blocks[0]], [b.sub_blocks[1]]])
+
+        # Sub-blocks from the same file are compiled together
+        f = Block(file=self.write('model.py', 'a = 1\nb = a\n'))
+        plan = ExecutionPlan(f)
+        self.assertEqual(len(plan.groups), 1)
+        self.assertEqual(plan.groups[0][2], f.sub_blocks)
+
+        # So are all the sub-blocks without filenames in tracebacks
+        b.no_filenames_in_tracebacks = True
+        plan = ExecutionPlan(b)
+        self.assertEqual(len(plan.groups), 1)
+        self.assertIs(plan.groups[0][3], b._code)
+
+    def test_sub_block_filenames(self):
+        b = Block(CODE)
+        try:
+            b.execute({})
+        except ZeroDivisionError:
+            self.assertEqual(last_frame(sys.exc_info()[2]),
+                             ('<%r>' % b.sub_blocks[2], 3))
+        else:
+            self.fail('ZeroDivisionError not raised')
+
+    def test_mixed_filenames(self):
+        first = Block(file=self.write('first.py', 'a = 1\nb = a + 1\n'))
+        second = Block(file=self.write('second.py', '\nc = b\nd = 1/0\n'))
+        b = Block(first.sub_blocks + second.sub_blocks)
+        self.assertEqual(len(b._execution_plan.groups), 2)
+        names = {}
+        try:
+            b.execute(names)
+        except ZeroDivisionError:
+            self.assertEqual(last_frame(sys.exc_info()[2]),
+                             (second.sub_blocks[0].filename, 3))
+        else:
+            self.fail('ZeroDivisionError not raised')
+        self.assertEqual(names['c'], 2)
+        self.assertEqual(names['__file__'], second.sub_blocks[0].filename)
+
+    def test_continue_on_errors(self):
+        b = Block(CODE)
+        names = {}
+        try:
+            b.execute(names, continue_on_errors=True)
+        except CompositeException as e:
+            self.assertEqual([type(x) for x in e.exceptions],
+                             [ZeroDivisionError, NameError])
+            self.assertIn('ZeroDivisionError', e.exceptions[0].traceback)
+            self.assertIn('<%r>' % b.sub_blocks[2], e.exceptions[0].traceback)
+        else:
+            self.fail('CompositeException not raised')
+        self.assertEqual(names, dict(a=1, b=2, e=2))
+
+    def test_continue_on_errors_in_a_file(self):
+        filename = self.write('model.py', CODE)
+        b = Block(file=filename)
+        names = {}
+        self.assertRaises(CompositeException, b.execute, names,
+                          continue_on_errors=True)
+        self.assertEqual(names, dict(a=1, b=2, e=2, __file__=filename))
+
+        b.no_filenames_in_tracebacks = True
+        names = {}
+        self.assertRaises(CompositeException, b.execute, names,
+                          continue_on_errors=True)
+        self.assertEqual(names, dict(a=1, b=2, e=2, __file__=filename))
+
+    def test_single_statement_continue_on_errors(self):
+        b = Block('a = 1/0')
+        try:
+            b.execute({}, continue_on_errors=True)
+        except ZeroDivisionError as e:
+            self.assertIn('ZeroDivisionError', e.traceback)
+        else:
+            self.fail('ZeroDivisionError not raised')
+
+    def test_plan_follows_changes(self):
+        b = Block('a = 1')
+        names = {}
+        b.execute(names)
+        b.sub_blocks.append(Block('b = a + 1'))
+        b.execute(names)
+        self.assertEqual(names, dict(a=1, b=2))
+
+        b.no_filenames_in_tracebacks = True
+        self.assertEqual(b._execution_plan.groups[0][1],
+                         '(Block with filename suppressed)')
+
+    def test_recursive_execution(self):
+        # The inner execution must not lose the errors of the outer one
+        b = Block('a = 1/0\nb = block.execute(names, continue_on_errors=True) '
+                  'if depth else 0')
+        names = dict(depth=1, block=b, names=dict(depth=0))
+        try:
+            b.execute(names, continue_on_errors=True)
+        except CompositeException as e:
+            self.assertEqual([type(x) for x in e.exceptions],
+                             [ZeroDivisionError, ZeroDivisionError])
+        else:
+            self.fail('CompositeException not raised')
+        self.assertEqual(names['names']['b'], 0)
+
+    def test_traceback_module(self):
+        b = Block('a = 1\nb = a/0')
+        try:
+            b.execute({})
+        except ZeroDivisionError:
+            text = traceback.format_exc()
+        self.assertIn('<%r>' % b.sub_blocks[1], text)
+
+    def test_long_blocks(self):
+        # More runs than fit in one driver
+        count = 3 * DRIVER_SIZE + 5
+        code = ''.join('x%d = x%d + 1\n' % (i + 1, i) for i in range(count))
+        b = Block(code + 'y = 1/0\n')
+        names = dict(x0=0)
+        try:
+            b.execute(names)
+        except ZeroDivisionError:
+            self.assertEqual(last_frame(sys.exc_info()[2]),
+                             ('<%r>' % b.sub_blocks[-1], count + 1))
+        else:
+            self.fail('ZeroDivisionError not raised')
+        self.assertEqual(names['x%d' % count], count)
+
+        names = dict(x0=0)
+        self.assertRaises(ZeroDivisionError, b.execute, names, {}, True)
+        self.assertEqual(names['x%d' % count], count)
+
+    def test_cancellation(self):
+        code = 'a = 1\nb = a + 1\nc = b + 1\n'
+        mixed = Block(code)
+        mixed.sub_blocks[0].filename = 'first.py'
+        for sub_block in mixed.sub_blocks[1:]:
+            sub_block.filename = 'model.py'
+        for b in [Block(code), Block(file=self.write('model.py', code)),
+                  Block(code, no_filenames_in_tracebacks=True), mixed]:
+            for continue_on_errors in [False, True]:
+                names = {}
+                self.assertRaises(ExecutionCancelled, b.execute, names, {},
+                                  continue_on_errors, lambda: 'b' in names)
+                self.assertEqual(names.pop('a'), 1)
+                self.assertEqual(names.pop('b'), 2)
+                self.assertNotIn('c', names)
+
+                names = {}
+                b.execute(names, {}, continue_on_errors, lambda: False)
+                self.assertEqual(names['c'], 3)
+
+        names = {}
+        self.assertRaises(ExecutionCancelled, Block(code).execute, names,
+                          cancelled=lambda: True)
+        self.assertEqual(names, {})
+
+    def test_execution_needs_no_analysis(self):
+        b = Block(CODE.replace('1/0', '2').replace('undefined', 'c'))
+        names = {}
+        b.execute(names)
+        self.assertEqual(names['e'], 2)
+        self.assertIs(b._inputs, None)
+        self.assertTrue(all(s._inputs is None for s in b.sub_blocks))
+        self.assertIs(b._dependency_index, None)
+        self.assertFalse(b._Block__dep_graph_is_valid)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Tests for compiling Blocks into Python functions."""
+
+import sys
+import unittest
+
+from codetools.blocks.block import Block
+from codetools.blocks.fast_function import compile_function
+
+CODE = """import math
+c = a + b
+d = math.sqrt(c)
+if d > 1:
+    e = d * 2
+else:
+    e = -d
+f = [i * c for i in range(3)]
+"""
+
+
+class GetFunctionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.block = Block(CODE)
+
+    def test_fast_locals(self):
+        f = self.block.get_function(['a', 'b'], ['e'])
+        self.assertEqual(f.func_code.co_varnames[:2], ('a', 'b'))
+        self.assertIn('c', f.func_code.co_varnames)
+        self.assertEqual(f(1, 3), 4.0)
+        self.assertEqual(f(b=0, a=0.25), -0.5)
+
+    def test_same_results_as_execute(self):
+        f = self.block.get_function(['a', 'b'], ['c', 'e', 'f'])
+        names = dict(a=2, b=7)
+        self.block.execute(names)
+        self.assertEqual(f(2, 7), (names['c'], names['e'], names['f']))
+
+    def test_single_names(self):
+        f = Block('c = a + b').get_function(['a', 'b'], 'c')
+        self.assertEqual(f.__doc__, 'c = <name>(a,b)')
+        self.assertEqual(f(1, 2), 3)
+        self.assertRaises(TypeError, f, 1)
+
+    def test_cache(self):
+        f = self.block.get_function(['a', 'b'], ['e'])
+        self.assertIs(self.block.get_function(('a', 'b'), ('e',)), f)
+        self.assertIsNot(self.block.get_function(['b', 'a'], ['e']), f)
+
+        self.block.sub_blocks.append(Block('g = e'))
+        self.assertIsNot(self.block.get_function(['a', 'b'], ['e']), f)
+
+    def test_tracebacks(self):
+        f = Block('c = a + 1\nd = c / b').get_function(['a', 'b'], ['d'])
+        try:
+            f(1, 0)
+        except ZeroDivisionError:
+            tb = sys.exc_info()[2]
+            while tb.tb_next is not None:
+                tb = tb.tb_next
+            self.assertEqual(tb.tb_lineno, 2)
+        else:
+            self.fail('ZeroDivisionError not raised')
+
+    def test_fallback(self):
+        block = Block('c = a + 1\nd = sorted(locals()) + [c]')
+        self.assertIsNone(compile_function(block, ['a'], ['d']))
+        f = block.get_function(['a'], ['c', 'd'])
+        self.assertEqual(f(1), (2, ['a', 'c', 2]))
+        self.assertRaises(ValueError, f)
+
+    def test_unsafe_bodies(self):
+        for code in ['def f():\n    return 1\nb = f()',
+                     'g = lambda: (yield)\nb = 1']:
+            self.assertIsNotNone(compile_function(Block(code), [], ['b']))
+        for code in ['return 1', 'yield 1', 'exec "b = 1"',
+                     'b = vars()', 'import six\nsix.exec_("b = 1")']:
+            self.assertIsNone(compile_function(Block(code), [], ['b']))
+        self.assertIsNone(compile_function(Block('b = a'), ['a', 'a'], ['b']))
+        self.assertIsNone(compile_function(Block('b = a'), ['a.x'], ['b']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+"""Tests for the fusion of elementwise statements."""
+
+import cPickle
+import marshal
+import unittest
+
+import numpy
+
+from codetools.blocks.block import Block
+from codetools.blocks.fusion import (Kernel, elementwise_statement,
+                                     fuse_elementwise)
+
+CODE = """import numpy
+from numpy import sqrt
+a = x * y
+b = a + z
+c = sqrt(b)
+d = numpy.exp(-c) * 2 + a
+e = d.sum()
+f = c + 1
+"""
+
+
+class FusionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.block = Block(CODE)
+        self.x = numpy.random.rand(1001, 3)
+        self.y = numpy.random.rand(1001, 3)
+
+    def execute(self, block, **names):
+        block.execute(names)
+        names.pop('__builtins__', None)
+        return names
+
+    def assertSameNames(self, names, expected):
+        self.assertEqual(sorted(names), sorted(expected))
+        for name in names:
+            numpy.testing.assert_array_equal(names[name], expected[name])
+
+    def test_elementwise_statements(self):
+        for code in ['a = x * y', 'a = -x ** 2 % 3', 'a = numpy.sqrt(x + 1)',
+                     'a = f(x, g(y))']:
+            self.assertIsNotNone(elementwise_statement(Block(code).ast))
+        for code in ['a = x', 'a = 1', 'a = x.sum()', 'a = f(x, axis=0)',
+                     'a = x[0] + 1', 'a, b = x + 1, y', 'a += x * y',
+                     'a = x < y', 'a = f(*x)']:
+            self.assertIsNone(elementwise_statement(Block(code).ast), code)
+
+    def test_fused_block(self):
+        fused = fuse_elementwise(self.block, chunk_size=100)
+        self.assertEqual(len(fused.sub_blocks), 5)
+        self.assertEqual(fused.sub_blocks[2].outputs, set(['c', 'd']))
+        self.assertEqual(fused.sub_blocks[2].inputs,
+                         set(['x', 'y', 'z', 'sqrt', 'numpy']))
+
+        expected = self.execute(self.block, x=self.x, y=self.y, z=2.0)
+        names = self.execute(fused, x=self.x, y=self.y, z=2.0)
+        # The intermediate names aren't bound
+        del expected['a'], expected['b']
+        self.assertSameNames(names, expected)
+
+    def test_keep(self):
+        fused = fuse_elementwise(self.block, keep=['a'])
+        names = self.execute(fused, x=self.x, y=self.y, z=2.0)
+        numpy.testing.assert_array_equal(names['a'], self.x * self.y)
+        self.assertNotIn('b', names)
+
+    def test_unfused_values(self):
+        # Scalars, lists and arrays of different shapes run the statements
+        fused = fuse_elementwise(self.block)
+        for x, y in [(2.0, 3.0), (self.x, self.y[0]),
+                     (numpy.arange(3.), [1., 2., 3.])]:
+            expected = self.execute(self.block, x=x, y=y, z=1.0)
+            del expected['a'], expected['b']
+            self.assertSameNames(self.execute(fused, x=x, y=y, z=1.0),
+                                 expected)
+
+    def test_dtypes(self):
+        block = Block('a = x * 2\nb = a / y\nc = a + 0.5')
+        fused = fuse_elementwise(block, chunk_size=7)
+        x = numpy.arange(20, dtype=numpy.int32)
+        for y in [3, 2.5, numpy.float32(2)]:
+            expected = self.execute(block, x=x, y=y)
+            names = self.execute(fused, x=x, y=y)
+            self.assertEqual(names['b'].dtype, expected['b'].dtype)
+            self.assertEqual(names['c'].dtype, expected['c'].dtype)
+            numpy.testing.assert_array_equal(names['b'], expected['b'])
+
+    def test_kernel(self):
+        statements = [elementwise_statement(Block(code).ast) for code in
+                      ['a = x + 1', 'b = a * 2', 'c = b - 3', 'd = c / 4']]
+        kernel = Kernel(statements, ['d'], chunk_size=10)
+        self.assertEqual(kernel.inputs, ['x'])
+        self.assertEqual(len(kernel.ops), 4)
+        x = numpy.arange(25.)
+        numpy.testing.assert_array_equal(kernel(x), ((x + 1) * 2 - 3) / 4)
+
+    def test_reassigned_names_are_not_fused(self):
+        block = Block('a = x * 2\na = a + 1\nb = a * a')
+        fused = fuse_elementwise(block)
+        names = self.execute(fused, x=numpy.arange(4.))
+        numpy.testing.assert_array_equal(names['b'],
+                                         (numpy.arange(4.) * 2 + 1) ** 2)
+
+    def test_attribute_reads_keep_names(self):
+        block = Block('a = x * y\nb = a + z\nc = b * 2\ns = a.shape\n'
+                      't = b.sum()')
+        fused = fuse_elementwise(block)
+        expected = self.execute(block, x=self.x, y=self.y, z=2.0)
+        names = self.execute(fused, x=self.x, y=self.y, z=2.0)
+        self.assertSameNames(names, expected)
+
+    def test_round_trips(self):
+        fused = fuse_elementwise(self.block, chunk_size=100)
+        expected = self.execute(fused, x=self.x, y=self.y, z=2.0)
+        copies = [Block(fused.codestring),
+                  cPickle.loads(cPickle.dumps(fused, 2))]
+        for copy in copies:
+            self.assertEqual(copy.codestring, fused.codestring)
+            self.assertSameNames(self.execute(copy, x=self.x, y=self.y,
+                                              z=2.0), expected)
+
+        # (As 'execute_processes' sends it to the workers)
+        names = dict(x=self.x, y=self.y, z=2.0)
+        exec marshal.loads(marshal.dumps(fused._code)) in names
+        names.pop('__builtins__')
+        self.assertSameNames(names, expected)
+
+        # (The unparser drops these parentheses and doesn't know '%')
+        block = Block('a = x - (y - z)\nb = a % 3 * 0.1')
+        copy = Block(fuse_elementwise(block, keep=['a']).codestring)
+        self.assertSameNames(self.execute(copy, x=self.x, y=self.y, z=2.0),
+                             self.execute(block, x=self.x, y=self.y, z=2.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
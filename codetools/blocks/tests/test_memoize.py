@@ -0,0 +1,150 @@
+"""Tests for memoized execution of Blocks."""
+
+import unittest
+
+import numpy
+
+from codetools.blocks.block import (Block, CompositeException,
+                                    ExecutionCancelled)
+from codetools.blocks.memoize import (Memoizer, Unfingerprintable,
+                                      fingerprint, register_version)
+
+
+class Versioned(object):
+
+    def __init__(self):
+        self.version = 0
+
+
+class FingerprintTestCase(unittest.TestCase):
+
+    def test_values(self):
+        self.assertEqual(fingerprint((1, 'a', None)), fingerprint((1, 'a', None)))
+        self.assertNotEqual(fingerprint(1), fingerprint(True))
+        self.assertNotEqual(fingerprint(2), fingerprint(3))
+
+    def test_arrays(self):
+        a = numpy.arange(10.)
+        self.assertEqual(fingerprint(a), fingerprint(a.copy()))
+        self.assertNotEqual(fingerprint(a), fingerprint(a.reshape(2, 5)))
+        self.assertNotEqual(fingerprint(a), fingerprint(a.astype(int)))
+        b = a.copy()
+        b[3] = 0
+        self.assertNotEqual(fingerprint(a), fingerprint(b))
+        self.assertEqual(fingerprint(a[::2]), fingerprint(a[::2].copy()))
+
+    def test_identity(self):
+        self.assertEqual(fingerprint(numpy), fingerprint(numpy))
+        self.assertNotEqual(fingerprint(len), fingerprint(min))
+
+    def test_mutable_objects(self):
+        self.assertRaises(Unfingerprintable, fingerprint, [1])
+        self.assertRaises(Unfingerprintable, fingerprint, (1, [1]))
+        register_version(Versioned, lambda obj: obj.version)
+        obj = Versioned()
+        before = fingerprint(obj)
+        self.assertEqual(fingerprint(obj), before)
+        obj.version += 1
+        self.assertNotEqual(fingerprint(obj), before)
+        self.assertNotEqual(fingerprint(Versioned()), before)
+
+
+class MemoizerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.memoizer = Memoizer()
+        self.calls = []
+        self.block = Block('a = f(x)\n'
+                           'b = f(y)\n'
+                           'c = a + b')
+
+    def f(self, value):
+        self.calls.append(value)
+        return value * 2
+
+    def execute(self, **names):
+        names['f'] = self.f
+        self.memoizer.execute(self.block, names)
+        del names['f']
+        return names
+
+    def test_unchanged_inputs_are_replayed(self):
+        self.assertEqual(self.execute(x=1, y=2), dict(x=1, y=2, a=2, b=4, c=6))
+        self.assertEqual(self.calls, [1, 2])
+        self.assertEqual(self.execute(x=1, y=3), dict(x=1, y=3, a=2, b=6, c=8))
+        self.assertEqual(self.calls, [1, 2, 3])
+        self.assertEqual(self.execute(x=1, y=2), dict(x=1, y=2, a=2, b=4, c=6))
+        self.assertEqual(self.calls, [1, 2, 3])
+
+    def test_cancellation(self):
+        names = dict(f=self.f, x=1, y=2)
+        self.assertRaises(ExecutionCancelled, self.memoizer.execute,
+                          self.block, names, cancelled=lambda: 'a' in names)
+        self.assertEqual(self.calls, [1])
+        self.assertNotIn('b', names)
+
+    def test_arrays(self):
+        x = numpy.arange(5.)
+        self.execute(x=x, y=1)
+        self.execute(x=x.copy(), y=1)
+        self.assertEqual(len(self.calls), 2)
+        x[0] = 10
+        result = self.execute(x=x, y=1)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(result['c'][0], 22)
+
+    def test_unfingerprintable_inputs_run(self):
+        block = Block('a = f(x)')
+        for _ in range(2):
+            self.memoizer.execute(block, dict(f=self.f, x=[1]))
+        self.assertEqual(self.calls, [[1], [1]])
+
+    def test_mutated_output_is_not_replayed(self):
+        block = Block('a = numpy.zeros(3)')
+        names = dict(numpy=numpy)
+        self.memoizer.execute(block, names)
+        names['a'][0] = 1
+        self.memoizer.execute(block, names)
+        self.assertEqual(names['a'][0], 0)
+
+    def test_impure_statements_run(self):
+        block = Block('a = f(y)\nb = random(-1)\nx[0] = f(1)')
+        for _ in range(2):
+            names = dict(f=self.f, x=numpy.zeros(1), y=0, random=abs)
+            self.memoizer.execute(block, names)
+        self.assertEqual(self.calls, [0, 1, 1])
+        self.assertEqual(names['x'][0], 2)
+
+    def test_mark_impure(self):
+        self.memoizer.mark_impure(self.block.sub_blocks[0])
+        self.execute(x=1, y=2)
+        self.execute(x=1, y=2)
+        self.assertEqual(self.calls, [1, 2, 1])
+        self.memoizer.mark_impure(self.block.sub_blocks[0], impure=False)
+        self.execute(x=1, y=2)
+        self.execute(x=1, y=2)
+        self.assertEqual(self.calls, [1, 2, 1, 1])
+
+    def test_bounded(self):
+        memoizer = Memoizer(max_size=1)
+        block = Block('a = f(x)')
+        for x in (1, 2, 2, 1):
+            memoizer.execute(block, dict(f=self.f, x=x))
+        self.assertEqual(self.calls, [1, 2, 1])
+        self.assertEqual(len(memoizer.cache), 1)
+
+    def test_errors_are_not_memoized(self):
+        block = Block('a = 1/x\nb = 1/y\nc = 2')
+        names = dict(x=0, y=0)
+        for _ in range(2):
+            try:
+                self.memoizer.execute(block, names, continue_on_errors=True)
+            except CompositeException as e:
+                self.assertEqual(len(e.exceptions), 2)
+            else:
+                self.fail('CompositeException not raised')
+        self.assertEqual(names['c'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Tests for constant folding and dead-code elimination in Blocks."""
+
+import unittest
+
+from codetools.blocks.block import Block
+from codetools.blocks.optimize import optimize
+
+CODE = """import math
+x = expensive()
+x = 2
+k = x * 3 + 1
+y = f(x, a)
+z = (k, 'a' * 3)
+x = x + 1
+if a:
+    k = 5
+w = k * 2
+print_(math.pi * 2, x)
+"""
+
+
+class OptimizeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = calls = []
+        self.block = Block(CODE)
+        self.functions = dict(expensive=lambda: calls.append('expensive'),
+                              f=lambda x, a: x + a,
+                              print_=lambda *args: calls.append(args))
+
+    def context(self, **names):
+        context = dict(self.functions, a=0)
+        context.update(names)
+        return context
+
+    def execute(self, block, **names):
+        context = self.context(**names)
+        block.execute(context)
+        context.pop('__builtins__', None)
+        return context
+
+    def test_same_results_as_execute(self):
+        optimized, report = optimize(self.block)
+        for a in [0, 1]:
+            self.calls[:] = []
+            expected = self.execute(self.block, a=a)
+            calls = self.calls[1:]
+            self.calls[:] = []
+            self.assertEqual(self.execute(optimized, a=a), expected)
+            self.assertEqual(self.calls, calls)
+
+    def test_overwritten_assignments_are_removed(self):
+        optimized, report = optimize(self.block)
+        self.assertEqual(report.removed,
+                         [('x = expensive()', 'overwritten'),
+                          ('x = 2', 'overwritten')])
+        self.execute(optimized)
+        self.assertNotIn('expensive', self.calls)
+
+    def test_constants_are_folded(self):
+        optimized, report = optimize(self.block)
+        self.assertEqual(report.constants, dict(x=3, k=7, z=(7, 'aaa')))
+        sources = [after for before, after in report.folded]
+        self.assertEqual(sources, ['k = 7', 'y = f(2, a)', "z = (7, 'aaa')",
+                                   'x = 3', 'print_(math.pi*2, 3)'])
+        # 'k' may be bound again by the 'if'
+        self.assertEqual(optimized.sub_blocks[-2].codestring.strip(),
+                         'w = k*2')
+        self.assertTrue(str(report).startswith(
+            'removed (overwritten): x = expensive()'))
+
+    def test_outputs(self):
+        optimized, report = optimize(self.block, outputs=['w'])
+        self.assertEqual([reason for source, reason in report.removed],
+                         ['unused'] * 5)
+        self.assertEqual(optimized.outputs, set(['k', 'w']))
+        self.assertEqual(self.execute(optimized, a=1)['w'], 10)
+
+    def test_mutable_and_large_values_are_not_folded(self):
+        block = Block("l = [1]\nm = l\ns = 'ab' * 10000\nt = s\nn = 1 / 0")
+        optimized, report = optimize(block)
+        self.assertEqual(report.folded, [])
+        self.assertEqual(report.removed, [])
+
+        # Results too large to compute at all
+        block = Block("a = 2 ** 10**10\nb = 'x' * 10**10\n"
+                      "c = (1,) * 10**10\nd = 1 << 1099511627776\ne = 2 ** 12")
+        optimized, report = optimize(block)
+        self.assertEqual(optimized.sub_blocks[-1].codestring.strip(),
+                         'e = 4096')
+        self.assertEqual(len(report.folded), 4)
+
+    def test_statements_without_outputs_are_kept(self):
+        block = Block('l.append(1)\nl = 2')
+        optimized, report = optimize(block, outputs=[])
+        self.assertEqual(len(optimized.sub_blocks), 1)
+        self.assertEqual(optimized.codestring.strip(), 'l.append(1)')
+
+    def test_names_bound_by_comprehensions(self):
+        block = Block('x = 1\nv = [x for x in r]\ny = x + 1')
+        optimized, report = optimize(block)
+        names = self.execute(optimized, r=[5])
+        self.assertEqual(names['y'], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
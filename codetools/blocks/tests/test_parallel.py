@@ -0,0 +1,185 @@
+"""Tests for wavefront parallel execution of Blocks."""
+
+import threading
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from codetools.blocks.block import (Block, CompositeException,
+                                    ExecutionCancelled)
+from codetools.blocks.parallel import (connected_components,
+                                       execute_components,
+                                       sub_block_dependencies)
+
+
+class SubBlockDependenciesTestCase(unittest.TestCase):
+
+    def dependencies(self, code):
+        b = Block(code)
+        return [sorted(deps) for deps in
+                sub_block_dependencies(b.sub_blocks, b._dep_graph)]
+
+    def test_read_after_write(self):
+        self.assertEqual(self.dependencies('a = x\nb = y\nc = a + b'),
+                         [[], [], [0, 1]])
+
+    def test_write_after_read(self):
+        self.assertEqual(self.dependencies('a = x\nx = 2\nb = x'),
+                         [[], [0], [1]])
+
+    def test_write_after_write(self):
+        self.assertEqual(self.dependencies('a = 1\nif t: a = 2\nb = 3'),
+                         [[], [0], []])
+
+    def test_item_assignment(self):
+        self.assertEqual(self.dependencies('y = x[0]\nx[0] = 1\nz = x[0]'),
+                         [[], [0], [1]])
+
+
+class ComponentsTestCase(unittest.TestCase):
+
+    def components(self, code):
+        b = Block(code)
+        return connected_components(b.sub_blocks, b._dep_graph)
+
+    def test_connected_components(self):
+        self.assertEqual(self.components('a = x\nb = y\nc = a\nd = b + y'),
+                         [[0, 2], [1, 3]])
+        # Writes to a name read elsewhere join the components
+        self.assertEqual(self.components('a = x\nx = 2\nb = 1'),
+                         [[0, 1], [2]])
+        self.assertEqual(self.components('a = 1\nb = a\nc = b'),
+                         [[0, 1, 2]])
+
+    def test_execute_components(self):
+        # Each component waits for the other to start
+        first, second = threading.Event(), threading.Event()
+        components = [Block('a = first.set() or second.wait(5)\nb = x'),
+                      Block('c = second.set() or first.wait(5)\nd = 1/0')]
+        names = dict(first=first, second=second, x=1)
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            self.assertRaises(ZeroDivisionError, execute_components,
+                              components, names, Block.execute, executor)
+        finally:
+            executor.shutdown()
+        self.assertEqual((names['a'], names['b'], names['c']),
+                         (True, 1, True))
+        self.assertNotIn('d', names)
+
+    def test_components_after_an_error_copy_nothing(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            names = {}
+            self.assertRaises(ZeroDivisionError, execute_components,
+                              [Block('a = 1\nb = 1/0'), Block('c = 2')],
+                              names, Block.execute, executor)
+            self.assertEqual(names, dict(a=1))
+
+            # The first error in the order of the components is raised
+            self.assertRaises(KeyError, execute_components,
+                              [Block('a = {}[0]'), Block('c = 1/0')],
+                              names, Block.execute, executor)
+        finally:
+            executor.shutdown()
+
+    def test_busy_executor(self):
+        # The components the executor doesn't get to run in this thread
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            blocker = threading.Event()
+            executor.submit(blocker.wait, 5)
+            names = {}
+            execute_components([Block('a = 1'), Block('b = 2')], names,
+                               Block.execute, executor)
+            blocker.set()
+        finally:
+            executor.shutdown()
+        self.assertEqual(names, dict(a=1, b=2))
+
+    def test_cancelled_components_copy_nothing(self):
+        def execute(block, namespace):
+            block.execute(namespace, cancelled=lambda: 'a' in namespace)
+        names = {}
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            self.assertRaises(ExecutionCancelled, execute_components,
+                              [Block('a = 1\nb = a'), Block('c = 2')], names,
+                              execute, executor)
+        finally:
+            executor.shutdown()
+        self.assertEqual(names, {})
+
+
+class ExecuteParallelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_same_result_as_execute(self):
+        code = ('a = x + 1\n'
+                'b = x * 2\n'
+                'c = a + b\n'
+                'x = 5\n'
+                'd = [0]\n'
+                'd[0] = c\n'
+                'e = d[0]\n'
+                'if c > 3: f = e\n'
+                'import math\n'
+                'g = math.sqrt(x)')
+        b = Block(code)
+        expected, names = dict(x=1), dict(x=1)
+        b.execute(expected)
+        b.execute_parallel(names, executor=self.executor)
+        self.assertEqual(names, expected)
+
+    def test_independent_sub_blocks_run_concurrently(self):
+        # Each sub-block waits for the other to start
+        first, second = threading.Event(), threading.Event()
+        b = Block('a = first.set() or second.wait(5) or second.is_set()\n'
+                  'b = second.set() or first.wait(5) or first.is_set()')
+        names = dict(first=first, second=second)
+        b.execute_parallel(names, executor=self.executor)
+        self.assertTrue(names['a'])
+        self.assertTrue(names['b'])
+
+    def test_default_executor(self):
+        b = Block('a = 1\nb = a + 1')
+        names = {}
+        b.execute_parallel(names)
+        self.assertEqual(names, dict(a=1, b=2))
+
+    def test_error_stops_like_execute(self):
+        b = Block('a = 1\nb = 1/0\nc = a\nd = 2')
+        names = {}
+        self.assertRaises(ZeroDivisionError, b.execute_parallel, names,
+                          executor=self.executor)
+        self.assertEqual(names, dict(a=1))
+
+    def test_continue_on_errors(self):
+        b = Block('a = 1\nb = 1/0\nc = a\nd = undefined\ne = 2')
+        names = {}
+        try:
+            b.execute_parallel(names, continue_on_errors=True,
+                               executor=self.executor)
+        except CompositeException as e:
+            self.assertEqual([type(x) for x in e.exceptions],
+                             [ZeroDivisionError, NameError])
+            self.assertIn('ZeroDivisionError', e.exceptions[0].traceback)
+        else:
+            self.fail('CompositeException not raised')
+        self.assertEqual(names, dict(a=1, c=1, e=2))
+
+    def test_single_error_with_continue_on_errors(self):
+        b = Block('a = 1/0\nb = 2')
+        names = {}
+        self.assertRaises(ZeroDivisionError, b.execute_parallel, names,
+                          continue_on_errors=True, executor=self.executor)
+        self.assertEqual(names, dict(b=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Tests for Block execution in worker processes."""
+
+from cPickle import PicklingError
+import os
+import shutil
+import tempfile
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+
+from codetools.blocks.block import Block, CompositeException
+from codetools.blocks.processes import ProcessExecution, SharedArray
+
+
+class SharedArrayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        for array in (numpy.arange(12.).reshape(3, 4),
+                      numpy.asfortranarray(numpy.arange(12).reshape(3, 4)),
+                      numpy.zeros((0, 3))):
+            shared = SharedArray.create(array, self.directory)
+            attached = shared.attach()
+            self.assertEqual(type(attached), numpy.ndarray)
+            self.assertEqual(attached.dtype, array.dtype)
+            numpy.testing.assert_array_equal(attached, array)
+
+    def test_copy_on_write(self):
+        shared = SharedArray.create(numpy.arange(10), self.directory)
+        shared.attach()[0] = 5
+        self.assertEqual(shared.attach()[0], 0)
+
+
+class ExecuteProcessesTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = ProcessPoolExecutor(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def test_same_result_as_execute(self):
+        code = ('import math\n'
+                'a = x + 1\n'
+                'b = big * 2\n'
+                'c = b.sum() + a\n'
+                'big[0] = 7\n'
+                'd = math.sqrt(c)\n'
+                'e = big[0]')
+        b = Block(code)
+        expected = dict(x=1, big=numpy.arange(100000.))
+        names = dict(x=1, big=numpy.arange(100000.))
+        b.execute(expected)
+        b.execute_processes(names, executor=self.executor)
+        self.assertEqual(sorted(names), sorted(expected))
+        for name in expected:
+            numpy.testing.assert_array_equal(names[name], expected[name])
+
+    def test_only_writes_are_merged(self):
+        b = Block('a = x\ny = 2')
+        names = dict(x=1)
+        b.execute_processes(names, executor=self.executor)
+        self.assertEqual(names, dict(x=1, a=1, y=2))
+
+    def test_shared_arrays_are_reused_and_removed(self):
+        directory = tempfile.mkdtemp()
+        try:
+            b = Block('a = x + 1\nb = a * 2\nc = x - 1')
+            x = numpy.ones(10000)
+            names = dict(x=x)
+            execution = ProcessExecution(b.sub_blocks, b._dep_graph, names,
+                                         {}, threshold=1000,
+                                         directory=directory)
+            self.assertIs(execution._encode(x), execution._encode(x))
+            small = numpy.ones(10)
+            self.assertIs(execution._encode(small), small)
+            execution.run(self.executor)
+            self.assertEqual(os.listdir(directory), [])
+            numpy.testing.assert_array_equal(names['b'], 4 * x)
+            numpy.testing.assert_array_equal(names['c'], 0 * x)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_error_stops_like_execute(self):
+        b = Block('a = 1\nb = 1/0\nc = a\nd = 2')
+        names = {}
+        self.assertRaises(ZeroDivisionError, b.execute_processes, names,
+                          executor=self.executor)
+        self.assertEqual(names, dict(a=1))
+
+    def test_continue_on_errors(self):
+        b = Block('a = 1\nb = 1/0\nc = a\nd = undefined\ne = 2')
+        names = {}
+        try:
+            b.execute_processes(names, continue_on_errors=True,
+                                executor=self.executor)
+        except CompositeException as e:
+            self.assertEqual([type(x) for x in e.exceptions],
+                             [ZeroDivisionError, NameError])
+            self.assertIn('ZeroDivisionError', e.exceptions[0].traceback)
+        else:
+            self.fail('CompositeException not raised')
+        self.assertEqual(names, dict(a=1, c=1, e=2))
+
+    def test_unpicklable_output(self):
+        b = Block('def f():\n    pass\ng = 1')
+        names = {}
+        self.assertRaises(PicklingError, b.execute_processes, names,
+                          executor=self.executor)
+        self.assertEqual(names, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""Tests for rebuilding blocks after their source is edited."""
+
+import sys
+import traceback
+import unittest
+
+from codetools.blocks.block import Block
+from codetools.blocks.compiler_unparse import unparse
+from codetools.blocks.reparse import affected_sub_blocks
+
+CODE = """import math
+# Depths
+x = 1
+y = x * 2
+
+def scale(a):
+    return a * k
+
+@staticmethod
+def unused(b):
+    return b
+z = scale(y); w = 3
+q = w + c
+"""
+
+
+def sources(sub_blocks):
+    return [unparse(b.ast).strip() for b in sub_blocks]
+
+
+class ReparseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.block = Block(CODE)
+        self.old = list(self.block.sub_blocks)
+        for sub_block in self.old:
+            sub_block._code
+
+    def test_unchanged(self):
+        new, changed, removed = self.block.reparse(CODE)
+        self.assertEqual(new.sub_blocks, self.old)
+        self.assertEqual(changed, [])
+        self.assertEqual(removed, set())
+        self.assertEqual(new.codestring, CODE)
+
+    def test_insert(self):
+        code = CODE.replace('x = 1\n', 'x = 1\nextra = 5\nx = 2\n')
+        new, changed, removed = self.block.reparse(code)
+        self.assertEqual(sources(changed), ['extra = 5', 'x = 2'])
+        self.assertEqual(removed, set())
+        self.assertEqual(new.sub_blocks[:2] + new.sub_blocks[4:], self.old)
+        self.assertEqual(new.codestring, code)
+
+        # The statements below moved two lines down, compiled code included
+        fresh = Block(code)
+        self.assertEqual([b.ast.lineno for b in new.sub_blocks],
+                         [b.ast.lineno for b in fresh.sub_blocks])
+        self.assertEqual([b._code.co_firstlineno for b in new.sub_blocks],
+                         [b._code.co_firstlineno for b in fresh.sub_blocks])
+        self.assertEqual(new.sub_blocks[5]._code, self.old[3]._compiled)
+
+        context = {'c': 1}
+        new.execute(context, {'k': 10})
+        self.assertEqual((context['x'], context['z'], context['q']),
+                         (2, 40, 4))
+
+    def test_traceback_lines(self):
+        code = CODE.replace('# Depths\n', '# Depths\n#\n#\n').replace(
+            'return a * k', 'return a * kk')
+        new, changed, removed = self.block.reparse(code)
+        self.assertEqual(sources(changed),
+                         ['def scale(a): \n    return a*kk'])
+        try:
+            new.execute({'c': 1})
+        except NameError:
+            lines = [line for _, line, _, _ in
+                     traceback.extract_tb(sys.exc_info()[2])]
+        self.assertEqual(lines[-2:], [14, 9])
+
+    def test_delete(self):
+        code = CODE.replace('q = w + c\n', '')
+        new, changed, removed = self.block.reparse(code)
+        self.assertEqual(new.sub_blocks, self.old[:-1])
+        self.assertEqual(changed, [])
+        self.assertEqual(removed, set(['q']))
+
+    def test_decorated_and_semicolons(self):
+        code = CODE.replace('w = 3', 'w = 4')
+        new, changed, removed = self.block.reparse(code)
+        self.assertEqual(sources(changed), ['z = scale(y)', 'w = 4'])
+        self.assertEqual(new.sub_blocks[:5], self.old[:5])
+
+        code = code.replace('@staticmethod', '@classmethod')
+        new, changed, removed = new.reparse(code)
+        self.assertEqual(len(changed), 1)
+        self.assertTrue(sources(changed)[0].startswith('@classmethod'))
+
+    def test_fall_back(self):
+        # An edit that joins lines with unchanged statements
+        code = CODE.replace('x = 1', 'x = (1 +')
+        self.assertRaises(SyntaxError, self.block.reparse, code)
+        self.assertEqual([b.ast.lineno for b in self.block.sub_blocks],
+                         [b.ast.lineno for b in self.old])
+
+        code = CODE.replace('x = 1', 'x = (1 +\n     2)')
+        new, changed, removed = self.block.reparse(code)
+        self.assertEqual(new.sub_blocks[0], self.old[0])
+
+        code = CODE.replace('x = 1', 'x = """').replace(
+            '\n\ndef scale', '\n\n"""\ndef scale')
+        new, changed, removed = Block(CODE).reparse(code)
+        self.assertEqual(changed, new.sub_blocks)
+        self.assertEqual(removed, Block(CODE).outputs)
+
+        # A new encoding declaration
+        code = '# -*- coding: latin-1 -*-\n' + CODE
+        new, changed, removed = Block(CODE).reparse(code)
+        self.assertEqual(changed, new.sub_blocks)
+
+    def test_settings(self):
+        block = Block(CODE, decompose_compound_statements=True,
+                      incremental=True)
+        block.sub_blocks[0].filename = 'script.py'
+        code = CODE + 'if m:\n    r = 1\n    s = 2\n'
+        new, changed, removed = block.reparse(code)
+        self.assertTrue(new.decompose_compound_statements)
+        self.assertTrue(new.incremental)
+        self.assertEqual(len(changed), 2)
+        self.assertEqual(changed[0].filename, 'script.py')
+
+    def test_affected_sub_blocks(self):
+        code = CODE.replace('x = 1', 'x = 2')
+        new, changed, removed = self.block.reparse(code)
+        self.assertEqual(sources(affected_sub_blocks(new, changed,
+                                                     removed=removed)),
+                         ['import math', 'x = 2', 'y = x*2',
+                          'z = scale(y)'])
+        self.assertEqual(sources(affected_sub_blocks(new, names=['c'])),
+                         ['import math', 'q = w+c'])
+
+        # The statements left that bind a name a removed one rebound
+        block = Block('f = x + 5\nf = x + 100\ng = f\n')
+        new, changed, removed = block.reparse('f = x + 5\ng = f\n')
+        self.assertEqual((changed, removed), ([], set(['f'])))
+        self.assertEqual(sources(affected_sub_blocks(new, changed,
+                                                     removed=removed)),
+                         ['f = x+5', 'g = f'])
+
+    def test_single_statement(self):
+        block = Block('a = x + 1\n')
+        new, changed, removed = block.reparse('a = x + 2\n')
+        self.assertEqual(sources(changed), ['a = x+2'])
+        self.assertEqual(len(new.sub_blocks), 1)
+        self.assertIs(changed[0], new.sub_blocks[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
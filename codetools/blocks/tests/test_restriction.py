@@ -0,0 +1,118 @@
+"""Tests for bitset restriction of Blocks."""
+
+import unittest
+
+from codetools.blocks.block import Block
+from codetools.blocks.restriction import RestrictionGraph, iter_bits, sweep
+
+
+class SweepTestCase(unittest.TestCase):
+
+    def test_iter_bits(self):
+        self.assertEqual(list(iter_bits(0)), [])
+        self.assertEqual(list(iter_bits(1 << 100 | 5)), [0, 2, 100])
+
+    def test_sweep(self):
+        # 0 -> 1 -> 2, 3 -> 2
+        adjacency = [0b10, 0b100, 0, 0b100]
+        self.assertEqual(sweep(0b1, adjacency), 0b111)
+        self.assertEqual(sweep(0b1000, adjacency), 0b1100)
+        self.assertEqual(sweep(0b1, adjacency, mask=0b101), 0b1)
+
+
+class RestrictionGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.block = Block('x = expensive()\n'
+                           'x = 2\n'
+                           'y = f(x, a)\n'
+                           'z = g(x, a)\n'
+                           'w = h(a)')
+        self.graph = RestrictionGraph(self.block.sub_blocks,
+                                      self.block._dep_graph)
+
+    def lines(self, blocks):
+        return [self.block.sub_blocks.index(b) for b in blocks]
+
+    def test_outputs(self):
+        self.assertEqual(self.lines(self.graph.restrict(outputs=['z'])),
+                         [1, 3])
+
+    def test_inputs(self):
+        self.assertEqual(self.lines(self.graph.restrict(inputs=['a'])),
+                         [2, 3, 4])
+
+    def test_inputs_and_outputs(self):
+        self.assertEqual(
+            self.lines(self.graph.restrict(inputs=['a'], outputs=['z'])), [3])
+
+    def test_intermediates(self):
+        self.assertEqual(
+            self.lines(self.graph.restrict(intermediates=['x'])), [2, 3])
+
+    def test_pure_output_intermediate(self):
+        self.assertEqual(self.graph.restrict(intermediates=['w']), [])
+
+    def test_graph_is_not_modified(self):
+        self.graph.restrict(intermediates=['x'])
+        self.assertEqual(self.lines(self.graph.restrict(outputs=['z'])),
+                         [1, 3])
+
+    def test_restrict_many(self):
+        outputs_list = [['z'], ['y', 'w'], [], ['x']]
+        for inputs, intermediates in [([], []), (['a'], []), ([], ['x'])]:
+            many = self.graph.restrict_many(inputs, outputs_list,
+                                            intermediates)
+            self.assertEqual(many,
+                             [self.graph.restrict(inputs, outputs,
+                                                  intermediates)
+                              for outputs in outputs_list])
+
+
+class RestrictionCacheTestCase(unittest.TestCase):
+
+    def test_statistics(self):
+        b = Block('a = x\nb = a\nc = y')
+        r = b.restrict(inputs=('x',))
+        self.assertIs(b.restrict(inputs=('x',)), r)
+        b.restrict(inputs=('y',))
+        self.assertEqual(b.restriction_cache_hits, 1)
+        self.assertEqual(b.restriction_cache_misses, 2)
+        self.assertEqual(b.restriction_cache_evictions, 0)
+
+    def test_size_bound(self):
+        b = Block('a = x\nb = a\nc = y', restriction_cache_size=1)
+        b.restrict(inputs=('x',))
+        b.restrict(inputs=('y',))
+        self.assertEqual(b.restriction_cache_evictions, 1)
+        b.restrict(inputs=('y',))
+        self.assertEqual(b.restriction_cache_hits, 1)
+
+    def test_restrict_many(self):
+        b = Block('import math\na = x\nb = a\nc = y\nd = b + c')
+        r = b.restrict(inputs=('x',), outputs=('b',))
+        many = b.restrict_many(('x',), [('b',), ('d',), ('b', 'd'), ('d',)])
+        self.assertIs(many[0], r)
+        self.assertIs(many[1], many[3])
+        self.assertEqual([str(sb.ast) for sb in many[2].sub_blocks],
+                         [str(sb.ast) for sb in
+                          Block('import math\na = x\nb = a\nd = b + c')
+                          .sub_blocks])
+
+        # The new restrictions are cached
+        self.assertIs(b.restrict(inputs=('x',), outputs=('d',)), many[1])
+        self.assertIs(b.restrict(inputs=('x',), outputs=('b', 'd')), many[2])
+        self.assertEqual(b.restriction_cache_misses, 4)
+
+        self.assertRaises(ValueError, b.restrict_many, (), [('d',), ()])
+
+    def test_statement_bound(self):
+        b = Block('a = x\nb = a\nc = y')
+        b.restrict(inputs=('x',))
+        b.restrict(inputs=('y',))
+        b.restriction_cache_max_statements = 1
+        self.assertEqual(b.restriction_cache_evictions, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
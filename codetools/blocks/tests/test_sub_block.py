@@ -0,0 +1,122 @@
+"""Tests for the compact sub-blocks of blocks."""
+
+from compiler.ast import Stmt
+import cPickle
+import sys
+import traceback
+import unittest
+
+from codetools.blocks.block import Block, ExecutionCancelled
+from codetools.blocks.compiler_.api import parse
+from codetools.blocks.sub_block import SubBlock
+
+CODE = """from math import sqrt
+import os
+a = x + 1
+if t:
+    b = a.real
+c = 2
+d = os.sep + y.z
+"""
+
+
+class SubBlockTestCase(unittest.TestCase):
+
+    def test_same_analysis_as_block(self):
+        for node in parse(CODE).node.nodes:
+            sub_block, block = SubBlock(node), Block(node)
+            self.assertEqual(sub_block.inputs, block.inputs)
+            self.assertEqual(sub_block.outputs, block.outputs)
+            self.assertEqual(sub_block.conditional_outputs,
+                             block.conditional_outputs)
+            self.assertEqual(sub_block.all_outputs, block.all_outputs)
+            self.assertEqual(sub_block.const_assign, block.const_assign)
+            self.assertEqual(sub_block.fromimports, block.fromimports)
+            self.assertEqual(sub_block.codestring, block.codestring)
+
+    def test_parsed_blocks_use_sub_blocks(self):
+        block = Block(CODE)
+        self.assertTrue(all(isinstance(b, SubBlock)
+                            for b in block.sub_blocks))
+        self.assertTrue(block.sub_blocks[0] in block.sub_blocks)
+        self.assertFalse(block.sub_blocks[0] == block.sub_blocks[1])
+
+        # Sub-blocks only get a uuid when asked for one
+        self.assertTrue(all(b._uuid is None for b in block.sub_blocks))
+        uuid = block.sub_blocks[2].uuid
+        self.assertEqual(block.sub_blocks[2].uuid, uuid)
+
+        names = dict(x=1, t=True)
+        block.restrict(inputs=['x']).execute(names)
+        self.assertEqual(sorted(names), ['a', 'b', 'os', 'sqrt', 't', 'x'])
+
+    def test_mixed_with_blocks(self):
+        block = Block('a = x\nb = a + 1')
+        block.sub_blocks.append(Block('c = b * 2'))
+        self.assertEqual(block.outputs, set(['a', 'b', 'c']))
+        merged = Block([block.sub_blocks[0], Block('d = 3')])
+        self.assertIs(merged.sub_blocks[0], block.sub_blocks[0])
+        names = dict(x=1)
+        block.execute(names)
+        self.assertEqual(names['c'], 4)
+
+    def test_ast_changes(self):
+        sub_block = Block('a = x\nb = a').sub_blocks[0]
+        self.assertEqual(sub_block.inputs, set(['x']))
+        sub_block.ast = parse('a = y').node.nodes[0]
+        self.assertEqual(sub_block.inputs, set(['y']))
+        names = dict(y=3)
+        sub_block.execute(names)
+        self.assertEqual(names['a'], 3)
+        self.assertFalse(sub_block.is_empty())
+        self.assertTrue(SubBlock(Stmt([])).is_empty())
+
+    def test_block_api(self):
+        sub_block = Block('a = x\nb = b + a').sub_blocks[1]
+        self.assertEqual(repr(sub_block), 'SubBlock(uuid=%s)' % sub_block.uuid)
+        self.assertIs(sub_block.validate_for_restriction(), sub_block)
+        self.assertIs(SubBlock(parse('c = a').node.nodes[0])
+                      .validate_for_restriction(), None)
+
+        names = dict(a=1, b=2)
+        self.assertRaises(ExecutionCancelled, sub_block.execute, names,
+                          cancelled=lambda: True)
+        sub_block.execute(names, cancelled=lambda: False)
+        self.assertEqual(names['b'], 3)
+
+        # The rest of the Block API takes a Block
+        self.assertFalse(hasattr(sub_block, 'restrict'))
+        first = Block('a = x\nb = a + 1').sub_blocks[0]
+        self.assertEqual(Block([first]).restrict(outputs=['a']).inputs,
+                         set(['x']))
+
+    def test_tracebacks(self):
+        block = Block('a = 1\nb = a / 0')
+        try:
+            block.execute({})
+        except ZeroDivisionError:
+            filename, line, _, _ = traceback.extract_tb(
+                sys.exc_info()[2])[-1]
+        self.assertEqual(filename, '<%r>' % block.sub_blocks[1])
+        self.assertEqual(line, 2)
+
+        sub_block = block.sub_blocks[1]
+        sub_block.filename = 'script.py'
+        try:
+            sub_block.execute({'a': 1})
+        except ZeroDivisionError:
+            filename, line, _, _ = traceback.extract_tb(
+                sys.exc_info()[2])[-1]
+        self.assertEqual((filename, line), ('script.py', 2))
+
+    def test_pickle(self):
+        block = Block(CODE)
+        uuid = block.sub_blocks[1].uuid
+        copy = cPickle.loads(cPickle.dumps(block, 2))
+        self.assertEqual(copy.sub_blocks[1].uuid, uuid)
+        self.assertEqual(copy.sub_blocks[2].inputs, set(['x']))
+        self.assertEqual(copy.codestring, block.codestring)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Tests for parameter sweeps over Blocks."""
+
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+
+from codetools.blocks.block import Block
+from codetools.blocks.sweep import Sweep, SweepResults
+
+CODE = """import math
+k = scale * 2
+calls.append(k)
+y = math.sin(x) * k
+z = y + offset
+w = k + 1
+"""
+
+
+class SweepResultsTestCase(unittest.TestCase):
+
+    def test_numbers(self):
+        results = SweepResults(['a'], 3)
+        for i, value in enumerate([1, 2, 3.5]):
+            results.store('a', i, value)
+        self.assertEqual(results.arrays['a'].dtype, numpy.float64)
+        numpy.testing.assert_array_equal(results.arrays['a'], [1, 2, 3.5])
+
+    def test_arrays(self):
+        results = SweepResults(['a'], 2)
+        results.store('a', 0, numpy.zeros(3))
+        results.store('a', 1, numpy.ones(3))
+        self.assertEqual(results.arrays['a'].shape, (2, 3))
+
+    def test_objects(self):
+        results = SweepResults(['a'], 3)
+        results.store('a', 0, numpy.zeros(3))
+        results.store('a', 1, numpy.ones(2))
+        results.store('a', 2, 'text')
+        a = results.arrays['a']
+        self.assertEqual(a.dtype, object)
+        numpy.testing.assert_array_equal(a[0], numpy.zeros(3))
+        numpy.testing.assert_array_equal(a[1], numpy.ones(2))
+        self.assertEqual(a[2], 'text')
+
+
+class ExecuteSweepTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.block = Block(CODE)
+        self.calls = []
+        self.context = dict(scale=1.5, offset=1, calls=self.calls)
+
+    def expected(self, name, **values):
+        names = dict(self.context, calls=[], **values)
+        self.block.execute(names)
+        return names[name]
+
+    def test_same_results_as_execute(self):
+        xs = numpy.linspace(0, 3, 7)
+        results = self.block.execute_sweep(self.context, dict(x=xs))
+        self.assertEqual(sorted(results), ['y', 'z'])
+        numpy.testing.assert_array_almost_equal(
+            results['z'], [self.expected('z', x=x) for x in xs])
+
+    def test_upstream_runs_once(self):
+        self.block.execute_sweep(self.context, dict(x=range(10)))
+        self.assertEqual(self.calls, [3.0])
+
+        sweep = Sweep(self.block, self.context, dict(x=[1]))
+        self.assertEqual(sorted(sweep.params), ['k', 'offset', 'x'])
+        self.assertEqual(sorted(sweep.block.outputs), ['y', 'z'])
+
+    def test_several_varying_names(self):
+        xs, offsets = [0, 1, 2], [10, 20, 30]
+        results = self.block.execute_sweep(
+            self.context, dict(x=xs, offset=offsets), outputs=['z', 'w'])
+        numpy.testing.assert_array_almost_equal(
+            results['z'], [self.expected('z', x=x, offset=o)
+                           for x, o in zip(xs, offsets)])
+        # Outputs computed upstream are the same at every point
+        numpy.testing.assert_array_equal(results['w'], [4, 4, 4])
+
+    def test_varying_intermediate(self):
+        results = self.block.execute_sweep(self.context,
+                                           dict(k=[1, 2], x=[0.5, 0.5]))
+        numpy.testing.assert_array_almost_equal(
+            results['y'], [numpy.sin(0.5), 2 * numpy.sin(0.5)])
+
+    def test_invalid_sweeps(self):
+        self.assertRaises(ValueError, self.block.execute_sweep, self.context,
+                          {})
+        self.assertRaises(ValueError, self.block.execute_sweep, self.context,
+                          dict(x=[1, 2], offset=[1]))
+
+    def test_process_pool(self):
+        block = Block('import math\nk = scale * 2\ny = math.sin(x) * k')
+        xs = numpy.linspace(0, 3, 11)
+        executor = ProcessPoolExecutor(max_workers=2)
+        try:
+            results = block.execute_sweep(dict(scale=2), dict(x=xs),
+                                          executor=executor, chunk_size=3)
+        finally:
+            executor.shutdown()
+        numpy.testing.assert_array_almost_equal(results['y'],
+                                                numpy.sin(xs) * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
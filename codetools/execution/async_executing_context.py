@@ -7,31 +7,115 @@
 #
 from __future__ import absolute_import
 
+from collections import Mapping
 import contextlib
 import threading
+import time
+import weakref
 
 from concurrent.futures import Executor, Future
 from concurrent.futures import ThreadPoolExecutor
 
 from traits.api import (Instance, Dict, Event, Code, Any, on_trait_change,
-        Bool, Undefined, Supports, OBJECT_IDENTITY_COMPARE)
+        Bool, Undefined, Supports, OBJECT_IDENTITY_COMPARE, Either, Float, Int)
 
+from codetools.blocks.block import ExecutionCancelled
 from codetools.contexts.data_context import DataContext
 from .executing_context import ExecutingContext
 from .interfaces import IListenableContext
 from .restricting_code_executable import RestrictingCodeExecutable
 
 
+class ContextSnapshot(Mapping):
+    """A read-only view of a context with pending changes laid over it.
+
+    The view doesn't copy the context: it reads through to it until the
+    owner is about to modify it, and then detaches the view onto a copy,
+    which all the views detached at the same time share (copy on write).
+
+    """
+
+    def __init__(self, context, delta):
+        # The context, or a copy of it once detached
+        self._context = context
+
+        # The pending changes, which the view owns
+        self._delta = delta
+
+    def __getitem__(self, name):
+        if name in self._delta:
+            return self._delta[name]
+        return self._context[name]
+
+    def __contains__(self, name):
+        return name in self._delta or name in self._context
+
+    def __iter__(self):
+        for name in self._context.keys():
+            if name not in self._delta:
+                yield name
+        for name in self._delta:
+            yield name
+
+    def __len__(self):
+        return len(self._context) + sum(1 for name in self._delta
+                                        if name not in self._context)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self))
+
+    def _detach(self, copy):
+        self._context = copy
+
+
 class AsyncExecutingContext(ExecutingContext):
     """Sequential, threaded pipeline for execution of a Block.
 
     This uses a (possibly shared) Executor to asynchronously execute a block
-    within a context. This will only consume a single worker at a time from the
-    Executor. Changes to the context are made with the '__setitem__' method
-    (dictionary update) and may trigger an execution of the block, with inputs
-    restricted to the current, cumulative set of context changes.  Updates made
-    while the block is being executed will result in an accumulation of the
-    changes and execution of the block once the current execution completes.
+    within a context. This will only consume a single worker at a time from
+    the Executor, unless 'concurrent_components' is set. Changes to the
+    context are made with the '__setitem__' method (dictionary update) and may
+    trigger an execution of the block, with inputs restricted to the current,
+    cumulative set of context changes.  Updates made while the block is being
+    executed will result in an accumulation of the changes and execution of
+    the block once the current execution completes.
+
+    The 'context' of the events fired by '__setitem__' is a 'ContextSnapshot'
+    of the subcontext with the changes not executed yet, which doesn't copy
+    the subcontext until the next execution starts, and only if the snapshot
+    is still referenced then. A snapshot taken while the block executes
+    copies the subcontext at once, as the execution is writing to it, and
+    so shows the values the execution had written by then.
+
+    By default an execution starts as soon as one is pending and none is
+    running. Setting 'quiet_period' waits until no update has come for that
+    long, so that a burst of assignments (e.g. a slider drag) collapses into
+    one execution, and 'max_latency' bounds how long a pending update can
+    wait for quiet. 'min_interval' limits the rate of executions. The
+    counters 'update_count', 'coalesced_update_count' and 'execution_count'
+    tell how well updates are coalesced.
+
+    With 'cancel_superseded', an update made while the block executes
+    cancels the execution, whose result it makes obsolete: the execution
+    stops before its next statement, the names it bound are restored, and
+    the block executes again for the changes of both. The cancelled
+    execution fires no 'items_modified' event. This requires an
+    executable whose 'execute' (and 'execute_code_changes') take a
+    'cancelled' callable, like 'RestrictingCodeExecutable'.
+
+    With 'concurrent_components', the parts of the block to execute that
+    share no name one of them writes run concurrently on the executor, in
+    other workers as they are free, and their results are committed together
+    in one 'items_modified' event, as for a sequential execution. If a part
+    raises, the results of the parts after it are dropped, but the parts
+    before it may have run statements that come after the failing one (see
+    'codetools.blocks.parallel.execute_components'). This pays off for
+    independent, slow parts that release the GIL (I/O, numpy, ...), and
+    requires an executable whose 'execute' (and 'execute_code_changes') take
+    an 'executor', like 'RestrictingCodeExecutable'.
+
+    Many contexts sharing one executor can share it fairly through the
+    executors of a 'fair_share_scheduler.FairShareScheduler'.
 
     """
 
@@ -52,6 +136,34 @@ class AsyncExecutingContext(ExecutingContext):
     # An Executor with which to dispatch work.
     executor = Instance(Executor)
 
+    # Seconds without updates to wait for before executing (debouncing)
+    quiet_period = Float(0.0)
+
+    # The most seconds a pending update waits for 'quiet_period', or None
+    max_latency = Either(None, Float)
+
+    # The fewest seconds between the starts of two executions (rate limit)
+    min_interval = Float(0.0)
+
+    # The number of updates requested
+    update_count = Int(0)
+
+    # The number of updates merged into an update already pending, rather
+    # than causing an execution of their own
+    coalesced_update_count = Int(0)
+
+    # The number of executions started
+    execution_count = Int(0)
+
+    # Whether updates cancel the execution running, to start over sooner
+    cancel_superseded = Bool(False)
+
+    # The number of executions cancelled
+    cancelled_execution_count = Int(0)
+
+    # Whether the independent parts of the block execute concurrently
+    concurrent_components = Bool(False)
+
     # The cumulative changes in the context since the last successful execution
     _context_delta = Dict
 
@@ -61,8 +173,18 @@ class AsyncExecutingContext(ExecutingContext):
     # A lock for shared data
     _data_lock = Instance(threading.Lock, ())
 
+    # The snapshots of the subcontext that still read through to it, by id
+    _snapshots = Instance(weakref.WeakValueDictionary, ())
+
+    # Whether the worker is writing to the subcontext (under '_data_lock')
+    _executing = Bool(False)
+
     _full_update = Bool(False)
 
+    # Whether the code changed since the last execution (the executable only
+    # executes the statements affected, if it supports it)
+    _code_update = Bool(False)
+
     ###########################################################################
     #### AsyncExecutingContext Interface
     ###########################################################################
@@ -121,21 +243,64 @@ class AsyncExecutingContext(ExecutingContext):
 
         with self._data_lock:
             self._context_delta[name] = value
-            context_copy = dict(self.subcontext)
-            if name in context_copy:
+            if name in self.subcontext:
                 added = []
                 modified = [name]
             else:
                 modified = []
                 added = [name]
-            context_copy.update(self._context_delta)
-        self._fire_event(added=added, modified=modified, context=context_copy)
+            if self._executing:
+                snapshot = ContextSnapshot(self._copy_subcontext(),
+                                           dict(self._context_delta))
+            else:
+                snapshot = ContextSnapshot(self.subcontext,
+                                           dict(self._context_delta))
+                self._snapshots[id(snapshot)] = snapshot
+        self._fire_event(added=added, modified=modified, context=snapshot)
 
         self._update()
 
     def __delitem__(self, name):
+        with self._data_lock:
+            self._detach_snapshots()
         del self.subcontext[name]
 
+    ###########################################################################
+    #### Protected interface
+    ###########################################################################
+
+    def _detach_snapshots(self):
+        """Detach the live snapshots before the subcontext changes.
+
+        Must be called with '_data_lock' held.
+
+        """
+        snapshots = self._snapshots.values()
+        if snapshots:
+            copy = self._copy_subcontext()
+            for snapshot in snapshots:
+                snapshot._detach(copy)
+            self._snapshots.clear()
+
+    def _discard_deferred_events(self):
+        """Drop the events the subcontext deferred."""
+        deferred = getattr(self.subcontext, '_deferred_events', None)
+        if deferred is not None:
+            deferred.clear()
+
+    def _copy_subcontext(self):
+        """A dict copy of the subcontext, which the worker may be changing.
+
+        """
+        copy = {}
+        for name in self.subcontext.keys():
+            try:
+                copy[name] = self.subcontext[name]
+            except KeyError:
+                # (Deleted since)
+                pass
+        return copy
+
     ###########################################################################
     #### Concurrency methods and state machine.
     ###########################################################################
@@ -153,6 +318,18 @@ class AsyncExecutingContext(ExecutingContext):
     # The current Future instance, or None.
     _future = Instance(Future)
 
+    # When the pending update was first and last requested, and when the
+    # last execution started (from 'time.time'), or None
+    _first_pending_time = Any
+    _last_pending_time = Any
+    _last_submit_time = Any
+
+    # The 'threading.Timer' that submits the pending update when it's due
+    _timer = Any
+
+    # The 'threading.Event' that cancels the current execution
+    _cancel_event = Any
+
     @contextlib.contextmanager
     def _update_state(self):
         """Helper for state updates.
@@ -169,19 +346,68 @@ class AsyncExecutingContext(ExecutingContext):
                 not self._execution_deferred
             )
             if submit_new:
+                now = time.time()
+                delay = self._submission_delay(now)
+                if delay > 0:
+                    submit_new = False
+                    self._start_timer(delay)
+            if submit_new:
+                self._cancel_timer()
                 self._update_pending = False
-                self._future = self.executor.submit(self._worker)
+                self._first_pending_time = self._last_pending_time = None
+                self._last_submit_time = now
+                self.execution_count += 1
+                self._cancel_event = threading.Event()
+                self._future = self.executor.submit(self._worker,
+                                                   self._cancel_event)
             self._state_lock.notify_all()
 
         if submit_new:
             self._future.add_done_callback(self._callback)
 
+    def _submission_delay(self, now):
+        """The seconds to wait before submitting the pending update."""
+        delay = 0.0
+        if self.quiet_period > 0:
+            delay = self._last_pending_time + self.quiet_period - now
+            if self.max_latency is not None:
+                delay = min(delay,
+                            self._first_pending_time + self.max_latency - now)
+        if self.min_interval > 0 and self._last_submit_time is not None:
+            delay = max(delay,
+                        self._last_submit_time + self.min_interval - now)
+        return delay
+
+    def _start_timer(self, delay):
+        self._cancel_timer()
+        self._timer = threading.Timer(delay, self._timer_fired)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _timer_fired(self):
+        with self._update_state():
+            pass
+
     # Transition methods.
 
     def _update(self):
         """Update based on changes in _context_delta."""
         with self._update_state():
+            now = time.time()
+            self.update_count += 1
+            if self._update_pending:
+                self.coalesced_update_count += 1
+            else:
+                self._first_pending_time = now
+            self._last_pending_time = now
             self._update_pending = True
+            if self._future is not None and self.cancel_superseded:
+                self._cancel_event.set()
 
     def _callback(self, future):
         """Callback for the _worker"""
@@ -204,41 +430,83 @@ class AsyncExecutingContext(ExecutingContext):
     def _wait(self):
         """Wait until all previous assignments are finished, possibly longer."""
         with self._state_lock:
-            while self._future is not None:
+            while self._future is not None or (
+                    self._update_pending and not self._execution_deferred):
                 self._state_lock.wait()
 
-    def _worker(self):
+    def _worker(self, cancel_event=None):
         """Worker for the _update method. """
 
         # Get the current context, apply then delete the delta
         with self._data_lock:
             updated_vars = set(self._context_delta.keys())
+            work = bool(updated_vars or self._full_update or
+                        self._code_update)
+            if work:
+                self._detach_snapshots()
+                self._executing = True
             self._suppress_events = True
             self.subcontext.update(self._context_delta)
             self._suppress_events = False
             context_delta = self._context_delta.copy()
             self._context_delta.clear()
 
-        if not updated_vars and not self._full_update:
-            # don't execute if no context delta or full update requested
+        if not work:
+            # don't execute if no context delta, code change or full update
+            # requested
             return
 
+        try:
+            self._execute_update(updated_vars, context_delta, cancel_event)
+        finally:
+            with self._data_lock:
+                self._executing = False
+
+    def _execute_update(self, updated_vars, context_delta, cancel_event):
+        """Execute the block for the update the worker took on. """
+        code_update = self._code_update
+        full_update = self._full_update
+        self._code_update = False
         if self._full_update:
             # signal to self.executable that we want the unrestricted block to
             # be executed and then clear the flag
             updated_vars = []
+            code_update = False
             self._full_update = False
 
+        kw = {}
+        if self.cancel_superseded and cancel_event is not None:
+            kw['cancelled'] = cancel_event.is_set
+        if self.concurrent_components:
+            kw['executor'] = self.executor
+
         try:
             self.subcontext.defer_events = True
-            self.executable.execute(self.subcontext, inputs=updated_vars)
+            if code_update:
+                self.executable.execute_code_changes(self.subcontext,
+                                                     inputs=updated_vars, **kw)
+            else:
+                self.executable.execute(self.subcontext, inputs=updated_vars,
+                                        **kw)
             self.subcontext.defer_events = False
-        except Exception:
+        except Exception as e:
+            if isinstance(e, ExecutionCancelled):
+                # The execution restored the names it bound: don't report
+                # its writes as changes
+                self._discard_deferred_events()
             self.subcontext.defer_events = False
             # If we failed to execute, put changes back into _context_delta
             with self._data_lock:
                 context_delta.update(self._context_delta)
                 self._context_delta = context_delta
+            if code_update:
+                self._code_update = True
+            if isinstance(e, ExecutionCancelled):
+                # The update that cancelled us starts over for both
+                self._full_update = self._full_update or full_update
+                with self._state_lock:
+                    self.cancelled_execution_count += 1
+                return
             raise
 
     ###########################################################################
@@ -261,7 +529,12 @@ class AsyncExecutingContext(ExecutingContext):
         except Exception as e:
             self.exception = e
             return
-        self.execute()
+        if hasattr(self.executable, 'execute_code_changes'):
+            # Only execute the statements affected by the change
+            self._code_update = True
+            self._update()
+        else:
+            self.execute()
 
     def _defer_execution_changed(self, new):
         if new:
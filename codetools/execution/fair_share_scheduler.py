@@ -0,0 +1,279 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+""" Fair sharing of one executor among many AsyncExecutingContexts.
+
+    Contexts that share an executor directly get its workers first come,
+    first served, so one context with a lot of work delays all the others.
+    A 'FairShareScheduler' sits in front of the executor and hands each
+    context an executor of its own, from 'client()', with a queue of its
+    own. The scheduler keeps at most 'max_workers' tasks in the executor and,
+    when one finishes, starts the next task of:
+
+    * the clients with the highest 'priority' that have work queued,
+    * that run fewer than their 'max_concurrent' tasks,
+    * taking turns (round robin) among those.
+
+    For example::
+
+        scheduler = FairShareScheduler(ThreadPoolExecutor(4), max_workers=4)
+        context = AsyncExecutingContext(
+            subcontext=DataContext(), code=code,
+            executor=scheduler.client('report.py', priority=1))
+
+    Clients count the tasks they queue and the time they wait in the queue
+    ('queue_depth', 'mean_wait_time', ...), and the scheduler sums these up.
+    Tasks still queued can be cancelled through their futures.
+
+    On Python 2 this needs the 'futures' backport of 'concurrent.futures'.
+"""
+from __future__ import absolute_import
+
+from collections import deque
+import threading
+import time
+
+from concurrent.futures import Executor, Future
+from concurrent.futures import wait as wait_for
+
+
+class ScheduledExecutor(Executor):
+    """ The executor of one client of a FairShareScheduler.
+
+    'priority' and 'max_concurrent' can be changed at any time, and apply to
+    the tasks started afterwards.
+
+    """
+
+    def __init__(self, scheduler, name, priority, max_concurrent):
+        self.scheduler = scheduler
+        self.name = name
+
+        # Clients with a higher priority have their tasks started first
+        self.priority = priority
+
+        # The most tasks of the client running at once
+        self.max_concurrent = max_concurrent
+
+        # The number of tasks submitted, started and done
+        self.submitted_count = 0
+        self.started_count = 0
+        self.completed_count = 0
+
+        # The seconds the started tasks waited in the queue, in all and at most
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+        # The number of tasks running
+        self.running_count = 0
+
+        # The (future, fn, args, kwargs, submit time) of the queued tasks
+        self._queue = deque()
+
+        # The futures not done yet
+        self._futures = set()
+
+        self._shutdown = False
+
+    def __repr__(self):
+        return '%s(%r, priority=%r)' % (type(self).__name__, self.name,
+                                        self.priority)
+
+    @property
+    def queue_depth(self):
+        """ The number of tasks waiting to start. """
+        with self.scheduler._lock:
+            return self._queue_depth()
+
+    @property
+    def mean_wait_time(self):
+        """ The mean seconds the started tasks waited in the queue. """
+        with self.scheduler._lock:
+            if self.started_count == 0:
+                return 0.0
+            return self.total_wait_time / self.started_count
+
+    ###########################################################################
+    #### Executor interface
+    ###########################################################################
+
+    def submit(self, fn, *args, **kwargs):
+        return self.scheduler._submit(self, fn, args, kwargs)
+
+    def shutdown(self, wait=True):
+        """ Take no more tasks, and leave the scheduler once the queued ones
+        are done.
+
+        """
+        with self.scheduler._lock:
+            self._shutdown = True
+            self.scheduler._remove_if_idle(self)
+            futures = list(self._futures)
+        if wait:
+            wait_for(futures)
+
+    ###########################################################################
+    #### Private interface
+    ###########################################################################
+
+    def _queue_depth(self):
+        return sum(1 for item in self._queue if not item[0].cancelled())
+
+
+class FairShareScheduler(object):
+    """ Start the tasks of many clients on one executor, fairly.
+
+    See the module docstring.
+
+    """
+
+    def __init__(self, executor, max_workers):
+        # The executor that runs the tasks
+        self.executor = executor
+
+        # The most tasks in the executor at once (its number of workers, or
+        # fewer to leave some to other users)
+        self.max_workers = max_workers
+
+        # The number of tasks running
+        self.running_count = 0
+
+        self._lock = threading.Lock()
+
+        # The clients, in the order they get their turns
+        self._clients = []
+
+    def client(self, name=None, priority=0, max_concurrent=1):
+        """ A new client, as an Executor for one AsyncExecutingContext.
+
+        Parameters
+        ----------
+        name : str, optional
+            for the client's repr
+        priority : int
+            the tasks of the clients with the highest priority start first
+        max_concurrent : int
+            the most tasks of the client running at once
+
+        """
+        client = ScheduledExecutor(self, name, priority, max_concurrent)
+        with self._lock:
+            self._clients.append(client)
+        return client
+
+    @property
+    def clients(self):
+        with self._lock:
+            return list(self._clients)
+
+    @property
+    def queue_depth(self):
+        """ The number of tasks waiting to start. """
+        with self._lock:
+            return sum(client._queue_depth() for client in self._clients)
+
+    @property
+    def mean_wait_time(self):
+        """ The mean seconds the started tasks waited in the queue. """
+        with self._lock:
+            started = sum(client.started_count for client in self._clients)
+            if started == 0:
+                return 0.0
+            return sum(client.total_wait_time
+                       for client in self._clients) / started
+
+    ###########################################################################
+    #### Private interface
+    ###########################################################################
+
+    def _submit(self, client, fn, args, kwargs):
+        future = Future()
+        with self._lock:
+            if client._shutdown:
+                raise RuntimeError('cannot schedule new futures after '
+                                   'shutdown')
+            client._queue.append((future, fn, args, kwargs, time.time()))
+            client._futures.add(future)
+            client.submitted_count += 1
+            tasks = self._next_tasks()
+        self._start(tasks)
+        return future
+
+    def _next_tasks(self):
+        """ Take the tasks to start now off the queues; the lock is held.
+
+        """
+        tasks = []
+        while self.running_count < self.max_workers:
+            client = self._next_client()
+            if client is None:
+                break
+            future, fn, args, kwargs, submitted = client._queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                client._futures.discard(future)
+                self._remove_if_idle(client)
+                continue
+            wait_time = time.time() - submitted
+            client.started_count += 1
+            client.total_wait_time += wait_time
+            client.max_wait_time = max(client.max_wait_time, wait_time)
+            client.running_count += 1
+            self.running_count += 1
+            tasks.append((client, future, fn, args, kwargs))
+        return tasks
+
+    def _next_client(self):
+        """ The client whose turn it is, moved to the end of the turns, or
+        None.
+
+        """
+        ready = [client for client in self._clients if client._queue and
+                 client.running_count < client.max_concurrent]
+        if not ready:
+            return None
+        priority = max(client.priority for client in ready)
+        for client in ready:
+            if client.priority == priority:
+                self._clients.remove(client)
+                self._clients.append(client)
+                return client
+
+    def _start(self, tasks):
+        for task in tasks:
+            try:
+                self.executor.submit(self._run, *task)
+            except Exception as e:
+                # (E.g. the executor was shut down)
+                self._finish(task[0], task[1], exception=e)
+
+    def _run(self, client, future, fn, args, kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(client, future, exception=e)
+        else:
+            self._finish(client, future, result=result)
+
+    def _finish(self, client, future, result=None, exception=None):
+        with self._lock:
+            client.running_count -= 1
+            client.completed_count += 1
+            client._futures.discard(future)
+            self.running_count -= 1
+            self._remove_if_idle(client)
+            tasks = self._next_tasks()
+        # (Done callbacks may submit more work: run them without the lock)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+        self._start(tasks)
+
+    def _remove_if_idle(self, client):
+        if client._shutdown and not client._queue and \
+                client.running_count == 0 and client in self._clients:
+            self._clients.remove(client)
@@ -0,0 +1,44 @@
+#
+# (C) Copyright 2013 Enthought, Inc., Austin, TX
+# All right reserved.
+#
+# This file is open source software distributed according to the terms in
+# LICENSE.txt
+#
+from __future__ import absolute_import
+
+from traits.api import Instance, List, Str, on_trait_change, provides
+
+from codetools.blocks.memoize import Memoizer
+from codetools.execution.interfaces import IExecutable
+from codetools.execution.restricting_code_executable import (
+        RestrictingCodeExecutable)
+
+@provides(IExecutable)
+class MemoizingCodeExecutable(RestrictingCodeExecutable):
+    """ IExecutable that restricts like RestrictingCodeExecutable, and skips
+    the statements whose inputs are unchanged since they last ran, assigning
+    their previous outputs again instead.
+
+    See codetools.blocks.memoize for what can be memoized.
+
+    """
+
+    # Remembers the outputs of past executions of statements
+    memoizer = Instance(Memoizer, ())
+
+    # Names whose statements must always execute (e.g. because they have side
+    # effects that the memoizer can't see)
+    impure_outputs = List(Str)
+
+    def _execute_block(self, block, context, globals, cancelled=None):
+        self.memoizer.execute(block, context, globals, cancelled=cancelled)
+
+    @on_trait_change('_block, impure_outputs[]')
+    def _mark_impure(self):
+        if self._block is None:
+            return
+        impure = set(self.impure_outputs)
+        for sub_block in self._block.sub_blocks or [self._block]:
+            self.memoizer.mark_impure(sub_block,
+                                      bool(sub_block.all_outputs & impure))
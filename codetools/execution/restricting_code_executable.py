@@ -7,9 +7,15 @@
 #
 from __future__ import absolute_import
 
-from traits.api import (HasStrictTraits, Str, provides, Instance,
+from compiler.ast import From, Import
+from functools import partial
+import threading
+
+from traits.api import (Any, HasStrictTraits, Str, provides, Instance,
         adapt, on_trait_change)
-from codetools.blocks.block import Block
+from codetools.blocks.block import Block, ExecutionCancelled
+from codetools.blocks.parallel import connected_components, execute_components
+from codetools.blocks.reparse import affected_sub_blocks
 from codetools.execution.interfaces import IExecutable
 from codetools.contexts.i_context import IContext
 
@@ -26,7 +32,18 @@ class RestrictingCodeExecutable(HasStrictTraits):
     # The block that handles code restriction
     _block = Instance(Block)
 
-    def execute(self, context, globals=None, inputs=None, outputs=None):
+    # The sub-blocks of '_block' added by changes to the code since the whole
+    # block last executed, or None if the whole block must execute
+    _changed_blocks = Any
+
+    # The names bound by the sub-blocks removed by these changes
+    _removed_names = Instance(set, ())
+
+    # Guards the changes, which the code can get while the block executes
+    _changes_lock = Instance(threading.Lock, (), transient=True)
+
+    def execute(self, context, globals=None, inputs=None, outputs=None,
+                cancelled=None, executor=None):
         """ Execute code in context, optionally restricting on inputs or
         outputs if supplied
 
@@ -36,6 +53,13 @@ class RestrictingCodeExecutable(HasStrictTraits):
         globals : Dict-like, optional
         inputs : List of strings, options
         outputs : List of strings, optional
+        cancelled : callable, optional
+            called between statements; if it returns True, the names the
+            executed statements bound are restored and ExecutionCancelled
+            is raised
+        executor : concurrent.futures.Executor, optional
+            runs the independent parts of the (restricted) code concurrently
+            (see codetools.blocks.parallel.execute_components)
 
         Returns
         -------
@@ -57,11 +81,157 @@ class RestrictingCodeExecutable(HasStrictTraits):
         #If called with no inputs or outputs the full block executes
         if inputs or outputs:
             block = self._block.restrict(inputs=inputs, outputs=outputs)
+            self._execute_cancellable(block, icontext, globals, cancelled,
+                                      executor)
+            return block.inputs, block.outputs
+
+        block, changed, removed = self._take_changes()
+        try:
+            self._execute_cancellable(block, icontext, globals, cancelled,
+                                      executor)
+        except Exception:
+            self._restore_changes(changed, removed)
+            raise
+        return block.inputs, block.outputs
+
+    def execute_code_changes(self, context, globals=None, inputs=(),
+                             cancelled=None, executor=None):
+        """ Bring context up to date after changes to the code, executing
+        only the statements that changed and those that depend on them (or
+        on the names in inputs).
+
+        Parameters
+        ----------
+        context : Dict-like
+        globals : Dict-like, optional
+        inputs : List of strings, optional
+            names changed in context since the code last executed
+        cancelled : callable, optional
+            as for execute
+        executor : concurrent.futures.Executor, optional
+            as for execute
+
+        Returns
+        -------
+        inputs : set
+            the inputs to the executed block
+        outpus : set
+            the outputs of the executed block
+
+        """
+        if self._changed_blocks is None:
+            return self.execute(context, globals, cancelled=cancelled,
+                                executor=executor)
+
+        icontext = adapt(context, IContext)
+        if globals is None:
+            globals = {}
+
+        whole, changed, removed = self._take_changes()
+        if changed or removed or inputs:
+            sub_blocks = affected_sub_blocks(whole, changed, inputs, removed)
         else:
-            block = self._block
-        block.execute(icontext, global_context=globals)
+            sub_blocks = []
+        block = Block(sub_blocks)
+        try:
+            self._execute_cancellable(block, icontext, globals, cancelled,
+                                      executor)
+        except Exception:
+            self._restore_changes(changed, removed)
+            raise
         return block.inputs, block.outputs
 
+    def _take_changes(self):
+        """ The block and its changes to execute, leaving none pending
+
+        Changes to the code made while the block executes are thus kept for
+        the next execution.
+
+        """
+        with self._changes_lock:
+            changes = self._block, self._changed_blocks, self._removed_names
+            self._changed_blocks = []
+            self._removed_names = set()
+        return changes
+
+    def _restore_changes(self, changed, removed):
+        """ Put back the changes of an execution that failed """
+        with self._changes_lock:
+            if changed is None or self._changed_blocks is None:
+                self._changed_blocks = None
+            else:
+                kept = set(self._block.sub_blocks or [self._block])
+                self._changed_blocks = [b for b in changed if b in kept] + \
+                                       self._changed_blocks
+            self._removed_names |= removed
+
+    def _execute_block(self, block, context, globals, cancelled=None):
+        """ Execute the (restricted) block in context """
+        block.execute(context, global_context=globals, cancelled=cancelled)
+
+    def _execute_components(self, block, context, globals, cancelled,
+                            executor):
+        """ Execute the independent parts of the block concurrently """
+        # Imports would join the parts using the same modules: run them first
+        imports = [b for b in block.sub_blocks
+                   if isinstance(b.ast, (Import, From))]
+        others = [b for b in block.sub_blocks
+                  if not isinstance(b.ast, (Import, From))]
+        indices = connected_components(others, block._dep_graph)
+        if len(indices) < 2:
+            self._execute_block(block, context, globals, cancelled)
+            return
+
+        if imports:
+            self._execute_block(Block(imports), context, globals, cancelled)
+        components = [Block([others[i] for i in component])
+                      for component in indices]
+        execute_components(
+            components, context,
+            lambda b, namespace: self._execute_block(b, namespace, globals,
+                                                     cancelled),
+            executor)
+
+    def _execute_cancellable(self, block, context, globals, cancelled,
+                             executor=None):
+        """ Execute the block, undoing its assignments if it's cancelled """
+        if executor is not None:
+            execute = partial(self._execute_components, executor=executor)
+        else:
+            execute = self._execute_block
+        if cancelled is None:
+            execute(block, context, globals, None)
+            return
+
+        # (Changes to the attributes or items of objects can't be undone)
+        names = [name for name in block.all_outputs | block.fromimports
+                 if '.' not in name]
+        saved = dict((name, context[name]) for name in names
+                     if name in context)
+        try:
+            execute(block, context, globals, cancelled)
+        except ExecutionCancelled:
+            for name in names:
+                if name in saved:
+                    if context.get(name) is not saved[name]:
+                        context[name] = saved[name]
+                elif name in context:
+                    del context[name]
+            raise
+
     @on_trait_change('code')
     def _code_changed(self, new):
-        self._block = Block(new)
+        if self._block is None:
+            self._block = Block(new)
+            self._changed_blocks = None
+            return
+
+        # Reuse the statements that didn't change
+        block, changed, removed = self._block.reparse(new)
+        with self._changes_lock:
+            if self._changed_blocks is not None:
+                kept = set(block.sub_blocks or [block])
+                self._changed_blocks = [b for b in self._changed_blocks
+                                        if b in kept] + changed
+                self._removed_names |= removed
+            self._block = block
@@ -1,4 +1,5 @@
 import sys
+import threading
 import time
 if sys.version_info[:2] < (2, 7):
     import unittest2 as unittest
@@ -118,6 +119,41 @@ class TestAsyncExecutingContext(unittest.TestCase):
         self.assertEqual(len(self.exceptions), 1)
         self.assertEqual(ZeroDivisionError, type(self.exceptions[0]))
 
+    def test_code_change(self):
+        d = DataContext()
+        d['a'] = 1
+        d['b'] = 3
+        d['g'] = 5
+        rce = RestrictingCodeExecutable(code=CODE)
+        ec = AsyncExecutingContext(subcontext=d, executable=rce)
+        ec.execute()
+        ec._wait()
+        ec.on_trait_change(self._items_modified_fired, 'items_modified')
+
+        # Only the statements downstream of the edit execute
+        ec.code = CODE.replace('d = c + 5', 'd = c + 6')
+        ec._wait()
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0].modified, ['d'])
+        self.assertEqual(ec['d'], 10)
+
+    def test_code_change_with_assignment(self):
+        d = DataContext()
+        d['a'] = 1
+        d['b'] = 3
+        d['g'] = 5
+        rce = RestrictingCodeExecutable(code=CODE)
+        ec = AsyncExecutingContext(subcontext=d, executable=rce)
+        ec.execute()
+        ec._wait()
+
+        ec.defer_execution = True
+        ec.code = CODE.replace('d = c + 5', 'd = c + 6')
+        ec['g'] = 10
+        ec.defer_execution = False
+        ec._wait()
+        self.assertEqual((ec['c'], ec['d'], ec['f']), (4, 10, 11))
+
     def test_items_modified_fired(self):
         self.ec.on_trait_change(self._items_modified_fired, 'items_modified')
         self.ec['a'] = 6
@@ -125,6 +161,150 @@ class TestAsyncExecutingContext(unittest.TestCase):
         self.assertEqual(self.events[0].modified, ['a'])
         self.assertEqual(self.events[1].added, ['c'])
 
+    def test_event_context_snapshots(self):
+        self.ec.on_trait_change(self._items_modified_fired, 'items_modified')
+        self.ec.defer_execution = True
+        self.ec['a'] = 6
+        self.ec['x'] = 1
+        first, second = [event.context for event in self.events]
+        self.assertEqual(dict(first), dict(a=6, b=2))
+        self.assertEqual(dict(second), dict(a=6, b=2, x=1))
+        self.assertEqual(len(second), 3)
+        self.assertNotIn('c', second)
+
+        # The snapshots read through to the subcontext until it changes
+        self.assertIs(first._context, self.ec.subcontext)
+        self.ec.defer_execution = False
+        self.ec._wait()
+        self.assertEqual(self.ec['c'], 8)
+        self.assertIs(first._context, second._context)
+        self.assertEqual(dict(second), dict(a=6, b=2, x=1))
+
+    def test_snapshots_during_execution(self):
+        started, resume = threading.Event(), threading.Event()
+        d = DataContext()
+        d.update(a=0, started=started, resume=resume)
+        code = 'x = started.set() or resume.wait(5) and a\nc = x + 10\n'
+        ec = AsyncExecutingContext(
+            subcontext=d, executable=RestrictingCodeExecutable(code=code))
+        resume.set()
+        ec.execute()
+        ec._wait()
+
+        started.clear()
+        resume.clear()
+        ec['a'] = 1
+        started.wait(5)
+        ec.on_trait_change(self._items_modified_fired, 'items_modified')
+        ec['y'] = 5
+        resume.set()
+        ec._wait()
+        self.assertEqual(ec['c'], 11)
+
+        # The snapshot doesn't change as the execution goes on
+        snapshot = self.events[0].context
+        self.assertEqual((snapshot['a'], snapshot['c'], snapshot['y']),
+                         (1, 10, 5))
+
+    def test_quiet_period(self):
+        self.ec.quiet_period = 0.05
+        for i in xrange(10):
+            self.ec['a'] = i
+        self.ec._wait()
+        self.assertEqual(self.ec['c'], 11)
+        self.assertEqual(self.ec.execution_count, 1)
+        self.assertEqual(self.ec.update_count, 10)
+        self.assertEqual(self.ec.coalesced_update_count, 9)
+
+    def test_max_latency(self):
+        self.ec.quiet_period = 60.0
+        self.ec.max_latency = 0.05
+        start = time.time()
+        self.ec['a'] = 5
+        self.ec['a'] = 6
+        self.ec._wait()
+        self.assertLess(time.time() - start, 10.0)
+        self.assertEqual(self.ec['c'], 8)
+        self.assertEqual(self.ec.execution_count, 1)
+
+    def test_min_interval(self):
+        self.ec.min_interval = 0.1
+        start = time.time()
+        self.ec['a'] = 5
+        self.ec._wait()
+        self.ec['a'] = 6
+        self.ec._wait()
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        self.assertEqual(self.ec['c'], 8)
+        self.assertEqual(self.ec.execution_count, 2)
+
+    def test_cancel_superseded(self):
+        d = DataContext()
+        d['a'] = 0
+        code = 'import time\nx = a\ny = time.sleep(0.2 + 0 * a)\nz = x\n'
+        rce = RestrictingCodeExecutable(code=code)
+        ec = AsyncExecutingContext(subcontext=d, executable=rce,
+                                   cancel_superseded=True)
+        ec['a'] = 1
+        time.sleep(0.05)
+        ec['a'] = 2
+        ec._wait()
+        self.assertEqual((ec['x'], ec['z']), (2, 2))
+        self.assertEqual(ec.cancelled_execution_count, 1)
+        self.assertEqual(ec.execution_count, 2)
+
+        # The cancelled execution fires no event for the names it restored:
+        # only the assignments and the execution that completed do
+        ec.on_trait_change(self._items_modified_fired, 'items_modified')
+        ec['a'] = 3
+        time.sleep(0.05)
+        ec['a'] = 4
+        ec._wait()
+        self.assertEqual(ec.cancelled_execution_count, 2)
+        self.assertEqual(len(self.events), 3)
+        self.assertEqual(sorted(self.events[2].modified),
+                         ['time', 'x', 'y', 'z'])
+
+    def test_code_change_during_execution(self):
+        started, resume = threading.Event(), threading.Event()
+        d = DataContext()
+        d.update(a=1, started=started, resume=resume)
+        code = 'b = started.set() or resume.wait(5) and a\nc = b + 1\n'
+        rce = RestrictingCodeExecutable(code=code)
+        ec = AsyncExecutingContext(subcontext=d, executable=rce)
+        resume.set()
+        ec.execute()
+        ec._wait()
+
+        # Edit the code again while the first edit executes
+        started.clear()
+        resume.clear()
+        code = code.replace('and a', 'and a * 2')
+        ec.code = code
+        started.wait(5)
+        ec.code = code.replace('c = b + 1', 'c = b + 100')
+        resume.set()
+        ec._wait()
+        self.assertEqual(ec['c'], 102)
+
+    def test_concurrent_components(self):
+        d = DataContext()
+        d.update(first=threading.Event(), second=threading.Event(), a=0, b=0)
+        # Each chain waits for the other to start
+        code = ('x = first.set() or second.wait(5) and a\n'
+                'y = second.set() or first.wait(5) and b\n'
+                'z = x + 1\n'
+                'w = y + 1\n')
+        rce = RestrictingCodeExecutable(code=code)
+        ec = AsyncExecutingContext(subcontext=d, executable=rce,
+                                   concurrent_components=True)
+        ec.on_trait_change(self._items_modified_fired, 'items_modified')
+        ec.execute()
+        ec._wait()
+        self.assertEqual((ec['z'], ec['w']), (1, 1))
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(sorted(self.events[0].added), ['w', 'x', 'y', 'z'])
+
     def _items_modified_fired(self, event):
         self.events.append(event)
 
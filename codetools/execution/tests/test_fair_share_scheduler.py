@@ -0,0 +1,119 @@
+import sys
+import threading
+if sys.version_info[:2] < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from codetools.contexts.api import DataContext
+from codetools.execution.async_executing_context import AsyncExecutingContext
+from codetools.execution.fair_share_scheduler import FairShareScheduler
+
+
+class TestFairShareScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.order = []
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def task(self, name):
+        return lambda: self.order.append(name)
+
+    def blocked(self, scheduler, client):
+        """ Occupy all the workers of 'scheduler' until the event is set. """
+        gate = threading.Event()
+        futures = [client.submit(gate.wait, 5)
+                   for i in range(scheduler.max_workers)]
+        return gate, futures
+
+    def test_round_robin(self):
+        scheduler = FairShareScheduler(self.executor, max_workers=1)
+        heavy = scheduler.client('heavy')
+        light = scheduler.client('light')
+        gate, futures = self.blocked(scheduler, heavy)
+        futures += [heavy.submit(self.task('a%d' % i)) for i in range(3)]
+        futures += [light.submit(self.task('b%d' % i)) for i in range(2)]
+        self.assertEqual((heavy.queue_depth, light.queue_depth), (3, 2))
+        self.assertEqual(scheduler.queue_depth, 5)
+        gate.set()
+        [f.result() for f in futures]
+        self.assertEqual(self.order, ['b0', 'a0', 'b1', 'a1', 'a2'])
+        self.assertEqual(scheduler.queue_depth, 0)
+
+    def test_priority(self):
+        scheduler = FairShareScheduler(self.executor, max_workers=1)
+        low = scheduler.client('low')
+        high = scheduler.client('high', priority=1)
+        gate, futures = self.blocked(scheduler, low)
+        futures += [low.submit(self.task('low')) for i in range(2)]
+        futures += [high.submit(self.task('high')) for i in range(2)]
+        gate.set()
+        [f.result() for f in futures]
+        self.assertEqual(self.order, ['high', 'high', 'low', 'low'])
+
+    def test_max_concurrent(self):
+        scheduler = FairShareScheduler(self.executor, max_workers=2)
+        capped = scheduler.client('capped', max_concurrent=1)
+        other = scheduler.client('other')
+        gate = threading.Event()
+        first = capped.submit(gate.wait, 5)
+        second = capped.submit(self.task('capped'))
+        third = other.submit(self.task('other'))
+        third.result(5)
+        self.assertEqual(self.order, ['other'])
+        self.assertEqual((capped.running_count, capped.queue_depth), (1, 1))
+        gate.set()
+        first.result()
+        second.result()
+        self.assertEqual(self.order, ['other', 'capped'])
+
+    def test_metrics_and_cancellation(self):
+        scheduler = FairShareScheduler(self.executor, max_workers=1)
+        client = scheduler.client()
+        gate, futures = self.blocked(scheduler, client)
+        cancelled = client.submit(self.task('cancelled'))
+        queued = client.submit(self.task('queued'))
+        self.assertTrue(cancelled.cancel())
+        self.assertEqual(client.queue_depth, 1)
+        gate.wait(0.05)
+        gate.set()
+        queued.result()
+        self.assertEqual(self.order, ['queued'])
+        self.assertEqual((client.submitted_count, client.started_count,
+                          client.completed_count), (3, 2, 2))
+        self.assertGreater(client.max_wait_time, 0.04)
+        self.assertGreater(scheduler.mean_wait_time, 0.02)
+
+        client.shutdown()
+        self.assertNotIn(client, scheduler.clients)
+        self.assertRaises(RuntimeError, client.submit, self.task('late'))
+
+    def test_errors(self):
+        scheduler = FairShareScheduler(self.executor, max_workers=1)
+        future = scheduler.client().submit(lambda: 1/0)
+        self.assertRaises(ZeroDivisionError, future.result, 5)
+        self.assertEqual(scheduler.running_count, 0)
+
+    def test_async_executing_contexts(self):
+        scheduler = FairShareScheduler(self.executor, max_workers=1)
+        contexts = []
+        for i in range(3):
+            d = DataContext()
+            d['a'] = i
+            contexts.append(AsyncExecutingContext(
+                subcontext=d, code='b = a * 2',
+                executor=scheduler.client(priority=i)))
+        for ec in contexts:
+            ec['a'] = ec['a'] + 10
+        for ec in contexts:
+            ec._wait()
+        self.assertEqual([ec['b'] for ec in contexts], [20, 22, 24])
+
+
+if __name__ == "__main__":
+    unittest.main()
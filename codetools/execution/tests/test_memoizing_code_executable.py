@@ -0,0 +1,71 @@
+import unittest
+
+from codetools.contexts.data_context import DataContext
+from codetools.execution.executing_context import ExecutingContext
+from codetools.execution.memoizing_code_executable import (
+        MemoizingCodeExecutable)
+
+CODE = """aa = f(a)
+bb = f(b)
+c = a + b + aa + bb
+"""
+
+
+class TestMemoizingCodeExecutable(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.executable = MemoizingCodeExecutable(code=CODE)
+        self.globals = {'f': self.f}
+
+    def context(self):
+        context = DataContext()
+        context.update(a=1, b=10)
+        return context
+
+    def f(self, value):
+        self.calls.append(value)
+        return 2 * value
+
+    def test_execute(self):
+        context = self.context()
+        self.executable.execute(context, self.globals)
+        self.assertEqual(dict(context),
+                         {'a': 1, 'b': 10, 'aa': 2, 'bb': 20, 'c': 33})
+
+    def test_reexecution_skips_unchanged_statements(self):
+        context = self.context()
+        self.executable.execute(context, self.globals)
+        context['a'] = 2
+        self.executable.execute(context, self.globals)
+        context['a'] = 1
+        self.executable.execute(context, self.globals, inputs=['a'])
+        self.assertEqual(self.calls, [1, 10, 2])
+        self.assertEqual(dict(context),
+                         {'a': 1, 'b': 10, 'aa': 2, 'bb': 20, 'c': 33})
+
+    def test_impure_outputs(self):
+        self.executable.impure_outputs = ['bb']
+        context = self.context()
+        self.executable.execute(context, self.globals)
+        self.executable.execute(context, self.globals)
+        self.assertEqual(self.calls, [1, 10, 10])
+
+        # Marks survive code changes
+        self.executable.code = 'bb = f(b)'
+        self.executable.execute(context, self.globals)
+        self.assertEqual(self.calls, [1, 10, 10, 10])
+
+    def test_executing_context(self):
+        context = ExecutingContext(executable=self.executable,
+                                   subcontext=self.context())
+        context.subcontext['f'] = self.f
+        context.execute_for_names(None)
+        context['b'] = 11
+        context['b'] = 10
+        self.assertEqual(self.calls, [1, 10, 11])
+        self.assertEqual(context['c'], 33)
+
+
+if __name__ == '__main__':
+    unittest.main()
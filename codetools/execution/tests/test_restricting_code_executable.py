@@ -4,6 +4,10 @@ if sys.version_info[:2] < (2, 7):
 else:
     import unittest
 
+from concurrent.futures import ThreadPoolExecutor
+
+from codetools.blocks.block import ExecutionCancelled
+from codetools.contexts.api import DataContext
 from codetools.execution.executing_context import ExecutingContext
 from codetools.execution.restricting_code_executable import (
         RestrictingCodeExecutable)
@@ -57,6 +61,120 @@ class TestRestrictingCodeExecutable(unittest.TestCase):
         expected_context = {'a': 1, 'b': 10, 'aa': 2, 'bb': 5, 'c': 18}
         self.assertEqual(self.context, expected_context)
 
+    def test_execute_code_changes(self):
+        self.context = DataContext()
+        self.context.update({'a': 1, 'b': 10})
+
+        # Before the code ever runs, everything runs
+        self.restricting_exec.execute_code_changes(self.context)
+        self.assertEqual(self.context['c'], 33)
+
+        block = self.restricting_exec._block
+        self.restricting_exec.code = CODE.replace('bb = 2 * b', 'bb = 3 * b')
+        self.assertIs(self.restricting_exec._block.sub_blocks[0],
+                      block.sub_blocks[0])
+        self.context['aa'] = 100
+        inputs, outputs = self.restricting_exec.execute_code_changes(
+            self.context)
+        self.assertEqual(outputs, set(['bb', 'c']))
+        expected_context = {'a': 1, 'b': 10, 'aa': 100, 'bb': 30, 'c': 141}
+        self.assertEqual(dict(self.context), expected_context)
+
+        # Nothing changed since
+        inputs, outputs = self.restricting_exec.execute_code_changes(
+            self.context, inputs=['a'])
+        self.assertEqual(outputs, set(['aa', 'c']))
+        self.restricting_exec.execute_code_changes(self.context)
+        self.assertEqual(self.context['aa'], 2)
+
+    def test_execute_code_changes_accumulate(self):
+        self.context = DataContext()
+        self.context.update({'a': 1, 'b': 10})
+        self.restricting_exec.execute(self.context)
+        self.restricting_exec.code = CODE + 'd = c + 1\n'
+        self.restricting_exec.code = CODE.replace('aa = 2 * a\n', '') + \
+                                     'd = c + 2\n'
+        self.context['aa'] = 100
+        self.restricting_exec.execute_code_changes(self.context)
+        self.assertEqual(self.context['c'], 131)
+        self.assertEqual(self.context['d'], 133)
+
+    def test_execute_code_changes_edge_cases(self):
+        # Editing the only statement
+        context = DataContext()
+        context['x'] = 1
+        restricting_exec = RestrictingCodeExecutable(code='a = x + 1\n')
+        restricting_exec.execute(context)
+        restricting_exec.code = 'a = x + 2\n'
+        restricting_exec.execute_code_changes(context)
+        self.assertEqual(context['a'], 3)
+
+        # Removing a statement that rebound a name
+        restricting_exec = RestrictingCodeExecutable(
+            code='f = x + 5\nf = x + 100\n')
+        restricting_exec.execute(context)
+        self.assertEqual(context['f'], 101)
+        restricting_exec.code = 'f = x + 5\n'
+        restricting_exec.execute_code_changes(context)
+        self.assertEqual(context['f'], 6)
+
+    def test_code_changes_during_execution(self):
+        context = DataContext()
+        context.update({'a': 1, 'b': 10})
+        self.restricting_exec.execute(context)
+
+        # The code changes again while its changes execute
+        code = CODE.replace('bb = 2 * b', 'bb = 3 * b')
+        def edit():
+            self.restricting_exec.code = code.replace('c = a + b',
+                                                      'c = 100 + a + b')
+            return False
+        self.restricting_exec.code = code
+        self.restricting_exec.execute_code_changes(context, cancelled=edit)
+        self.assertEqual((context['bb'], context['c']), (30, 43))
+        self.restricting_exec.execute_code_changes(context)
+        self.assertEqual(context['c'], 143)
+
+        # The changes of a failed execution are kept
+        self.restricting_exec.code = CODE.replace('bb = 2 * b', 'bb = 4 * b')
+        context['b'] = None
+        self.assertRaises(TypeError,
+                          self.restricting_exec.execute_code_changes, context)
+        context['b'] = 10
+        self.restricting_exec.execute_code_changes(context)
+        self.assertEqual((context['bb'], context['c']), (40, 53))
+
+    def test_cancellation_restores_names(self):
+        context = DataContext()
+        context.update({'a': 1, 'b': 10, 'aa': 5})
+        self.assertRaises(ExecutionCancelled, self.restricting_exec.execute,
+                          context, cancelled=lambda: 'bb' in context)
+        self.assertEqual(dict(context), {'a': 1, 'b': 10, 'aa': 5})
+
+        self.restricting_exec.execute(context, cancelled=lambda: False)
+        self.assertEqual(context['c'], 33)
+
+    def test_concurrent_components(self):
+        code = ('import math\n'
+                'x = math.sqrt(a)\n'
+                'y = b + 1\n'
+                'z = x + 1\n'
+                'w = y * 2\n')
+        rce = RestrictingCodeExecutable(code=code)
+        context = DataContext()
+        context.update({'a': 4, 'b': 1})
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            rce.execute(context, executor=executor)
+            self.assertEqual((context['z'], context['w']), (3.0, 4))
+
+            # Restricted to one of the components
+            context['b'] = 2
+            rce.execute(context, inputs=['b'], executor=executor)
+            self.assertEqual((context['z'], context['w']), (3.0, 6))
+        finally:
+            executor.shutdown()
+
     def _change_detect(self):
         self.events.append('fired')
 
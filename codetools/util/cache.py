@@ -0,0 +1,113 @@
+'A bounded, least-recently-used cache with usage statistics'
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    ''' A mapping that evicts its least recently used entries.
+
+        The cache is bounded by the number of entries ('max_size') and/or by
+        the total cost of its values ('max_cost', where 'cost(value)' gives the
+        cost of one value). A bound of None means unbounded.
+
+        'get' and 'cached' record hits and misses; all three counters persist
+        across 'clear', which is for invalidation rather than a reset.
+
+        >>> cache = LRUCache(max_size=2)
+        >>> cache['a'] = 1
+        >>> cache['b'] = 2
+        >>> cache.get('a')
+        1
+        >>> cache['c'] = 3
+        >>> sorted(cache.keys())
+        ['a', 'c']
+        >>> cache.get('b') is None
+        True
+        >>> (cache.hits, cache.misses, cache.evictions)
+        (1, 1, 1)
+
+        >>> cache = LRUCache(max_cost=5, cost=len)
+        >>> cache['a'] = 'xxx'
+        >>> cache['b'] = 'yyy'
+        >>> list(cache.keys()), cache.total_cost
+        (['b'], 3)
+    '''
+
+    def __init__(self, max_size=None, max_cost=None, cost=None):
+        self._data = OrderedDict()
+        self._costs = {}
+        self.max_size = max_size
+        self.max_cost = max_cost
+        self.cost = cost
+        self.total_cost = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    ###########################################################################
+    # LRUCache interface
+    ###########################################################################
+
+    def get(self, key, default=None):
+        ''' Look up 'key', counting a hit or a miss. '''
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def trim(self):
+        ''' Evict entries until the cache is within its bounds. '''
+        while self._data and (
+            (self.max_size is not None and len(self._data) > self.max_size) or
+            (self.max_cost is not None and self.total_cost > self.max_cost)):
+            key = next(iter(self._data))
+            del self[key]
+            self.evictions += 1
+
+    def info(self):
+        ''' A dictionary summarizing the cache and its usage. '''
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, size=len(self._data),
+                    max_size=self.max_size, cost=self.total_cost,
+                    max_cost=self.max_cost)
+
+    ###########################################################################
+    # Mapping interface
+    ###########################################################################
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            del self[key]
+        self._data[key] = value
+        if self.cost is not None:
+            self._costs[key] = self.cost(value)
+            self.total_cost += self._costs[key]
+        self.trim()
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self.total_cost -= self._costs.pop(key, 0)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def keys(self):
+        return list(self._data)
+
+    def clear(self):
+        self._data.clear()
+        self._costs.clear()
+        self.total_cost = 0
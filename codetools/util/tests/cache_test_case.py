@@ -0,0 +1,41 @@
+import unittest
+from traits.testing.api import doctest_for_module
+import codetools.util.cache as cache
+from codetools.util.cache import LRUCache
+
+class CacheDocTestCase(doctest_for_module(cache)):
+    pass
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_recently_used_entries_survive(self):
+        c = LRUCache(max_size=3)
+        for key in 'abc':
+            c[key] = key
+        c.get('a')
+        c['d'] = 'd'
+        self.assertEqual(sorted(c.keys()), ['a', 'c', 'd'])
+        self.assertEqual(c.evictions, 1)
+
+    def test_shrinking_bounds(self):
+        c = LRUCache(max_cost=10, cost=len)
+        c['a'] = 'xxxx'
+        c['b'] = 'yyyy'
+        c.max_cost = 5
+        c.trim()
+        self.assertEqual(c.keys(), ['b'])
+        self.assertEqual(c.total_cost, 4)
+
+    def test_clear_keeps_statistics(self):
+        c = LRUCache()
+        c['a'] = 1
+        c.get('a')
+        c.get('b')
+        c.clear()
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.info()['hits'], 1)
+        self.assertEqual(c.info()['misses'], 1)
+
+if __name__ == '__main__':
+    import sys
+    unittest.main(argv=sys.argv)
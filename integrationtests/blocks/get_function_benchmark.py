@@ -0,0 +1,42 @@
+""" Compare the functions made by Block.get_function with executing the
+    restricted block in a namespace, as get_function used to do.
+
+    Usage: python get_function_benchmark.py [calls]
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+from codetools.blocks.api import Block
+
+CODE = """
+c = a + b
+d = c * c - a
+e = d / (b + 1.0) if d > 0 else -d
+f = max(c, d, e)
+"""
+
+
+def main(calls=100000):
+    block = Block(CODE)
+    inputs, outputs = ['a', 'b'], ['f']
+    compiled = block.get_function(inputs, outputs)
+    namespace = block._namespace_function(
+        block.restrict(inputs=inputs, outputs=outputs), inputs, outputs)
+    assert compiled(3, 4) == namespace(3, 4)
+
+    print('%d calls' % calls)
+    print('%20s %12s %14s' % ('', 'time (s)', 'per call (us)'))
+    results = []
+    for name, function in [('namespace', namespace), ('compiled', compiled)]:
+        t = min(timeit.repeat(lambda: function(3, 4), number=calls,
+                              repeat=3))
+        results.append(t)
+        print('%20s %12.4f %14.2f' % (name, t, 1e6 * t / calls))
+    print('Speedup: %.1fx' % (results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
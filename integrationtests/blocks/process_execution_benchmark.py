@@ -0,0 +1,79 @@
+""" Compare Block.execute with Block.execute_processes.
+
+    Runs a block of independent, GIL-bound statements of increasing cost both
+    ways and reports the statement cost at which the process pool starts to
+    win. A second table does the same for statements reading a large array,
+    which goes through shared memory.
+
+    Usage: python process_execution_benchmark.py [workers]
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+
+from codetools.blocks.api import Block
+
+
+def best_time(f, repeat=3):
+    return min(timeit.repeat(f, number=1, repeat=repeat))
+
+
+def compare(block, context, executor):
+    serial = best_time(lambda: block.execute(dict(context)))
+    parallel = best_time(lambda: block.execute_processes(
+        dict(context), executor=executor))
+    return serial, parallel
+
+
+def report(title, rows):
+    print(title)
+    print('%12s %12s %14s %9s' % ('size', 'serial (s)', 'processes (s)',
+                                  'speedup'))
+    crossover = None
+    for size, serial, parallel in rows:
+        print('%12d %12.4f %14.4f %9.2f' % (size, serial, parallel,
+                                           serial / parallel))
+        if crossover is None and parallel < serial:
+            crossover = size
+    if crossover is None:
+        print('No crossover: serial execution wins at every size\n')
+    else:
+        print('Crossover at size %d\n' % crossover)
+
+
+def main(workers=None):
+    executor = ProcessPoolExecutor(max_workers=workers)
+    statements = 8
+
+    # Pure Python loops: 'size' iterations per statement
+    rows = []
+    for size in (10, 100, 1000, 10000, 100000, 1000000):
+        code = '\n'.join('t%d = sum(i * i for i in range(n))' % k
+                         for k in range(statements))
+        block = Block(code)
+        serial, parallel = compare(block, dict(n=size), executor)
+        rows.append((size, serial, parallel))
+    report('%d independent pure Python statements' % statements, rows)
+
+    # NumPy reductions over one shared input array of 'size' elements
+    rows = []
+    for size in (10**3, 10**4, 10**5, 10**6, 10**7):
+        code = '\n'.join('t%d = (x ** %d).sum()' % (k, k + 1)
+                         for k in range(statements))
+        block = Block(code)
+        serial, parallel = compare(block, dict(x=numpy.random.rand(size)),
+                                   executor)
+        rows.append((size, serial, parallel))
+    report('%d independent NumPy statements on a shared array' % statements,
+           rows)
+
+    executor.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,67 @@
+""" Compare the cost of the sub-blocks of a long script as 'SubBlock's and as
+    'Block's, as they used to be: the time to build them from the parsed
+    statements, the memory they take, and the time to build the whole block.
+
+    Usage: python sub_block_benchmark.py [statements]
+
+    (Memory is the growth of the resident set size, so this needs Linux.)
+"""
+
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import time
+
+from codetools.blocks.api import Block
+from codetools.blocks.compiler_.api import parse
+from codetools.blocks.sub_block import SubBlock
+
+
+def script(statements):
+    return ''.join('x%d = x%d * 2 + %d\n' % (i + 1, i, i)
+                   for i in range(statements))
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def build(kind, nodes):
+    ''' (seconds, bytes) to build and analyze sub-blocks for 'nodes'. '''
+    gc.collect()
+    before = rss()
+    t = time.time()
+    sub_blocks = [kind(node) for node in nodes]
+    for sub_block in sub_blocks:
+        sub_block.inputs
+    t = time.time() - t
+    gc.collect()
+    return t, rss() - before, sub_blocks
+
+
+def main(statements=10000):
+    code = script(statements)
+    nodes = parse(code).node.nodes
+
+    print('%d statements' % statements)
+    print('%20s %12s %16s %18s' % ('', 'time (s)', 'per stmt (us)',
+                                   'per stmt (bytes)'))
+    kept = []
+    for name, kind in [('Block', Block), ('SubBlock', SubBlock)]:
+        t, size, sub_blocks = build(kind, nodes)
+        kept.append(sub_blocks)
+        print('%20s %12.4f %16.1f %18.0f' % (name, t, 1e6 * t / statements,
+                                             float(size) / statements))
+    del kept
+
+    t = time.time()
+    block = Block(code)
+    block.outputs
+    print('Block(code): %.4f s' % (time.time() - t))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)